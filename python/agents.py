@@ -1,46 +1,55 @@
 from typing import Dict, List, Any
 from openai import OpenAI
 import json
-import requests
 import logging
+from database import SessionFactory
+from queries import save_llm_calls
+from utils import llm_client, llm_cache, llm_journal
+from utils.json_stream import find_json_span
 
 class Agent:
-    def __init__(self, api_key: str):
+    model = llm_client.DEFAULT_MODEL
+
+    def __init__(self, api_key: str, use_cache: bool = True):
         self.api_key = api_key  # Store the API key
+        self.use_cache = use_cache
         self.client = OpenAI(api_key=api_key)
         # self.model = "anthropic/claude-3-opus"
         self.logger = logging.getLogger(__name__)
 
     def call_openrouter(self, prompt: str) -> str:
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        data = {
-            "model": self.model,
-            "messages": [{"role": "user", "content": prompt}]
-        }
-        
+        # Called outside a pipeline run, the call is journaled on its own, without a sermon or game
+        if llm_journal.current() is not None:
+            return self._complete(prompt)
+        with llm_journal.collecting() as journal:
+            try:
+                return self._complete(prompt)
+            finally:
+                self._save_journal(journal)
+
+    def _complete(self, prompt: str) -> str:
+        payload = {"model": self.model, "messages": [{"role": "user", "content": prompt}]}
         try:
-            response = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                json=data
+            return llm_cache.cached_completion(
+                payload,
+                lambda: llm_client.message_content(llm_client.get_client().chat(payload, api_key=self.api_key)),
+                stage="agent",
+                use_cache=self.use_cache
             )
-            response.raise_for_status()
-            response_json = response.json()
-            
-            if "choices" not in response_json or not response_json["choices"] or "message" not in response_json["choices"][0]:
-                raise Exception(f"Unexpected API response format: {response_json}")
-                
-            return response_json["choices"][0]["message"]["content"]
-        except requests.exceptions.RequestException as e:
+        except llm_client.LLMClientError as e:
             self.logger.error(f"OpenRouter API request error: {str(e)}")
             raise Exception(f"OpenRouter API error: {str(e)}")
-        except json.JSONDecodeError as e:
-            self.logger.error(f"JSON parsing error: {str(e)}, Response content: {response.text}")
-            raise Exception(f"Failed to parse API response: {str(e)}")
+
+    def _save_journal(self, journal: llm_journal.Journal) -> None:
+        llm_calls = journal.pending()
+        session = SessionFactory()
+        try:
+            save_llm_calls(session, llm_calls)
+            journal.mark_saved(llm_calls)
+        except Exception as e:
+            self.logger.error(f"Could not journal {len(llm_calls)} LLM call(s): {str(e)}")
+        finally:
+            session.close()
 
     def parse_json_response(self, response: str) -> Dict[str, Any]:
         """Safely parse JSON response and handle common formatting issues"""
@@ -52,35 +61,8 @@ class Agent:
             
             # First, check if the response has a preamble text before the JSON
             if fixed_json.startswith("Here is") or fixed_json.startswith("Here's") or "JSON" in fixed_json.split("\n")[0]:
-                # Find the first occurrence of { or [
-                json_start = fixed_json.find('{')
-                array_start = fixed_json.find('[')
-                
-                # Find which comes first (if both exist)
-                if json_start >= 0 and (array_start < 0 or json_start < array_start):
-                    # Find the corresponding closing brace
-                    brace_count = 1
-                    for i in range(json_start + 1, len(fixed_json)):
-                        if fixed_json[i] == '{':
-                            brace_count += 1
-                        elif fixed_json[i] == '}':
-                            brace_count -= 1
-                            
-                        if brace_count == 0:
-                            fixed_json = fixed_json[json_start:i+1]
-                            break
-                elif array_start >= 0:
-                    # Find the corresponding closing bracket
-                    bracket_count = 1
-                    for i in range(array_start + 1, len(fixed_json)):
-                        if fixed_json[i] == '[':
-                            bracket_count += 1
-                        elif fixed_json[i] == ']':
-                            bracket_count -= 1
-                            
-                        if bracket_count == 0:
-                            fixed_json = fixed_json[array_start:i+1]
-                            break
+                # Match the first { or [ with its closing character, ignoring string contents
+                fixed_json = find_json_span(fixed_json) or fixed_json
             
             # Check if the response is wrapped in a code block
             elif fixed_json.startswith("```json"):
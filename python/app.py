@@ -1,25 +1,38 @@
-from flask import Flask, request, jsonify, make_response
+from flask import Flask, Response, g, request, jsonify, make_response
 from flask_cors import CORS
 import os
 from dotenv import load_dotenv
-import requests
 import json
-from typing import List, Dict, Any, Optional
-from pydantic import BaseModel
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Callable, Iterator, Literal, Tuple, Union
+from pydantic import BaseModel, StrictFloat, StrictInt, TypeAdapter
 import pytube
-import PyPDF2
 import magic
-import io
 import tempfile
 import subprocess
 import openai  # Use the old-style import instead of OpenAI class
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from models import Base, Sermon, Game, Question as QuestionModel  # Rename to avoid conflict
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from models import Base, upgrade_schema, Sermon, Game, SermonJob, Question as QuestionModel  # Rename to avoid conflict
+from database import engine, Session, SessionFactory
+from queries import game_json, list_games, llm_usage, save_generated_game, save_llm_calls, DEFAULT_GAME_LIST_FIELDS
 import re
+import hashlib
 import time
 import logging
+import threading
+import queue
+import uuid
+import contextvars
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 # Update the import to include all needed functions
+from utils import llm_client, llm_cache, llm_journal, log_helpers, metrics, rate_governor, structured_output
+from utils.pdf_engine import extract_pdf_text
+from utils.upload_helpers import UploadTooLarge, spool_to_disk, sniff_mime_type, remove_quietly
+from utils.json_stream import find_json_span, iter_json_values
+from utils.text_helpers import estimate_tokens, split_into_sections
+from utils.timing import StageTimer
 from utils.youtube_helpers import (
     download_youtube_audio, 
     validate_youtube_url,
@@ -27,6 +40,9 @@ from utils.youtube_helpers import (
     get_youtube_metadata
 )
 
+# JSON log records tagged with the request id; configured before Flask creates app.logger
+log_helpers.configure_logging()
+
 # Modify Flask app initialization to serve static files with proper permissions
 app = Flask(__name__, static_url_path='', static_folder='static')
 
@@ -40,10 +56,13 @@ CORS(app,
 # Load environment variables
 load_dotenv()
 
-# Database setup
-engine = create_engine('sqlite:///sermon_games.db')
+# Database setup - engine and sessions are configured from DATABASE_URL in database.py
 Base.metadata.create_all(engine)
-Session = sessionmaker(bind=engine)
+upgrade_schema(engine)
+
+@app.teardown_appcontext
+def remove_session(exception=None):
+    Session.remove()
 
 # OpenRouter configuration - get from environment variables with fallback
 OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY", "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")
@@ -53,6 +72,56 @@ OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 if not OPENROUTER_API_KEY or OPENROUTER_API_KEY == "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":
     app.logger.warning("OpenRouter API key not set or using fallback value. API calls will likely fail.")
 
+# Maximum number of concurrent designer calls per sermon
+DESIGNER_MAX_WORKERS = int(os.environ.get("DESIGNER_MAX_WORKERS", "6"))
+
+# Designer mode: 'single' (one call per question) or 'batched' (DESIGNER_BATCH_SIZE questions per call, 0 = all)
+DESIGNER_MODE = os.environ.get("DESIGNER_MODE", "single")
+DESIGNER_BATCH_SIZE = int(os.environ.get("DESIGNER_BATCH_SIZE", "0"))
+
+# Start designing each question while the writer is still streaming the rest (single designer mode only)
+PIPELINE_OVERLAP = os.environ.get("PIPELINE_OVERLAP", "1").lower() in ("1", "true", "yes")
+
+# Longest a pipeline run may take; later stages fail with a 504 and LLM call timeouts are capped to what is left
+PIPELINE_TIMEOUT_SECONDS = int(os.environ.get("PIPELINE_TIMEOUT_SECONDS", "600"))
+
+# Request JSON-schema structured output from the planner, writer and designer and repair invalid fragments
+STRUCTURED_OUTPUT = os.environ.get("STRUCTURED_OUTPUT", "0").lower() in ("1", "true", "yes")
+
+# Sermons estimated above CONDENSE_THRESHOLD_TOKENS are summarized in sections of
+# CONDENSE_CHUNK_TOKENS before planning
+CONDENSE_THRESHOLD_TOKENS = int(os.environ.get("CONDENSE_THRESHOLD_TOKENS", "12000"))
+CONDENSE_CHUNK_TOKENS = int(os.environ.get("CONDENSE_CHUNK_TOKENS", "3000"))
+
+# PDF uploads are spooled to UPLOAD_DIR and capped at UPLOAD_MAX_MB
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "sermon_uploads"))
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_MB", "100")) * 1024 * 1024
+
+# Background job settings for asynchronous sermon processing
+JOB_MAX_WORKERS = int(os.environ.get("JOB_MAX_WORKERS", "4"))
+JOB_STALE_SECONDS = int(os.environ.get("JOB_STALE_SECONDS", "600"))
+
+# A running job refreshes its updated_at this often, so long stages don't make it look stale
+JOB_HEARTBEAT_SECONDS = int(os.environ.get("JOB_HEARTBEAT_SECONDS", "30"))
+
+# Page size for GET /api/games
+GAMES_PAGE_SIZE = int(os.environ.get("GAMES_PAGE_SIZE", "50"))
+GAMES_MAX_PAGE_SIZE = int(os.environ.get("GAMES_MAX_PAGE_SIZE", "200"))
+
+# Interval between keep-alive comments on idle Server-Sent Event streams
+SSE_KEEPALIVE_SECONDS = int(os.environ.get("SSE_KEEPALIVE_SECONDS", "15"))
+
+# Shared LLM connection pool, sized so every designer thread of every concurrent job gets a connection
+LLM_POOL_SIZE = int(os.environ.get("LLM_POOL_SIZE", str(DESIGNER_MAX_WORKERS * (JOB_MAX_WORKERS + 1))))
+llm_client.configure(
+    api_key=OPENROUTER_API_KEY,
+    base_url=OPENROUTER_BASE_URL,
+    pool_size=LLM_POOL_SIZE,
+    http2=os.environ.get("LLM_HTTP2", "").lower() in ("1", "true", "yes")
+)
+if os.environ.get("LLM_PREWARM", "1").lower() in ("1", "true", "yes"):
+    llm_client.prewarm_in_background()
+
 # OpenAI configuration for transcription (using old style API)
 openai.api_key = OPENROUTER_API_KEY
 
@@ -61,113 +130,189 @@ class SermonInput(BaseModel):
     content: str  # URL or text content
     custom_prompt: str = ""
     title: Optional[str] = None
+    use_cache: bool = True  # Set to False to force fresh LLM responses
+    force_regenerate: bool = False  # Set to True to skip reusing a game generated from identical content
+    designer_mode: Optional[Literal['single', 'batched']] = None  # Defaults to DESIGNER_MODE
+    designer_batch_size: Optional[int] = None  # Questions per batched call; 0 sends the whole array
+    structured_output: Optional[bool] = None  # Defaults to STRUCTURED_OUTPUT
 
 class GamePlan(BaseModel):
     theme: str
     main_topics: List[str]
     game_structure: Dict[str, Any]
 
+QuestionType = Literal[
+    'single-answer-multiple-choice',
+    'multiple-answer-multiple-choice',
+    'slider',
+    'single-answer-drag-drop',
+    'multiple-answer-drag-drop',
+    'true-false'
+]
+
+# Slider answers may be numbers; strict so a true/false answer isn't read as 1/0
+Answer = Union[str, StrictInt, StrictFloat]
+
 # Define the Pydantic model with a different name to avoid conflicts
 class QuestionSchema(BaseModel):
     question: str
-    correct_answer: str
-    question_type: str  # 'multiple_choice', 'slider', 'text'
-    options: List[str] = []
+    correct_answer: Union[Answer, List[str]]  # Array for multiple-answer questions
+    question_type: QuestionType
+    fake_answers: List[Answer] = []
     hints: List[str] = []
     learning_points: List[str] = []
+    difficulty: str = "easy"  # easy, medium, or hard
+
+# Adapters are built once at import so validation doesn't rebuild the core schema per call
+GAME_PLAN_ADAPTER = TypeAdapter(GamePlan)
+QUESTION_ADAPTER = TypeAdapter(QuestionSchema)
+QUESTION_LIST_ADAPTER = TypeAdapter(List[QuestionSchema])
+GAME_PLAN_FORMAT = structured_output.response_format("game_plan", GAME_PLAN_ADAPTER)
+QUESTION_FORMAT = structured_output.response_format("question", QUESTION_ADAPTER)
+QUESTION_LIST_FORMAT = structured_output.response_format("questions", QUESTION_LIST_ADAPTER)
+
+def call_openrouter(prompt: str, model: str = "google/gemini-2.0-flash-001",
+                    stage: Optional[str] = None, use_cache: bool = True,
+                    response_format: Optional[Dict[str, Any]] = None,
+                    validate: Optional[llm_cache.Validator] = None) -> str:
+    """
+    Send a prompt to OpenRouter. Identical requests are answered from the LLM
+    cache (TTL chosen by stage) unless use_cache is False. response_format is
+    passed through to request structured (JSON-schema) output. A response that
+    fails validate (see json_reply) is returned but not cached.
+    """
+    payload = openrouter_payload(prompt, model, response_format)
+
+    def fetch() -> str:
+        app.logger.debug("Calling OpenRouter API", extra={"model": model, "stage": stage})
+        # Goes through the shared keep-alive client; 120 s timeout prevents hanging requests
+        response_data = llm_client.get_client().chat(payload, timeout=120)
+        log_helpers.log_payload(app.logger, "OpenRouter API response", model=model, stage=stage, response=response_data)
+        return llm_client.message_content(response_data)
 
-def call_openrouter(prompt: str, model: str = "google/gemini-2.0-flash-001") -> str:
-    # Add timeout to prevent hanging requests
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "https://jesustech-hackathon.com",  # Adding a referer can help with API auth
-        "X-Title": "JesusTech Hackathon"  # Adding application info
-    }
-    
-    data = {
-        "model": model,
-        "messages": [{"role": "user", "content": prompt}]
-    }
-    
     try:
-        app.logger.debug(f"Calling OpenRouter API with model: {model}")
-        # Increase timeout parameter to prevent early timeouts
-        response = requests.post(
-            f"{OPENROUTER_BASE_URL}/chat/completions",
-            headers=headers,
-            json=data,
-            timeout=120  # Increase timeout to 120 seconds
-        )
-        
-        # Log API response status for debugging
-        app.logger.debug(f"OpenRouter API response status: {response.status_code}")
-        
-        # Handle common auth errors
-        if response.status_code == 401:
-            app.logger.error("OpenRouter API authorization failed. Please check your API key.")
-            raise Exception("API authorization failed. Please check your API key and ensure it's valid.")
-        elif response.status_code == 403:
-            app.logger.error("OpenRouter API access forbidden. Your account may have restrictions.")
-            raise Exception("API access forbidden. Your account may have restrictions.")
-            
-        response.raise_for_status()
-        response_data = response.json()
-        
-        # Log response for debugging
-        app.logger.debug(f"OpenRouter API response: {response_data}")
-        
-        if "choices" not in response_data or not response_data["choices"] or "message" not in response_data["choices"][0]:
-            raise Exception(f"Unexpected API response format: {response_data}")
-            
-        return response_data["choices"][0]["message"]["content"]
-    except requests.exceptions.RequestException as e:
-        app.logger.error(f"OpenRouter API request error: {str(e)}")
-        
-        # Add more detailed error handling for common issues
-        if "401" in str(e):
-            raise Exception("API key unauthorized. Please check your API key or generate a new one.")
-        elif "429" in str(e):
-            raise Exception("API rate limit exceeded. Please try again later.")
-        else:
-            raise Exception(f"OpenRouter API error: {str(e)}")
-    except json.JSONDecodeError as e:
-        app.logger.error(f"JSON parsing error: {str(e)}, Response content: {response.text}")
-        raise Exception(f"Failed to parse API response: {str(e)}")
+        return llm_cache.cached_completion(payload, fetch, stage=stage, use_cache=use_cache, validate=validate)
+    except llm_client.LLMClientError as e:
+        raise openrouter_error(e)
     except Exception as e:
         app.logger.error(f"Unexpected error in call_openrouter: {str(e)}")
         raise
 
-def extract_text_from_youtube(youtube_url):
+def openrouter_payload(prompt: str, model: str, response_format: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Chat completion request body for a single user prompt; also the LLM cache key input."""
+    payload = {"model": model, "messages": [{"role": "user", "content": prompt}]}
+    if response_format is not None:
+        payload["response_format"] = response_format
+    return payload
+
+def openrouter_error(e: llm_client.LLMClientError) -> Exception:
+    """Translate a client error into the user-facing exception raised by the pipeline."""
+    app.logger.error(f"OpenRouter API request error: {str(e)}")
+    
+    # Add more detailed error handling for common issues
+    if e.status_code == 401:
+        app.logger.error("OpenRouter API authorization failed. Please check your API key.")
+        return Exception("API authorization failed. Please check your API key and ensure it's valid.")
+    elif e.status_code == 403:
+        app.logger.error("OpenRouter API access forbidden. Your account may have restrictions.")
+        return Exception("API access forbidden. Your account may have restrictions.")
+    elif e.status_code == 429:
+        return Exception("API rate limit exceeded. Please try again later.")
+    elif e.timed_out:
+        return Exception("OpenRouter did not respond in time. Please try again later.")
+    elif e.status_code is None and str(e).startswith(("Failed to parse", "Unexpected API response")):
+        return Exception(str(e))
+    else:
+        return Exception(f"OpenRouter API error: {str(e)}")
+
+def stream_openrouter_json(prompt: str, model: str = "google/gemini-2.0-flash-001",
+                           stage: Optional[str] = None, use_cache: bool = True,
+                           response_format: Optional[Dict[str, Any]] = None,
+                           validate: Optional[llm_cache.Validator] = None) -> Iterator[Any]:
     """
-    Extract video ID from YouTube URL and generate content based on it using LLM
-    instead of downloading and transcribing.
+    Stream a completion whose answer is a JSON array and yield each element as
+    soon as it closes. Shares cache entries with call_openrouter: a hit is
+    replayed through the same parser, and only a stream that parsed to the end
+    of its array and passes validate is stored; a cached entry that fails
+    validate is evicted and fetched again. A stream cut off before its array
+    closed raises ValueError after the elements that did arrive, and is not stored.
     """
-    try:
-        # Validate the YouTube URL first
-        if not validate_youtube_url(youtube_url):
-            raise ValueError("Invalid YouTube URL format. Please provide a valid YouTube URL (e.g., https://www.youtube.com/watch?v=xxxx)")
-            
-        # Log the YouTube URL being processed
-        app.logger.info(f"Processing YouTube URL: {youtube_url}")
-        
-        # Get video ID without downloading
-        video_id = get_youtube_video_id(youtube_url)
-        app.logger.info(f"Extracted YouTube video ID: {video_id}")
-        
-        # Try to get some metadata about the video
+    payload = openrouter_payload(prompt, model, response_format)
+    with llm_journal.track(model, stage, use_cache) as call:
+        cache = llm_cache.get_cache() if use_cache else None
+        key = llm_cache.cache_key(payload)
+        cached = cache.get(key, stage) if cache is not None else None
+        if cached is not None and not llm_cache.usable(cached, validate):
+            app.logger.info("Evicting unparseable LLM cache entry for stage %s", stage or 'default')
+            cache.delete(key)
+            cached = None
+        if cached is not None:
+            call["cache_status"] = "hit"
+            try:
+                yield from iter_json_values([cached], require_array=True)
+            except ValueError:
+                # Only fully parsed streams are stored, but never replay one that fails
+                cache.delete(key)
+                raise
+            return
+        if cache is None:
+            call["cache_status"] = "bypass"
+
+        received: List[str] = []
+        def chunks() -> Iterator[str]:
+            stream = llm_client.get_client().stream(
+                payload, timeout=120, on_usage=lambda chunk: llm_journal.apply_usage(call, chunk)
+            )
+            for chunk in stream:
+                received.append(chunk)
+                yield chunk
+
+        app.logger.debug("Streaming OpenRouter API", extra={"model": model, "stage": stage})
         try:
-            metadata = get_youtube_metadata(video_id)
-            video_title = metadata.get("title", "Unknown video")
-            video_description = metadata.get("description", "")
-            app.logger.info(f"Video title: {video_title}")
-        except Exception as e:
-            app.logger.warning(f"Failed to get video metadata: {str(e)}")
-            video_title = "Unknown video"
-            video_description = ""
+            yield from iter_json_values(chunks(), require_array=True)
+        except llm_client.LLMClientError as e:
+            raise openrouter_error(e)
+        except ValueError as e:
+            app.logger.warning(f"Discarding streamed {stage or 'default'} response: {str(e)}")
+            raise
+        # iter_json_values returns only once the array has closed, so completion is the whole answer
+        completion = "".join(received)
+        log_helpers.log_payload(app.logger, "OpenRouter API streamed response", model=model, stage=stage, response=completion)
+        # The stream is closed once the array ends, usually before the usage chunk arrives
+        llm_journal.estimate_usage(call, payload, completion)
+        if cache is not None and llm_cache.usable(completion, validate):
+            cache.set(key, completion, stage)
+
+def youtube_summary_prompt(youtube_url: str) -> str:
+    """
+    Validate a YouTube URL and build the prompt that has the LLM summarize the
+    video from its id and metadata. Fetching the metadata blocks on the network.
+    """
+    # Validate the YouTube URL first
+    if not validate_youtube_url(youtube_url):
+        raise ValueError("Invalid YouTube URL format. Please provide a valid YouTube URL (e.g., https://www.youtube.com/watch?v=xxxx)")
         
-        # Generate content based on video ID using LLM
-        prompt = f"""
+    # Log the YouTube URL being processed
+    app.logger.info("Processing YouTube URL: %s", youtube_url)
+    
+    # Get video ID without downloading
+    video_id = get_youtube_video_id(youtube_url)
+    app.logger.info("Extracted YouTube video ID: %s", video_id)
+    
+    # Try to get some metadata about the video
+    try:
+        with metrics.PIPELINE_STAGE_SECONDS.time(stage="youtube_metadata", content_type="youtube"):
+            metadata = get_youtube_metadata(video_id)
+        video_title = metadata.get("title", "Unknown video")
+        video_description = metadata.get("description", "")
+        app.logger.info("Video title: %s", video_title)
+    except Exception as e:
+        app.logger.warning(f"Failed to get video metadata: {str(e)}")
+        video_title = "Unknown video"
+        video_description = ""
+    
+    # Generate content based on video ID using LLM
+    prompt = f"""
         You are tasked with creating a detailed summary of a YouTube video with ID: {video_id}
         Title: {video_title}
         
@@ -183,11 +328,19 @@ def extract_text_from_youtube(youtube_url):
         Write this as if you had watched the full video and are providing a detailed transcription.
         Make it at least 500 words, detailed enough to capture the essence of the content.
         """
+    app.logger.info("Generating content for YouTube video ID: %s", video_id)
+    return prompt
+
+def extract_text_from_youtube(youtube_url, use_cache: bool = True):
+    """
+    Extract video ID from YouTube URL and generate content based on it using LLM
+    instead of downloading and transcribing.
+    """
+    try:
+        prompt = youtube_summary_prompt(youtube_url)
+        generated_content = call_openrouter(prompt, stage="youtube", use_cache=use_cache)
         
-        app.logger.info(f"Generating content for YouTube video ID: {video_id}")
-        generated_content = call_openrouter(prompt)
-        
-        app.logger.info(f"Generated content: {len(generated_content)} characters")
+        app.logger.info("Generated content: %s characters", len(generated_content))
         return generated_content
     
     except Exception as e:
@@ -217,51 +370,9 @@ def extract_text_from_pdf(pdf_content: bytes) -> str:
                     pdf_content = pdf_content.encode('utf-8')
             
         # Log the type and size of content
-        app.logger.debug(f"PDF content type: {type(pdf_content)}, size: {len(pdf_content)} bytes")
-            
-        # Check if content seems like valid PDF (starts with %PDF)
-        if not pdf_content.startswith(b'%PDF'):
-            app.logger.error("Content doesn't appear to be a valid PDF (missing PDF header)")
-            raise ValueError("Content doesn't appear to be a valid PDF. Please check the file format.")
-            
-        pdf_file = io.BytesIO(pdf_content)
-        
-        try:
-            reader = PyPDF2.PdfReader(pdf_file)
-            
-            # Log the number of pages
-            app.logger.debug(f"PDF loaded successfully with {len(reader.pages)} pages")
+        app.logger.debug("PDF content type: %s, size: %s bytes", type(pdf_content), len(pdf_content))
             
-            text = ""
-            for page_num, page in enumerate(reader.pages):
-                try:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n\n"
-                    app.logger.debug(f"Extracted {len(page_text)} characters from page {page_num+1}")
-                except Exception as e:
-                    app.logger.error(f"Error extracting text from page {page_num+1}: {str(e)}")
-                    text += f"\n[Error extracting text from page {page_num+1}]\n"
-            
-            if not text.strip():
-                raise ValueError("No text could be extracted from the PDF")
-                
-            return text
-            
-        except PyPDF2.errors.PdfReadError as e:
-            # Try alternative approach with pdfminer
-            app.logger.warning(f"PyPDF2 failed, trying pdfminer: {str(e)}")
-            try:
-                from pdfminer.high_level import extract_text
-                pdf_file.seek(0)  # Reset file pointer
-                text = extract_text(pdf_file)
-                if text.strip():
-                    return text
-                else:
-                    raise ValueError("No text could be extracted from the PDF using alternative method")
-            except ImportError:
-                app.logger.error("pdfminer not available for fallback PDF processing")
-                raise ValueError(f"PDF processing error: {str(e)} (no fallback available)")
+        return _extract_pdf_source(pdf_content, pdf_content[:8])
             
     except ValueError as e:
         # Pass through ValueError with informative message
@@ -274,6 +385,40 @@ def extract_text_from_pdf(pdf_content: bytes) -> str:
             raise ValueError("The provided content doesn't appear to be a valid PDF file. Please check the file format and try again.")
         raise ValueError(f"PDF processing error: {str(e)}")
 
+def extract_text_from_pdf_file(pdf_path: str) -> str:
+    """Extract text from a PDF on disk; the file is memory-mapped rather than read into memory."""
+    try:
+        if app.logger.isEnabledFor(logging.DEBUG):
+            app.logger.debug("PDF file: %s, size: %s bytes", pdf_path, os.path.getsize(pdf_path))
+        with open(pdf_path, 'rb') as f:
+            header = f.read(8)
+        return _extract_pdf_source(pdf_path, header)
+    except ValueError as e:
+        app.logger.error(f"PDF validation error: {str(e)}")
+        raise
+    except Exception as e:
+        app.logger.error(f"PDF processing error: {str(e)}", exc_info=True)
+        if "not a PDF file" in str(e) or "EOF marker not found" in str(e):
+            raise ValueError("The provided content doesn't appear to be a valid PDF file. Please check the file format and try again.")
+        raise ValueError(f"PDF processing error: {str(e)}")
+
+def _extract_pdf_source(source, header: bytes) -> str:
+    # Check if content seems like valid PDF (starts with %PDF)
+    if not header.startswith(b'%PDF'):
+        app.logger.error("Content doesn't appear to be a valid PDF (missing PDF header)")
+        raise ValueError("Content doesn't appear to be a valid PDF. Please check the file format.")
+        
+    try:
+        # Pages are extracted in parallel worker processes for large documents
+        text = extract_pdf_text(source)
+    except ImportError as e:
+        raise ValueError(f"PDF processing error: {str(e)} (no fallback available)")
+    
+    if not text.strip():
+        raise ValueError("No text could be extracted from the PDF")
+        
+    return text
+
 def validate_content_type(content_type: str) -> None:
     valid_types = ['youtube', 'pdf', 'text']
     if content_type not in valid_types:
@@ -292,8 +437,6 @@ def extract_json_from_text(text: str) -> str:
     """
     Extract JSON from text that may have preamble or explanation text around it.
     """
-    app.logger.debug(f"Attempting to extract JSON from: {text}")
-    
     # If the response already looks like clean JSON, return it
     if text.strip().startswith('{') or text.strip().startswith('['):
         return text.strip()
@@ -306,218 +449,65 @@ def extract_json_from_text(text: str) -> str:
         json_content = text.split("```")[1].split("```")[0].strip()
         return json_content
         
-    # Try to extract JSON by finding the first { or [ character
-    json_start = text.find('{')
-    array_start = text.find('[')
-    
-    # Find which comes first (if both exist)
-    if json_start >= 0 and (array_start < 0 or json_start < array_start):
-        # Find the corresponding closing brace
-        brace_count = 1
-        for i in range(json_start + 1, len(text)):
-            if text[i] == '{':
-                brace_count += 1
-            elif text[i] == '}':
-                brace_count -= 1
-                
-            if brace_count == 0:
-                return text[json_start:i+1]
-    elif array_start >= 0:
-        # Find the corresponding closing bracket
-        bracket_count = 1
-        for i in range(array_start + 1, len(text)):
-            if text[i] == '[':
-                bracket_count += 1
-            elif text[i] == ']':
-                bracket_count -= 1
-                
-            if bracket_count == 0:
-                return text[array_start:i+1]
+    # Try to extract JSON by matching the first { or [ with its closing character,
+    # ignoring braces inside string literals
+    json_span = find_json_span(text)
+    if json_span is not None:
+        return json_span
                 
     # If we can't extract JSON, return the original text
     app.logger.warning("Couldn't extract JSON from text")
     return text
 
-@app.route('/api/process-sermon', methods=['POST', 'OPTIONS'])
-def process_sermon():
-    # Handle OPTIONS requests separately to avoid errors
-    if request.method == 'OPTIONS':
-        response = app.make_default_options_response()
-        return response
+def json_reply(expected: type) -> Callable[[str], None]:
+    """
+    LLM cache validator for stages that answer with a JSON object or array:
+    raises unless the response holds a JSON value of the expected type, so a
+    malformed reply is never replayed from the cache.
+    """
+    def validate(text: str) -> None:
+        if not isinstance(json.loads(extract_json_from_text(text)), expected):
+            raise ValueError(f"Response is not a JSON {expected.__name__}")
+    return validate
 
-    session = Session()
-    try:
-        data = request.json
-        if not data:
-            return jsonify({"success": False, "error": "No data provided"}), 400
-            
-        app.logger.info(f"Processing sermon request: {data}")
-        
-        # For debugging PDF issues, log content length
-        if 'content_type' in data and data['content_type'] == 'pdf' and 'content' in data:
-            content_len = len(data['content'])
-            app.logger.debug(f"Received PDF content with length: {content_len}")
-            if content_len < 100:  # Very small PDFs are likely not valid
-                app.logger.warning(f"PDF content suspiciously small: {data['content']}")
-                
-        sermon_input = SermonInput(**data)
-        validate_content_type(sermon_input.content_type)
-        
-        # Extract text based on content type
-        if sermon_input.content_type == 'youtube':
-            text = extract_text_from_youtube(sermon_input.content)
-        elif sermon_input.content_type == 'pdf':
-            try:
-                text = extract_text_from_pdf(sermon_input.content)
-            except Exception as e:
-                # Special handling for PDF errors
-                app.logger.error(f"PDF extraction failed: {str(e)}")
-                return jsonify({
-                    "success": False, 
-                    "error": str(e),
-                    "error_type": "pdf_processing"
-                }), 400
-        else:
-            text = sermon_input.content
+JSON_OBJECT_REPLY = json_reply(dict)
+JSON_ARRAY_REPLY = json_reply(list)
 
-        # If extracted text is empty, return an error
-        if not text or len(text.strip()) < 10:
-            return jsonify({
-                "success": False,
-                "error": "Extracted text is empty or too short. Please provide valid content."
-            }), 400
-
-        # Store sermon in database with title
-        sermon = Sermon(
-            title=sermon_input.title or "Untitled Sermon",  # Default title if not provided
-            content_type=sermon_input.content_type,
-            content=sermon_input.content,
-            source_url=sermon_input.content if sermon_input.content_type == 'youtube' else None,
-            custom_prompt=sermon_input.custom_prompt
-        )
-        session.add(sermon)
-        session.commit()
+def structured_value(raw: Any, adapter: TypeAdapter, name: str, use_cache: bool = True) -> Any:
+    """
+    Validate a structured-output fragment, repairing it with one short call
+    that contains only this fragment if it doesn't match the schema.
+    """
+    def complete(prompt: str, response_format: Dict[str, Any]) -> str:
+        return call_openrouter(prompt, stage="repair", use_cache=use_cache, response_format=response_format,
+                               validate=structured_output.load_json)
+    return structured_output.validate_or_repair(adapter, raw, complete, name)
 
-        # Planner Agent
-        planner_prompt = f"""
-        Analyze this sermon and create a game plan:
-        {text}
-        
-        Custom requirements: {sermon_input.custom_prompt}
-        
-        Create a structured plan with:
-        1. Main theme
-        2. Key topics
-        3. Game structure (how to make it engaging)
-        
-        Return ONLY the JSON response with no explanatory text before or after:
-        {{
-            "theme": "main theme of the sermon",
-            "main_topics": ["topic1", "topic2", "topic3"],
-            "game_structure": {{
-                "format": "game format description",
-                "rules": "game rules"
-            }}
-        }}
-        """
-        
-        planner_response = call_openrouter(planner_prompt)
-        
-        # Handle potential JSON parsing issues
-        try:
-            app.logger.info(f"Planner response: {planner_response}")
-            # Extract JSON from the response
-            json_content = extract_json_from_text(planner_response)
-            app.logger.info(f"Extracted JSON: {json_content}")
-            game_plan_data = json.loads(json_content)
-            game_plan = GamePlan(**game_plan_data)
-        except json.JSONDecodeError as e:
-            app.logger.error(f"Failed to parse planner response: {str(e)}, Response: {planner_response}")
-            return jsonify({
-                "success": False, 
-                "error": f"Failed to parse game plan: {str(e)}", 
-                "raw_response": planner_response
-            }), 500
-        except Exception as e:
-            app.logger.error(f"Error creating game plan: {str(e)}")
-            return jsonify({
-                "success": False, 
-                "error": f"Error creating game plan: {str(e)}", 
-                "raw_response": planner_response
-            }), 500
-
-        # Store game in database
-        game = Game(
-            sermon_id=sermon.id,
-            theme=game_plan.theme,
-            main_topics=game_plan.main_topics,
-            game_structure=game_plan.game_structure
-        )
-        session.add(game)
-        session.commit()
+def structured_question(question_data: Any, use_cache: bool = True) -> Optional[Dict[str, Any]]:
+    """Validate (and if needed repair) one question; None if it can't be repaired."""
+    try:
+        return structured_value(question_data, QUESTION_ADAPTER, "question", use_cache).model_dump()
+    except Exception as e:
+        app.logger.warning(f"Dropping question that failed schema repair: {str(e)}")
+        return None
 
-        # Question Writer Agent
-        question_writer_prompt = f"""
-        Based on this game plan, create 8-12 questions:
-        {json.dumps(game_plan.dict())}
-        
-        For each question:
-        1. Write the question text
-        2. Provide the correct answer (string for single answers, array for multiple answers)
-        3. Use ONLY these specific question types:
-           - single-answer-multiple-choice
-           - multiple-answer-multiple-choice
-           - slider
-           - single-answer-drag-drop
-           - multiple-answer-drag-drop
-           - true-false
-        4. Include fake answer options for multiple choice questions
-        5. Assign a difficulty level
-        
-        Return ONLY the JSON array with no explanatory text before or after:
-        [
-            {{
-                "question": "question text",
-                "correct_answer": "correct answer" OR ["answer1", "answer2"] for multiple answers,
-                "question_type": "single-answer-multiple-choice",  # Use only the types listed above
-                "fake_answers": ["fake1", "fake2", "fake3"],
-                "difficulty": "easy"  # easy, medium, or hard
-            }},
-            ...more questions...
-        ]
-        """
-        
-        question_writer_response = call_openrouter(question_writer_prompt)
-        
-        # Handle potential JSON parsing issues for questions
-        try:
-            app.logger.info(f"Question writer response: {question_writer_response}")
-            json_content = extract_json_from_text(question_writer_response)
-            app.logger.info(f"Extracted questions JSON: {json_content}")
-            questions = json.loads(json_content)
-            if not isinstance(questions, list):
-                raise ValueError("Questions response is not a list")
-        except json.JSONDecodeError as e:
-            app.logger.error(f"Failed to parse questions: {str(e)}, Response: {question_writer_response}")
-            return jsonify({
-                "success": False, 
-                "error": f"Failed to parse questions: {str(e)}", 
-                "raw_response": question_writer_response
-            }), 500
-        except Exception as e:
-            app.logger.error(f"Error creating questions: {str(e)}")
-            return jsonify({
-                "success": False, 
-                "error": f"Error creating questions: {str(e)}", 
-                "raw_response": question_writer_response
-            }), 500
-
-        # Question Designer Agent
-        designed_questions = []
-        for question_data in questions:
-            designer_prompt = f"""
+def structured_question_list(raw: str, use_cache: bool = True) -> List[Dict[str, Any]]:
+    """
+    Validate a writer response element by element. Only invalid elements are
+    repaired; the whole array is sent back only if it isn't an array at all.
+    """
+    try:
+        items = structured_output.load_json(raw)
+    except ValueError:
+        items = None
+    if not isinstance(items, list):
+        return [q.model_dump() for q in structured_value(raw, QUESTION_LIST_ADAPTER, "questions", use_cache)]
+    questions = [structured_question(item, use_cache) for item in items]
+    return [q for q in questions if q is not None]
+
+DESIGNER_PROMPT_TEMPLATE = """
             Design this question for a game:
-            {json.dumps(question_data)}
+            {question_json}
             
             Ensure question_type is one of:
             - single-answer-multiple-choice
@@ -543,115 +533,1306 @@ def process_sermon():
                 "difficulty": "easy"  # easy, medium, or hard
             }}
             """
+
+DESIGNER_BATCH_PROMPT_TEMPLATE = """
+            Design each of these {count} questions for a game:
+            {questions_json}
             
-            try:
-                designed_question_response = call_openrouter(designer_prompt)
-                app.logger.info(f"Question designer response: {designed_question_response}")
-                
-                json_content = extract_json_from_text(designed_question_response)
-                app.logger.info(f"Extracted designed question JSON: {json_content}")
-                question_dict = json.loads(json_content)
-                
-                # Update: Fix parameter names to match the Question model
-                question = QuestionModel(
-                    game_id=game.id,
-                    text=question_dict['question'],  # Updated from 'question' to 'text'
-                    correct_answer=question_dict['correct_answer'],
-                    question_type=question_dict['question_type'],
-                    options=question_dict.get('fake_answers', []),
-                    hints=question_dict.get('hints', []),
-                    learning_points=question_dict.get('learning_points', []),
-                    difficulty=question_dict.get('difficulty', 'easy')
-                )
-                session.add(question)
-                designed_questions.append(question_dict)
-            except Exception as e:
-                app.logger.error(f"Error processing question: {str(e)}")
-                # Continue with other questions instead of failing the entire request
-                continue
+            Ensure question_type is one of:
+            - single-answer-multiple-choice
+            - multiple-answer-multiple-choice
+            - slider
+            - single-answer-drag-drop
+            - multiple-answer-drag-drop
+            - true-false
+            
+            For every question:
+            1. Ensure fake_answers exist for multiple-choice questions
+            2. Visual elements if needed
+            3. Hints or learning points
+            
+            Return ONLY a JSON array with exactly {count} objects, one per input question and
+            in the same order, with no explanatory text before or after:
+            [
+                {{
+                    "question": "question text",
+                    "correct_answer": "correct answer" OR ["answer1", "answer2"] for multiple answers,
+                    "question_type": "single-answer-multiple-choice",  # Use only approved types
+                    "fake_answers": ["option1", "option2", "option3", "option4"],
+                    "hints": ["hint1", "hint2"],
+                    "learning_points": ["learning point 1", "learning point 2"],
+                    "difficulty": "easy"  # easy, medium, or hard
+                }},
+                ...one object per question...
+            ]
+            """
 
-        session.commit()
+def validate_designed_question(question_dict: Any) -> Dict[str, Any]:
+    """Check a designer result has the fields the Question model needs."""
+    if not isinstance(question_dict, dict):
+        raise ValueError("Designed question is not an object")
+    for field in ('question', 'correct_answer', 'question_type'):
+        if field not in question_dict:
+            raise ValueError(f"Designed question is missing '{field}'")
+    return question_dict
 
-        return jsonify({
-            "success": True,
-            "game_plan": game_plan.dict(),
-            "questions": designed_questions,
-            "sermon_id": sermon.id,
-            "game_id": game.id
-        })
+def design_question(question_data: Dict[str, Any], use_cache: bool = True, structured: bool = False) -> Dict[str, Any]:
+    """Run the designer prompt for a single question and return the parsed result."""
+    designer_prompt = DESIGNER_PROMPT_TEMPLATE.format(question_json=json.dumps(question_data))
+    designed_question_response = call_openrouter(
+        designer_prompt,
+        stage="designer",
+        use_cache=use_cache,
+        response_format=QUESTION_FORMAT if structured else None,
+        validate=JSON_OBJECT_REPLY
+    )
+    return parse_designed_question(designed_question_response, structured, use_cache)
 
-    except ValueError as e:
-        session.rollback()
-        app.logger.error(f"Validation error: {str(e)}")
-        return jsonify({"success": False, "error": str(e)}), 400
-    except Exception as e:
-        session.rollback()
-        app.logger.error(f"Process sermon error: {str(e)}", exc_info=True)
-        return jsonify({"success": False, "error": str(e)}), 500
-    finally:
-        session.close()
+def parse_designed_question(designed_question_response: str, structured: bool = False,
+                            use_cache: bool = True) -> Dict[str, Any]:
+    """Parse one designer response; raises if it is unusable."""
+    if structured:
+        return structured_value(designed_question_response, QUESTION_ADAPTER, "question", use_cache).model_dump()
+    
+    json_content = extract_json_from_text(designed_question_response)
+    
+    # Fail early on missing required fields so the caller can skip this question
+    return validate_designed_question(json.loads(json_content))
 
-# Add memory optimization for large responses
-@app.route('/api/games/<int:game_id>', methods=['GET'])
-def get_game(game_id):
-    session = Session()
-    try:
-        game = session.query(Game).filter_by(id=game_id).first()
-        if not game:
-            return jsonify({"success": False, "error": "Game not found"}), 404
-            
-        questions = session.query(QuestionModel).filter_by(game_id=game_id).all()
-        
-        return jsonify({
-            "success": True,
-            "game": {
-                "id": game.id,
-                "theme": game.theme,
-                "main_topics": game.main_topics,
-                "game_structure": game.game_structure,
-                "questions": [{
-                    "id": q.id,
-                    "question": q.text,  # Updated from q.question to q.text
-                    "correct_answer": q.correct_answer,
-                    "question_type": q.question_type,
-                    "options": q.options,
-                    "hints": q.hints,
-                    "learning_points": q.learning_points
-                } for q in questions]
+def design_question_batch(batch: List[Dict[str, Any]], use_cache: bool = True,
+                          structured: bool = False) -> List[Optional[Dict[str, Any]]]:
+    """
+    Design several questions with a single designer call. Each element of the
+    returned array is validated on its own; invalid or missing elements come
+    back as None so the caller can redesign just those questions. In
+    structured mode invalid elements are repaired individually first.
+    """
+    designer_prompt = DESIGNER_BATCH_PROMPT_TEMPLATE.format(count=len(batch), questions_json=json.dumps(batch))
+    designed_response = call_openrouter(
+        designer_prompt,
+        stage="designer",
+        use_cache=use_cache,
+        response_format=QUESTION_LIST_FORMAT if structured else None,
+        validate=JSON_ARRAY_REPLY
+    )
+    return parse_designed_batch(designed_response, len(batch), structured, use_cache)
+
+def parse_designed_batch(designed_response: str, count: int, structured: bool = False,
+                         use_cache: bool = True) -> List[Optional[Dict[str, Any]]]:
+    """Parse a batched designer response into count results, None for each unusable element."""
+    designed = json.loads(extract_json_from_text(designed_response))
+    if not isinstance(designed, list):
+        raise ValueError("Batched designer response is not a list")
+    if len(designed) != count:
+        app.logger.warning(f"Batched designer returned {len(designed)} questions for {count} inputs")
+    
+    results: List[Optional[Dict[str, Any]]] = []
+    for position in range(count):
+        if structured:
+            results.append(structured_question(designed[position], use_cache) if position < len(designed) else None)
+            continue
+        try:
+            results.append(validate_designed_question(designed[position]))
+        except (IndexError, ValueError) as e:
+            app.logger.warning(f"Batched designer element {position + 1} invalid: {str(e)}")
+            results.append(None)
+    return results
+
+def submit_in_context(executor: ThreadPoolExecutor, fn: Callable[..., Any], *args) -> Any:
+    """executor.submit that runs fn with the caller's context variables (e.g. the LLM journal), which pool threads don't inherit."""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+def design_questions(
+    questions: List[Dict[str, Any]],
+    max_workers: Optional[int] = None,
+    on_designed: Optional[Callable[[int, Optional[Dict[str, Any]]], None]] = None,
+    use_cache: bool = True,
+    batch_size: Optional[int] = None,
+    structured: bool = False
+) -> List[Optional[Dict[str, Any]]]:
+    """
+    Design all questions concurrently on a bounded thread pool.
+    Results keep the original question order; a failed question yields None
+    so one bad response doesn't fail the whole game. on_designed(index, result)
+    is called from the calling thread as each question finishes.
+    With batch_size, chunks of that many questions share one designer call and
+    only the elements that fail validation fall back to per-question calls.
+    """
+    if not questions:
+        return []
+    
+    results: List[Optional[Dict[str, Any]]] = [None] * len(questions)
+    
+    def finish(index: int, result: Optional[Dict[str, Any]]) -> None:
+        results[index] = result
+        if on_designed:
+            on_designed(index, result)
+    
+    pending = list(range(len(questions)))
+    if batch_size:
+        chunks = [pending[start:start + batch_size] for start in range(0, len(pending), batch_size)]
+        pending = []
+        workers = max(1, min(max_workers or DESIGNER_MAX_WORKERS, len(chunks)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="designer") as executor:
+            futures = {
+                submit_in_context(executor, design_question_batch, [questions[index] for index in chunk], use_cache, structured): chunk
+                for chunk in chunks
             }
-        })
-    except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
-    finally:
-        session.close()
+            for future in as_completed(futures):
+                chunk = futures[future]
+                try:
+                    batch_results = future.result()
+                except Exception as e:
+                    app.logger.error(f"Error processing question batch {chunk[0] + 1}-{chunk[-1] + 1}: {str(e)}")
+                    batch_results = [None] * len(chunk)
+                for index, result in zip(chunk, batch_results):
+                    if result is None:
+                        pending.append(index)
+                    else:
+                        finish(index, result)
+        if pending:
+            app.logger.info("Falling back to per-question design for %s question(s)", len(pending))
+    
+    if not pending:
+        return results
+    
+    workers = max(1, min(max_workers or DESIGNER_MAX_WORKERS, len(pending)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="designer") as executor:
+        futures = {
+            submit_in_context(executor, design_question, questions[index], use_cache, structured): index
+            for index in pending
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                app.logger.error(f"Error processing question {index + 1}: {str(e)}")
+                result = None
+            finish(index, result)
+    
+    return results
 
-# Add a new endpoint to get all games
-@app.route('/api/games', methods=['GET'])
-def get_all_games():
-    session = Session()
-    try:
-        games = session.query(Game).all()
+def write_and_design_questions(
+    writer_prompt: str,
+    questions: List[Dict[str, Any]],
+    on_written: Callable[[], None],
+    on_designed: Optional[Callable[[int, Optional[Dict[str, Any]]], None]] = None,
+    use_cache: bool = True,
+    max_workers: Optional[int] = None,
+    structured: bool = False
+) -> List[Optional[Dict[str, Any]]]:
+    """
+    Stream the writer's question array and submit each question to the designer
+    pool as soon as it is parsed, so designing overlaps the rest of the writer
+    output. Questions are appended to the caller's list as they arrive and
+    on_written() is called once the writer stream ends. Results keep the
+    original order; on_designed(index, result) is called from the calling thread.
+    In structured mode each written question is validated (and repaired) on the
+    designer thread before it is designed.
+    """
+    results: Dict[int, Optional[Dict[str, Any]]] = {}
+    futures: Dict[Any, int] = {}
+    started_early = 0
+    
+    def design_streamed(question_data: Any) -> Dict[str, Any]:
+        if structured:
+            question_data = structured_question(question_data, use_cache)
+            if question_data is None:
+                raise ValueError("Written question does not match the schema")
+        return design_question(question_data, use_cache, structured)
+    
+    def finish(future) -> None:
+        index = futures.pop(future)
+        try:
+            result = future.result()
+        except Exception as e:
+            app.logger.error(f"Error processing question {index + 1}: {str(e)}")
+            result = None
+        results[index] = result
+        if on_designed:
+            on_designed(index, result)
+    
+    with ThreadPoolExecutor(max_workers=max_workers or DESIGNER_MAX_WORKERS, thread_name_prefix="designer") as executor:
+        try:
+            for question_data in stream_openrouter_json(
+                writer_prompt,
+                stage="writer",
+                use_cache=use_cache,
+                response_format=QUESTION_LIST_FORMAT if structured else None,
+                validate=JSON_ARRAY_REPLY
+            ):
+                futures[submit_in_context(executor, design_streamed, question_data)] = len(questions)
+                questions.append(question_data)
+                started_early += 1
+                for future in [f for f in futures if f.done()]:
+                    finish(future)
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
         
-        return jsonify({
-            "success": True,
-            "games": [{
-                "id": game.id,
-                "theme": game.theme,
-                "main_topics": game.main_topics,
-                "sermon_id": game.sermon_id,
-                "created_at": game.created_at.isoformat()
-            } for game in games]
-        })
-    except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
-    finally:
-        session.close()
+        # The last question is only known once the stream closes, so it doesn't count as overlapped
+        app.logger.info("Writer streamed %s questions; %s designer calls started before it finished", len(questions), max(0, started_early - 1))
+        on_written()
+        for future in as_completed(list(futures)):
+            finish(future)
+    
+    return [results.get(index) for index in range(len(questions))]
 
-# Add an endpoint to get sermon details
-@app.route('/api/sermons/<int:sermon_id>', methods=['GET'])
-def get_sermon(sermon_id):
-    session = Session()
-    try:
+class PipelineError(Exception):
+    """Error raised by the sermon pipeline, carrying the HTTP status and extra response fields."""
+    def __init__(self, message: str, status_code: int = 500, **details):
+        super().__init__(message)
+        self.status_code = status_code
+        self.details = details
+
+def pipeline_timed_out() -> bool:
+    time_left = rate_governor.time_left()
+    return time_left is not None and time_left <= 0
+
+def check_pipeline_deadline(stage: str) -> None:
+    """Raise a 504 PipelineError if the run has used up PIPELINE_TIMEOUT_SECONDS before stage starts."""
+    if pipeline_timed_out():
+        raise PipelineError(f"Sermon processing took longer than {PIPELINE_TIMEOUT_SECONDS}s; stopped before the {stage} stage",
+                            504, error_type="timeout")
+
+@contextmanager
+def pipeline_deadline() -> Iterator[None]:
+    """
+    Bound a pipeline run by PIPELINE_TIMEOUT_SECONDS: every LLM call made in
+    it gets at most the time left, and a step that fails once the time has
+    run out is reported as a 504 PipelineError.
+    """
+    with rate_governor.deadline_scope(PIPELINE_TIMEOUT_SECONDS):
+        try:
+            yield
+        except Exception as e:
+            if not pipeline_timed_out() or (isinstance(e, PipelineError) and e.status_code == 504):
+                raise
+            raise PipelineError(f"Sermon processing took longer than {PIPELINE_TIMEOUT_SECONDS}s", 504,
+                                error_type="timeout") from e
+
+def designer_batch_size(sermon_input: SermonInput, question_count: int) -> Optional[int]:
+    """Resolve the request/config designer mode into a chunk size (None = one call per question)."""
+    mode = (sermon_input.designer_mode or DESIGNER_MODE).lower()
+    if mode == 'single':
+        return None
+    if mode != 'batched':
+        raise ValueError("Invalid designer_mode. Must be one of: single, batched")
+    size = sermon_input.designer_batch_size if sermon_input.designer_batch_size is not None else DESIGNER_BATCH_SIZE
+    return size if size > 0 else max(1, question_count)
+
+CONDENSE_PROMPT_TEMPLATE = """
+    Summarize section {section} of {total} of a sermon for someone who will design a quiz about it.
+    Keep the main points, scripture references, key names, numbers and memorable illustrations.
+    Write plain prose of at most {max_words} words with no preamble.
+    
+    Section:
+    {section_text}
+    """
+
+def condense_sermon_text(text: str, use_cache: bool = True, depth: int = 0) -> str:
+    """
+    Map-reduce a long sermon: split it into sections of CONDENSE_CHUNK_TOKENS,
+    summarize the sections concurrently and join the summaries in order. If the
+    joined summary is still over the threshold it is condensed again.
+    """
+    sections = split_into_sections(text, CONDENSE_CHUNK_TOKENS)
+    max_words = max(100, CONDENSE_CHUNK_TOKENS // 8)
+    app.logger.info("Condensing sermon of ~%s tokens in %s sections", estimate_tokens(text), len(sections))
+    
+    def summarize(index: int) -> str:
+        started = time.perf_counter()
+        prompt = CONDENSE_PROMPT_TEMPLATE.format(
+            section=index + 1, total=len(sections), max_words=max_words, section_text=sections[index]
+        )
+        summary = call_openrouter(prompt, stage="condense", use_cache=use_cache).strip()
+        app.logger.debug("Condensed section %s/%s in %.2fs", index + 1, len(sections), time.perf_counter() - started)
+        return summary
+    
+    summaries: List[str] = list(sections)
+    workers = max(1, min(DESIGNER_MAX_WORKERS, len(sections)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="condense") as executor:
+        futures = {submit_in_context(executor, summarize, index): index for index in range(len(sections))}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                summaries[index] = future.result()
+            except Exception as e:
+                # Keep the original section rather than losing its content
+                app.logger.error(f"Error condensing section {index + 1}: {str(e)}")
+    
+    condensed = "\n\n".join(summaries)
+    app.logger.info("Condensed sermon to ~%s tokens", estimate_tokens(condensed))
+    if estimate_tokens(condensed) > CONDENSE_THRESHOLD_TOKENS and depth < 2 and len(sections) > 1:
+        return condense_sermon_text(condensed, use_cache=use_cache, depth=depth + 1)
+    return condensed
+
+def sermon_fingerprint(content: str, custom_prompt: Optional[str]) -> str:
+    """SHA-256 of the whitespace-normalized sermon content plus the custom prompt."""
+    normalized_content = " ".join(content.split())
+    normalized_prompt = " ".join((custom_prompt or "").split())
+    return hashlib.sha256(f"{normalized_content}\n--prompt--\n{normalized_prompt}".encode("utf-8")).hexdigest()
+
+def serialize_designed_question(question: QuestionModel) -> Dict[str, Any]:
+    """Rebuild the designer output shape from a stored Question row."""
+    return {
+        "question": question.text,
+        "correct_answer": question.correct_answer,
+        "question_type": question.question_type,
+        "fake_answers": question.options or [],
+        "hints": question.hints or [],
+        "learning_points": question.learning_points or [],
+        "difficulty": question.difficulty
+    }
+
+def reuse_existing_game(
+    session,
+    fingerprint: str,
+    force_regenerate: bool,
+    report_progress: Callable[..., None],
+    on_event: Callable[[str, Dict[str, Any]], None]
+) -> Optional[Dict[str, Any]]:
+    """
+    Return the pipeline payload of the latest complete game generated for a
+    sermon with this fingerprint, or None if the pipeline has to run. When
+    regenerating (forced, or the earlier run never finished) the new sermon
+    takes over the fingerprint once its game is saved.
+    """
+    sermon = session.query(Sermon).filter_by(content_fingerprint=fingerprint).first()
+    game = session.query(Game).filter_by(sermon_id=sermon.id).order_by(Game.id.desc()).first() if sermon else None
+    questions = session.query(QuestionModel).filter_by(game_id=game.id).order_by(QuestionModel.id).all() if game else []
+    if force_regenerate or not questions:
+        # End the read transaction so it isn't held open through the LLM stages
+        session.rollback()
+        return None
+
+    app.logger.info("Reusing game %s of sermon %s for identical content", game.id, sermon.id)
+    game_plan = {"theme": game.theme, "main_topics": game.main_topics, "game_structure": game.game_structure}
+    designed_questions = [serialize_designed_question(q) for q in questions]
+
+    report_progress("reused", 95, sermon_id=sermon.id, game_id=game.id)
+    on_event("extracted", {"sermon_id": sermon.id, "characters": None, "deduplicated": True})
+    on_event("plan", {"game_id": game.id, "game_plan": game_plan})
+    on_event("questions_written", {"count": len(designed_questions)})
+    for index, question_dict in enumerate(designed_questions):
+        on_event("question", {"index": index, "question": question_dict})
+
+    return {
+        "game_plan": game_plan,
+        "questions": designed_questions,
+        "sermon_id": sermon.id,
+        "game_id": game.id,
+        "deduplicated": True
+    }
+
+PLANNER_PROMPT_TEMPLATE = """
+    Analyze this sermon and create a game plan:
+    {text}
+    
+    Custom requirements: {custom_prompt}
+    
+    Create a structured plan with:
+    1. Main theme
+    2. Key topics
+    3. Game structure (how to make it engaging)
+    
+    Return ONLY the JSON response with no explanatory text before or after:
+    {{
+        "theme": "main theme of the sermon",
+        "main_topics": ["topic1", "topic2", "topic3"],
+        "game_structure": {{
+            "format": "game format description",
+            "rules": "game rules"
+        }}
+    }}
+    """
+
+WRITER_PROMPT_TEMPLATE = """
+    Based on this game plan, create 8-12 questions:
+    {game_plan_json}
+    
+    For each question:
+    1. Write the question text
+    2. Provide the correct answer (string for single answers, array for multiple answers)
+    3. Use ONLY these specific question types:
+       - single-answer-multiple-choice
+       - multiple-answer-multiple-choice
+       - slider
+       - single-answer-drag-drop
+       - multiple-answer-drag-drop
+       - true-false
+    4. Include fake answer options for multiple choice questions
+    5. Assign a difficulty level
+    
+    Return ONLY the JSON array with no explanatory text before or after:
+    [
+        {{
+            "question": "question text",
+            "correct_answer": "correct answer" OR ["answer1", "answer2"] for multiple answers,
+            "question_type": "single-answer-multiple-choice",  # Use only the types listed above
+            "fake_answers": ["fake1", "fake2", "fake3"],
+            "difficulty": "easy"  # easy, medium, or hard
+        }},
+        ...more questions...
+    ]
+    """
+
+def parse_game_plan(planner_response: str, structured: bool = False, use_cache: bool = True) -> GamePlan:
+    """Parse (and in structured mode validate or repair) the planner response."""
+    try:
+        if structured:
+            return structured_value(planner_response, GAME_PLAN_ADAPTER, "game_plan", use_cache)
+        # Extract JSON from the response
+        json_content = extract_json_from_text(planner_response)
+        game_plan_data = json.loads(json_content)
+        return GamePlan(**game_plan_data)
+    except json.JSONDecodeError as e:
+        app.logger.error(f"Failed to parse planner response: {str(e)}", extra={"response": planner_response})
+        raise PipelineError(f"Failed to parse game plan: {str(e)}", 500, raw_response=planner_response)
+    except Exception as e:
+        app.logger.error(f"Error creating game plan: {str(e)}")
+        raise PipelineError(f"Error creating game plan: {str(e)}", 500, raw_response=planner_response)
+
+def parse_written_questions(question_writer_response: str, structured: bool = False,
+                            use_cache: bool = True) -> List[Dict[str, Any]]:
+    """Parse (and in structured mode validate or repair) the question writer response."""
+    try:
+        if structured:
+            questions = structured_question_list(question_writer_response, use_cache)
+        else:
+            json_content = extract_json_from_text(question_writer_response)
+            questions = json.loads(json_content)
+        if not isinstance(questions, list):
+            raise ValueError("Questions response is not a list")
+        return questions
+    except json.JSONDecodeError as e:
+        app.logger.error(f"Failed to parse questions: {str(e)}", extra={"response": question_writer_response})
+        raise PipelineError(f"Failed to parse questions: {str(e)}", 500, raw_response=question_writer_response)
+    except Exception as e:
+        app.logger.error(f"Error creating questions: {str(e)}")
+        raise PipelineError(f"Error creating questions: {str(e)}", 500, raw_response=question_writer_response)
+
+def question_row(question_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """Column values for the Question model (the designer's 'question' is stored as 'text')."""
+    return {
+        "text": question_dict['question'],
+        "correct_answer": question_dict['correct_answer'],
+        "question_type": question_dict['question_type'],
+        "options": question_dict.get('fake_answers', []),
+        "hints": question_dict.get('hints', []),
+        "learning_points": question_dict.get('learning_points', []),
+        "difficulty": question_dict.get('difficulty', 'easy')
+    }
+
+def new_sermon(sermon_input: SermonInput, fingerprint: Optional[str]) -> Sermon:
+    """Unsaved Sermon row for a pipeline run."""
+    return Sermon(
+        title=sermon_input.title or "Untitled Sermon",  # Default title if not provided
+        content_type=sermon_input.content_type,
+        content=sermon_input.content,
+        source_url=sermon_input.content if sermon_input.content_type == 'youtube' else None,
+        custom_prompt=sermon_input.custom_prompt,
+        content_fingerprint=fingerprint
+    )
+
+def persist_generated_game(session, sermon: Sermon, game: Game, question_rows: List[Dict[str, Any]]) -> Tuple[int, int]:
+    """
+    save_generated_game, together with the LLM calls journaled so far in this
+    run, retrying without the fingerprint if an identical sermon won the race.
+    """
+    journal = llm_journal.current()
+    llm_calls = journal.pending() if journal is not None else []
+    try:
+        ids = save_generated_game(session, sermon, game, question_rows, llm_calls)
+    except IntegrityError:
+        # An identical sermon was saved concurrently; keep this one unfingerprinted
+        app.logger.info("Duplicate sermon fingerprint inserted concurrently, saving without it")
+        sermon.content_fingerprint = None
+        ids = save_generated_game(session, sermon, game, question_rows, llm_calls)
+    if journal is not None:
+        journal.mark_saved(llm_calls)
+    return ids
+
+def save_unlinked_llm_calls(journal: llm_journal.Journal) -> None:
+    """Write the journaled LLM calls of a run that ended without saving a game; never raises."""
+    llm_calls = journal.pending()
+    if not llm_calls:
+        return
+    session = SessionFactory()
+    try:
+        save_llm_calls(session, llm_calls)
+        journal.mark_saved(llm_calls)
+    except Exception as e:
+        app.logger.error(f"Could not journal {len(llm_calls)} LLM call(s): {str(e)}")
+    finally:
+        session.close()
+
+@contextmanager
+def journaled_llm_calls() -> Iterator[llm_journal.Journal]:
+    """
+    Journal every LLM call made in the block. Calls not saved with a game by
+    the time it ends (a failed run, or an endpoint that makes no game) are
+    saved on their own.
+    """
+    with llm_journal.collecting() as journal:
+        try:
+            yield journal
+        finally:
+            save_unlinked_llm_calls(journal)
+
+def start_stage(timer: StageTimer, stage: str) -> None:
+    """Start timing the next pipeline stage, unless the run is already past PIPELINE_TIMEOUT_SECONDS."""
+    check_pipeline_deadline(stage)
+    timer.mark(stage)
+
+def youtube_fingerprint(sermon_input: SermonInput) -> Optional[str]:
+    """Fingerprint of a YouTube sermon by video id, known before extraction; None for other content."""
+    if sermon_input.content_type == 'youtube' and validate_youtube_url(sermon_input.content):
+        return sermon_fingerprint(f"youtube:{get_youtube_video_id(sermon_input.content)}", sermon_input.custom_prompt)
+    return None
+
+def extract_sermon_pdf(sermon_input: SermonInput, pdf_path: Optional[str]) -> str:
+    """Text of the uploaded PDF at pdf_path, or of the base64 PDF in sermon_input.content."""
+    try:
+        if pdf_path:
+            return extract_text_from_pdf_file(pdf_path)
+        return extract_text_from_pdf(sermon_input.content)
+    except Exception as e:
+        # Special handling for PDF errors
+        app.logger.error(f"PDF extraction failed: {str(e)}")
+        raise PipelineError(str(e), 400, error_type="pdf_processing")
+
+def check_extracted_text(text: Optional[str]) -> None:
+    if not text or len(text.strip()) < 10:
+        raise PipelineError("Extracted text is empty or too short. Please provide valid content.", 400)
+
+def overlaps_writer_and_designer(sermon_input: SermonInput) -> bool:
+    """Whether designer calls start while the writer is still streaming (PIPELINE_OVERLAP, single designer mode)."""
+    return PIPELINE_OVERLAP and designer_batch_size(sermon_input, 0) is None
+
+def game_from_plan(game_plan: GamePlan) -> Game:
+    return Game(
+        theme=game_plan.theme,
+        main_topics=game_plan.main_topics,
+        game_structure=game_plan.game_structure
+    )
+
+def questions_error(e: Exception, questions: List[Dict[str, Any]]) -> PipelineError:
+    app.logger.error(f"Error creating questions: {str(e)}")
+    return PipelineError(f"Error creating questions: {str(e)}", 500, raw_response=json.dumps(questions))
+
+def designed_question_rows(designed_results: List[Optional[Dict[str, Any]]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """The designed questions and their Question rows; failed questions are skipped instead of failing the entire request."""
+    designed_questions = [question_dict for question_dict in designed_results if question_dict is not None]
+    return designed_questions, [question_row(question_dict) for question_dict in designed_questions]
+
+def finish_pipeline(timer: StageTimer, sermon_input: SermonInput, game_plan: GamePlan,
+                    designed_questions: List[Dict[str, Any]], sermon_id: int, game_id: int) -> Dict[str, Any]:
+    """Record the stage timings of a completed run and build its response payload."""
+    timer.stop()
+    metrics.observe_stages(timer.timings, sermon_input.content_type)
+    app.logger.info("Pipeline stage timings for game %s: %s", game_id, timer.summary())
+    return {
+        "game_plan": game_plan.dict(),
+        "questions": designed_questions,
+        "sermon_id": sermon_id,
+        "game_id": game_id,
+        "deduplicated": False
+    }
+
+def _no_progress(stage: str, progress: int, **fields) -> None:
+    pass
+
+def _no_event(event: str, data: Dict[str, Any]) -> None:
+    pass
+
+def run_sermon_pipeline(
+    sermon_input: SermonInput,
+    session,
+    report_progress: Callable[..., None] = _no_progress,
+    on_event: Callable[[str, Dict[str, Any]], None] = _no_event,
+    pdf_path: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Run extraction -> planner -> writer -> designer for a sermon and persist the results.
+    report_progress(stage, progress, **fields) is called as each stage starts or finishes;
+    on_event(event, data) receives the intermediate results ("extracted", "plan",
+    "questions_written", "question") as soon as they are available.
+    pdf_path points at an uploaded PDF on disk, used instead of sermon_input.content.
+    Returns the response payload (without the success flag).
+    Every LLM call is journaled; the calls of a run that fails are saved without a game.
+    A run that takes longer than PIPELINE_TIMEOUT_SECONDS fails with a 504 PipelineError.
+    """
+    with journaled_llm_calls(), pipeline_deadline():
+        return _run_sermon_pipeline(sermon_input, session, report_progress, on_event, pdf_path)
+
+def _run_sermon_pipeline(
+    sermon_input: SermonInput,
+    session,
+    report_progress: Callable[..., None],
+    on_event: Callable[[str, Dict[str, Any]], None],
+    pdf_path: Optional[str]
+) -> Dict[str, Any]:
+    validate_content_type(sermon_input.content_type)
+    timer = StageTimer()
+    structured = STRUCTURED_OUTPUT if sermon_input.structured_output is None else sermon_input.structured_output
+    
+    # YouTube sermons are fingerprinted by video id, so a duplicate skips extraction too
+    fingerprint = youtube_fingerprint(sermon_input)
+    if fingerprint is not None:
+        existing = reuse_existing_game(session, fingerprint, sermon_input.force_regenerate, report_progress, on_event)
+        if existing is not None:
+            return existing
+
+    # Extract text based on content type
+    report_progress("extracting", 5)
+    timer.mark("extraction")
+    if sermon_input.content_type == 'youtube':
+        text = extract_text_from_youtube(sermon_input.content, use_cache=sermon_input.use_cache)
+    elif sermon_input.content_type == 'pdf':
+        text = extract_sermon_pdf(sermon_input, pdf_path)
+    else:
+        text = sermon_input.content
+
+    # If extracted text is empty, return an error
+    check_extracted_text(text)
+
+    if fingerprint is None:
+        fingerprint = sermon_fingerprint(text, sermon_input.custom_prompt)
+        existing = reuse_existing_game(session, fingerprint, sermon_input.force_regenerate, report_progress, on_event)
+        if existing is not None:
+            return existing
+
+    # Sermon, game and questions are written together once the game is complete
+    sermon = new_sermon(sermon_input, fingerprint)
+
+    on_event("extracted", {"characters": len(text)})
+
+    # Long sermons are summarized section by section so the planner prompt stays small
+    if estimate_tokens(text) > CONDENSE_THRESHOLD_TOKENS:
+        report_progress("condensing", 10)
+        start_stage(timer, "condense")
+        text = condense_sermon_text(text, use_cache=sermon_input.use_cache)
+
+    # Planner Agent
+    report_progress("planning", 15)
+    start_stage(timer, "planner")
+    planner_prompt = PLANNER_PROMPT_TEMPLATE.format(text=text, custom_prompt=sermon_input.custom_prompt)
+    
+    planner_response = call_openrouter(
+        planner_prompt,
+        stage="planner",
+        use_cache=sermon_input.use_cache,
+        response_format=GAME_PLAN_FORMAT if structured else None,
+        validate=JSON_OBJECT_REPLY
+    )
+    
+    game_plan = parse_game_plan(planner_response, structured, sermon_input.use_cache)
+    game = game_from_plan(game_plan)
+
+    on_event("plan", {"game_plan": game_plan.dict()})
+
+    # Question Writer Agent
+    report_progress("writing", 35)
+    start_stage(timer, "writer")
+    question_writer_prompt = WRITER_PROMPT_TEMPLATE.format(game_plan_json=json.dumps(game_plan.dict()))
+    
+    designed_count = 0
+    questions: List[Dict[str, Any]] = []
+    def on_designed(index: int, question_dict: Optional[Dict[str, Any]]) -> None:
+        nonlocal designed_count
+        designed_count += 1
+        report_progress("designing", 50 + int(40 * designed_count / max(len(questions), 1)))
+        if question_dict is not None:
+            on_event("question", {"index": index, "question": question_dict})
+
+    if overlaps_writer_and_designer(sermon_input):
+        # Question Writer streams into the Question Designer pool
+        def on_written() -> None:
+            on_event("questions_written", {"count": len(questions)})
+            report_progress("designing", 50 + int(40 * designed_count / max(len(questions), 1)))
+            timer.mark("designer")
+        try:
+            designed_results = write_and_design_questions(
+                question_writer_prompt,
+                questions,
+                on_written,
+                on_designed=on_designed,
+                use_cache=sermon_input.use_cache,
+                structured=structured
+            )
+        except Exception as e:
+            raise questions_error(e, questions)
+    else:
+        question_writer_response = call_openrouter(
+            question_writer_prompt,
+            stage="writer",
+            use_cache=sermon_input.use_cache,
+            response_format=QUESTION_LIST_FORMAT if structured else None,
+            validate=JSON_ARRAY_REPLY
+        )
+        
+        questions = parse_written_questions(question_writer_response, structured, sermon_input.use_cache)
+
+        on_event("questions_written", {"count": len(questions)})
+
+        # Question Designer Agent - fan out over a bounded worker pool
+        report_progress("designing", 50)
+        start_stage(timer, "designer")
+        designed_results = design_questions(
+            questions,
+            on_designed=on_designed,
+            use_cache=sermon_input.use_cache,
+            batch_size=designer_batch_size(sermon_input, len(questions)),
+            structured=structured
+        )
+
+    designed_questions, question_rows = designed_question_rows(designed_results)
+
+    report_progress("saving", 95)
+    start_stage(timer, "save")
+    sermon_id, game_id = persist_generated_game(session, sermon, game, question_rows)
+    return finish_pipeline(timer, sermon_input, game_plan, designed_questions, sermon_id, game_id)
+
+@app.route('/api/process-sermon', methods=['POST', 'OPTIONS'])
+def process_sermon():
+    # Handle OPTIONS requests separately to avoid errors
+    if request.method == 'OPTIONS':
+        response = app.make_default_options_response()
+        return response
+
+    session = Session()
+    try:
+        data = request.json
+        if not data:
+            return jsonify({"success": False, "error": "No data provided"}), 400
+            
+        app.logger.info("Processing sermon request", extra={"sermon_request": sermon_request_fields(data)})
+        
+        # Very small PDFs are likely not valid
+        if data.get('content_type') == 'pdf' and isinstance(data.get('content'), str) and len(data['content']) < 100:
+            app.logger.warning("PDF content suspiciously small", extra={"content": data['content']})
+                
+        sermon_input = SermonInput(**data)
+        validate_content_type(sermon_input.content_type)
+        if _bypass_cache_requested():
+            sermon_input.use_cache = False
+
+        # Job mode: queue the pipeline and let the client poll /api/jobs/<id>
+        if _wants_async(data):
+            return _job_accepted_response(submit_sermon_job(sermon_input))
+        
+        result = run_sermon_pipeline(sermon_input, session)
+        return jsonify({"success": True, **result})
+
+    except PipelineError as e:
+        session.rollback()
+        return jsonify({"success": False, "error": str(e), **e.details}), e.status_code
+    except ValueError as e:
+        session.rollback()
+        app.logger.error(f"Validation error: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        session.rollback()
+        app.logger.error(f"Process sermon error: {str(e)}", exc_info=True)
+        return jsonify({"success": False, "error": str(e)}), 500
+    finally:
+        session.close()
+
+@app.route('/api/process-sermon/upload', methods=['POST', 'OPTIONS'])
+def process_sermon_upload():
+    """
+    Binary upload variant of /api/process-sermon for PDFs. Accepts either
+    multipart/form-data with the PDF in a "file" field (other SermonInput fields
+    as form fields), or a raw application/pdf body (fields as query parameters).
+    The upload is spooled to disk and memory-mapped for extraction.
+    """
+    if request.method == 'OPTIONS':
+        response = app.make_default_options_response()
+        return response
+
+    if request.content_length is not None and request.content_length > UPLOAD_MAX_BYTES:
+        return jsonify({"success": False, "error": f"Upload exceeds the maximum size of {UPLOAD_MAX_BYTES // (1024 * 1024)} MB"}), 413
+
+    pdf_path = None
+    queued = False
+    session = Session()
+    try:
+        if request.mimetype == 'multipart/form-data':
+            upload = request.files.get('file')
+            if upload is None:
+                return jsonify({"success": False, "error": "Missing 'file' field"}), 400
+            fields = request.form.to_dict()
+            filename = upload.filename or "upload.pdf"
+            pdf_path, size = spool_to_disk(upload.stream, UPLOAD_DIR, UPLOAD_MAX_BYTES, suffix=".pdf")
+        elif request.mimetype in ('application/pdf', 'application/octet-stream'):
+            fields = request.args.to_dict()
+            filename = fields.pop('filename', None) or "upload.pdf"
+            pdf_path, size = spool_to_disk(request.stream, UPLOAD_DIR, UPLOAD_MAX_BYTES, suffix=".pdf")
+        else:
+            return jsonify({"success": False, "error": "Expected multipart/form-data or application/pdf"}), 415
+
+        mime_type = sniff_mime_type(pdf_path)
+        app.logger.info("Received upload %s: %s bytes, detected %s", filename, size, mime_type)
+        if mime_type != 'application/pdf':
+            return jsonify({
+                "success": False,
+                "error": f"Uploaded file is not a PDF (detected {mime_type})",
+                "error_type": "pdf_processing"
+            }), 415
+
+        wants_async = fields.pop('async', '').lower() in ('1', 'true', 'yes')
+        sermon_input = SermonInput(**{**fields, "content_type": "pdf", "content": filename})
+        if _bypass_cache_requested():
+            sermon_input.use_cache = False
+
+        if wants_async or request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+            # The job owns the spooled file from here on and removes it when done
+            queued = True
+            return _job_accepted_response(submit_sermon_job(sermon_input, upload_path=pdf_path))
+
+        result = run_sermon_pipeline(sermon_input, session, pdf_path=pdf_path)
+        return jsonify({"success": True, **result})
+
+    except PipelineError as e:
+        session.rollback()
+        return jsonify({"success": False, "error": str(e), **e.details}), e.status_code
+    except UploadTooLarge as e:
+        return jsonify({"success": False, "error": str(e)}), 413
+    except ValueError as e:
+        session.rollback()
+        app.logger.error(f"Validation error: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        session.rollback()
+        app.logger.error(f"Process sermon upload error: {str(e)}", exc_info=True)
+        return jsonify({"success": False, "error": str(e)}), 500
+    finally:
+        session.close()
+        if not queued:
+            remove_quietly(pdf_path)
+
+def _job_accepted_response(job_id: str):
+    response = jsonify({
+        "success": True,
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/api/jobs/{job_id}"
+    })
+    response.headers['Location'] = f"/api/jobs/{job_id}"
+    return response, 202
+
+def _bypass_cache_requested() -> bool:
+    """Clients can also skip the LLM cache with a Cache-Control: no-cache request header."""
+    return 'no-cache' in request.headers.get('Cache-Control', '').lower()
+
+def _wants_async(data: Dict[str, Any]) -> bool:
+    """A request opts into job mode with "async": true in the body or ?async=1."""
+    if data.get('async') is True:
+        return True
+    return request.args.get('async', '').lower() in ('1', 'true', 'yes')
+
+def sermon_request_fields(data: Dict[str, Any]) -> Dict[str, Any]:
+    """A sermon request body for logging: base64 PDF content is reduced to its length, other fields are clipped by the log formatter."""
+    fields = dict(data)
+    content = fields.get('content')
+    if fields.get('content_type') == 'pdf' and isinstance(content, str):
+        fields['content'] = f"<{len(content)} base64 chars>"
+    return fields
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Serialize one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/process-sermon/stream', methods=['POST', 'OPTIONS'])
+def process_sermon_stream():
+    """
+    Streaming variant of /api/process-sermon. The pipeline runs on a background
+    thread and each intermediate result is pushed to the client as an SSE event:
+    extracted, plan, questions_written, question (one per designed question),
+    then done or error.
+    """
+    if request.method == 'OPTIONS':
+        response = app.make_default_options_response()
+        return response
+
+    data = request.json
+    if not data:
+        return jsonify({"success": False, "error": "No data provided"}), 400
+    try:
+        sermon_input = SermonInput(**data)
+        validate_content_type(sermon_input.content_type)
+        if _bypass_cache_requested():
+            sermon_input.use_cache = False
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    events: "queue.Queue[Optional[str]]" = queue.Queue()
+
+    def run() -> None:
+        session = SessionFactory()
+        try:
+            result = run_sermon_pipeline(
+                sermon_input,
+                session,
+                on_event=lambda event, payload: events.put(format_sse(event, payload))
+            )
+            events.put(format_sse("done", {"success": True, **result}))
+        except PipelineError as e:
+            session.rollback()
+            events.put(format_sse("error", {"success": False, "error": str(e), **e.details}))
+        except Exception as e:
+            session.rollback()
+            app.logger.error(f"Process sermon stream error: {str(e)}", exc_info=True)
+            events.put(format_sse("error", {"success": False, "error": str(e)}))
+        finally:
+            session.close()
+            events.put(None)
+
+    # The pipeline keeps running (and saves the game) even if the client disconnects;
+    # it runs in a copy of this context so its logs keep the request id
+    threading.Thread(target=contextvars.copy_context().run, args=(run,), name="sermon-stream", daemon=True).start()
+
+    def generate():
+        yield format_sse("started", {"content_type": sermon_input.content_type})
+        while True:
+            try:
+                message = events.get(timeout=SSE_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                # Comment line keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+                continue
+            if message is None:
+                break
+            yield message
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Disable nginx response buffering
+    return response
+
+# Background job execution
+_job_executor: Optional[ThreadPoolExecutor] = None
+_job_executor_lock = threading.Lock()
+
+def get_job_executor() -> ThreadPoolExecutor:
+    """
+    Lazily create the per-process job executor. The first call in a process
+    also picks up jobs orphaned by a previous worker (see resume_stale_jobs).
+    """
+    global _job_executor
+    with _job_executor_lock:
+        if _job_executor is None:
+            _job_executor = ThreadPoolExecutor(max_workers=JOB_MAX_WORKERS, thread_name_prefix="sermon-job")
+            resume = True
+        else:
+            resume = False
+    if resume:
+        try:
+            resume_stale_jobs()
+        except Exception as e:
+            app.logger.error(f"Failed to resume stale jobs: {str(e)}")
+    return _job_executor
+
+def submit_sermon_job(sermon_input: SermonInput, upload_path: Optional[str] = None) -> str:
+    """Persist a queued job for the sermon and schedule it on the background executor."""
+    session = SessionFactory()
+    try:
+        job = SermonJob(
+            id=uuid.uuid4().hex,
+            status="queued",
+            stage="queued",
+            progress=0,
+            payload=sermon_input.dict(),
+            upload_path=upload_path
+        )
+        session.add(job)
+        session.commit()
+        job_id = job.id
+    finally:
+        session.close()
+    
+    # The job logs under the id of the request that queued it
+    submit_in_context(get_job_executor(), run_sermon_job, job_id)
+    return job_id
+
+def _update_job(job_id: str, **fields) -> None:
+    session = SessionFactory()
+    try:
+        fields['updated_at'] = datetime.utcnow()
+        session.query(SermonJob).filter_by(id=job_id).update(fields, synchronize_session=False)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        app.logger.error(f"Failed to update job {job_id}: {str(e)}")
+    finally:
+        session.close()
+
+def _claim_job(job_id: str, expected_attempts: int) -> bool:
+    """
+    Atomically mark a job as running so only one worker executes it. A job
+    another worker is running can only be taken over once its heartbeat has
+    been silent for JOB_STALE_SECONDS.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+    session = SessionFactory()
+    try:
+        claimed = session.query(SermonJob).filter(
+            SermonJob.id == job_id,
+            SermonJob.attempts == expected_attempts,
+            or_(SermonJob.status == "queued", (SermonJob.status == "running") & (SermonJob.updated_at < cutoff))
+        ).update({
+            "status": "running",
+            "attempts": expected_attempts + 1,
+            "updated_at": datetime.utcnow()
+        }, synchronize_session=False)
+        session.commit()
+        return claimed == 1
+    finally:
+        session.close()
+
+def _heartbeat_job(job_id: str, attempts: int, stop: threading.Event) -> None:
+    """Keep a running job's updated_at fresh until stop is set or another worker has taken the job over."""
+    while not stop.wait(JOB_HEARTBEAT_SECONDS):
+        session = SessionFactory()
+        try:
+            owned = session.query(SermonJob).filter(
+                SermonJob.id == job_id,
+                SermonJob.attempts == attempts,
+                SermonJob.status == "running"
+            ).update({"updated_at": datetime.utcnow()}, synchronize_session=False)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            app.logger.error(f"Failed to heartbeat job {job_id}: {str(e)}")
+            continue
+        finally:
+            session.close()
+        if not owned:
+            app.logger.warning(f"Job {job_id} is no longer owned by this worker; stopping its heartbeat")
+            return
+
+def run_sermon_job(job_id: str) -> None:
+    """Executor entry point: run the pipeline for a persisted job and record the outcome."""
+    # Resumed jobs have no originating request; their logs carry the job id instead
+    with log_helpers.request_context(log_helpers.current_request_id() or job_id):
+        _run_sermon_job(job_id)
+
+def _run_sermon_job(job_id: str) -> None:
+    session = SessionFactory()
+    upload_path = None
+    heartbeat_stop = threading.Event()
+    try:
+        job = session.get(SermonJob, job_id)
+        if job is None:
+            app.logger.error(f"Job {job_id} not found")
+            return
+        if not _claim_job(job_id, job.attempts):
+            app.logger.info("Job %s already claimed by another worker", job_id)
+            return
+        threading.Thread(
+            target=_heartbeat_job, args=(job_id, job.attempts + 1, heartbeat_stop), name=f"job-heartbeat-{job_id[:8]}", daemon=True
+        ).start()
+        sermon_input = SermonInput(**job.payload)
+        upload_path = job.upload_path
+        session.expunge_all()
+
+        def report_progress(stage: str, progress: int, **fields) -> None:
+            _update_job(job_id, stage=stage, progress=progress, **fields)
+
+        result = run_sermon_pipeline(sermon_input, session, report_progress, pdf_path=upload_path)
+        _update_job(
+            job_id,
+            status="completed",
+            stage="completed",
+            progress=100,
+            sermon_id=result["sermon_id"],
+            game_id=result["game_id"]
+        )
+        remove_quietly(upload_path)
+    except Exception as e:
+        session.rollback()
+        app.logger.error(f"Job {job_id} failed: {str(e)}", exc_info=True)
+        _update_job(job_id, status="failed", error=str(e))
+        remove_quietly(upload_path)
+    finally:
+        heartbeat_stop.set()
+        session.close()
+
+def resume_stale_jobs() -> int:
+    """
+    Re-queue jobs left queued or running by a worker that died. A job counts as
+    stale once neither progress nor its heartbeat has updated it for
+    JOB_STALE_SECONDS.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+    session = SessionFactory()
+    try:
+        stale_ids = [job_id for (job_id,) in session.query(SermonJob.id).filter(
+            SermonJob.status.in_(("queued", "running")),
+            SermonJob.updated_at < cutoff
+        ).all()]
+    finally:
+        session.close()
+    
+    for job_id in stale_ids:
+        app.logger.info("Resuming stale job %s", job_id)
+        _job_executor.submit(run_sermon_job, job_id)
+    return len(stale_ids)
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    # Make sure this worker has resumed orphaned jobs before reporting on them
+    get_job_executor()
+    session = Session()
+    try:
+        job = session.get(SermonJob, job_id)
+        if not job:
+            return jsonify({"success": False, "error": "Job not found"}), 404
+        
+        return jsonify({
+            "success": True,
+            "job": {
+                "id": job.id,
+                "status": job.status,
+                "stage": job.stage,
+                "progress": job.progress,
+                "sermon_id": job.sermon_id,
+                "game_id": job.game_id,
+                "error": job.error,
+                "created_at": job.created_at.isoformat(),
+                "updated_at": job.updated_at.isoformat()
+            }
+        })
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+    finally:
+        session.close()
+
+# Add memory optimization for large responses
+@app.route('/api/games/<int:game_id>', methods=['GET'])
+def get_game(game_id):
+    session = Session()
+    try:
+        # One round trip for the game and its questions, serialized straight from the rows
+        game = game_json(session, game_id)
+        if game is None:
+            return jsonify({"success": False, "error": "Game not found"}), 404
+        
+        return Response(f'{{"success":true,"game":{game}}}', mimetype='application/json')
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+    finally:
+        session.close()
+
+# Add a new endpoint to get all games
+@app.route('/api/games', methods=['GET'])
+def get_all_games():
+    """
+    List games newest first, one page at a time. Query parameters: limit
+    (default GAMES_PAGE_SIZE, max GAMES_MAX_PAGE_SIZE), cursor (next_cursor of
+    the previous page), sermon_id, theme, created_after, created_before (ISO
+    dates) and fields (comma-separated, e.g. fields=id,theme,game_structure).
+    """
+    try:
+        limit = request.args.get('limit', GAMES_PAGE_SIZE, type=int)
+        if limit < 1 or limit > GAMES_MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {GAMES_MAX_PAGE_SIZE}")
+        fields = request.args.get('fields')
+        created_after = request.args.get('created_after')
+        created_before = request.args.get('created_before')
+        filters = {
+            "cursor": request.args.get('cursor'),
+            "sermon_id": request.args.get('sermon_id', type=int),
+            "theme": request.args.get('theme'),
+            "created_after": datetime.fromisoformat(created_after) if created_after else None,
+            "created_before": datetime.fromisoformat(created_before) if created_before else None,
+            "fields": [f.strip() for f in fields.split(',') if f.strip()] if fields else DEFAULT_GAME_LIST_FIELDS
+        }
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    session = Session()
+    try:
+        games, next_cursor = list_games(session, limit=limit, **filters)
+        return jsonify({"success": True, "games": games, "next_cursor": next_cursor})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+    finally:
+        session.close()
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    cache = llm_cache.get_cache()
+    if cache is None:
+        return jsonify({"success": True, "enabled": False})
+    return jsonify({"success": True, "enabled": True, "stats": cache.stats()})
+
+@app.route('/api/llm/governor', methods=['GET'])
+def get_governor_stats():
+    """Per-model rate, in-flight limit, throttling counters and queue wait histogram of the OpenRouter governor."""
+    return jsonify({"success": True, "models": rate_governor.get_governor().stats()})
+
+@app.route('/api/llm/usage', methods=['GET'])
+def get_llm_usage():
+    """
+    Aggregated LLM call journal: calls, cache hits, errors, tokens, cost and
+    mean latency. Query parameters: group_by (comma-separated day, model,
+    stage and/or game_id; default day), since and until (ISO dates),
+    game_id, sermon_id and request_id.
+    """
+    try:
+        group_by = request.args.get('group_by', 'day')
+        since = request.args.get('since')
+        until = request.args.get('until')
+        filters = {
+            "group_by": [dimension.strip() for dimension in group_by.split(',') if dimension.strip()],
+            "since": datetime.fromisoformat(since) if since else None,
+            "until": datetime.fromisoformat(until) if until else None,
+            "game_id": request.args.get('game_id', type=int),
+            "sermon_id": request.args.get('sermon_id', type=int),
+            "request_id": request.args.get('request_id')
+        }
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    session = Session()
+    try:
+        return jsonify({"success": True, "usage": llm_usage(session, **filters)})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+    finally:
+        session.close()
+
+@app.route('/api/games/<int:game_id>/usage', methods=['GET'])
+def get_game_llm_usage(game_id):
+    """Tokens, cost and latency of the LLM calls that generated a game, per stage and model."""
+    session = Session()
+    try:
+        usage = llm_usage(session, group_by=("stage", "model"), game_id=game_id)
+        totals = llm_usage(session, group_by=(), game_id=game_id)[0]
+        return jsonify({"success": True, "game_id": game_id, "usage": usage, "totals": totals})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+    finally:
+        session.close()
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Stage, LLM call, queue wait, DB commit and request histograms of all workers, in Prometheus text format."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+# Add an endpoint to get sermon details
+@app.route('/api/sermons/<int:sermon_id>', methods=['GET'])
+def get_sermon(sermon_id):
+    session = Session()
+    try:
         sermon = session.query(Sermon).filter_by(id=sermon_id).first()
         if not sermon:
             return jsonify({"success": False, "error": "Sermon not found"}), 404
@@ -690,13 +1871,14 @@ def transcribe_content():
         
         validate_content_type(content_type)
         
-        # Extract text based on content type
-        if content_type == 'youtube':
-            text = extract_text_from_youtube(content)
-        elif content_type == 'pdf':
-            text = extract_text_from_pdf(content.encode())
-        else:
-            text = content
+        # Extract text based on content type; the YouTube summary call is journaled without a sermon
+        with journaled_llm_calls():
+            if content_type == 'youtube':
+                text = extract_text_from_youtube(content)
+            elif content_type == 'pdf':
+                text = extract_text_from_pdf(content.encode())
+            else:
+                text = content
         
         return jsonify({
             "success": True,
@@ -738,6 +1920,40 @@ def test_api():
         # Default GET request
         return jsonify({"success": True, "message": "API GET test successful"})
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.before_request
+def bind_request_id():
+    """Tag this request's logs, LLM calls and background work with the client's X-Request-ID or a new id."""
+    request_id = log_helpers.clean_request_id(request.headers.get(log_helpers.REQUEST_ID_HEADER))
+    g.request_id_token = log_helpers.bind_request_id(request_id)
+
+@app.after_request
+def add_request_id_header(response):
+    request_id = log_helpers.current_request_id()
+    if request_id is not None:
+        response.headers[log_helpers.REQUEST_ID_HEADER] = request_id
+    return response
+
+@app.teardown_request
+def unbind_request_id(exception=None):
+    token = g.pop("request_id_token", None)
+    if token is not None:
+        log_helpers.reset_request_id(token)
+
+@app.after_request
+def observe_request(response):
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    started = g.get("request_started")
+    if started is not None:
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method,
+                                             endpoint=endpoint, status=response.status_code)
+    if request.content_length is not None:
+        metrics.HTTP_REQUEST_BYTES.observe(request.content_length, method=request.method, endpoint=endpoint)
+    return response
+
 # Add a middleware to ensure all responses have CORS headers
 @app.after_request
 def add_cors_headers(response):
@@ -0,0 +1,234 @@
+"""
+ASGI entry point. POST /api/process-sermon runs on the event loop through
+async_pipeline, so a worker holds hundreds of pipelines waiting on OpenRouter
+without a thread each. Every other request (including job mode, uploads, SSE
+and /api/transcribe) is handed to the Flask app unchanged on a thread pool.
+
+    gunicorn -c gunicorn_config.py -k uvicorn_worker.UvicornWorker asgi:application
+    uvicorn asgi:application --port 8000
+"""
+import io
+import os
+import sys
+import json
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from app import app, PipelineError, SermonInput, sermon_request_fields, validate_content_type
+from async_pipeline import run_sermon_pipeline_async
+from utils import llm_client, log_helpers, metrics
+
+# Threads serving the Flask routes; each sync request (transcription, SSE stream) holds one
+ASGI_WSGI_THREADS = int(os.environ.get("ASGI_WSGI_THREADS", "32"))
+
+# Default executor of the event loop: LLM cache I/O, PDF extraction, database reads and saves
+ASGI_BLOCKING_THREADS = int(os.environ.get("ASGI_BLOCKING_THREADS", "32"))
+
+Headers = List[Tuple[bytes, bytes]]
+
+_wsgi_executor: Optional[ThreadPoolExecutor] = None
+_wsgi_executor_pid: Optional[int] = None
+_wsgi_executor_lock = threading.Lock()
+
+def get_wsgi_executor() -> ThreadPoolExecutor:
+    global _wsgi_executor, _wsgi_executor_pid
+    pid = os.getpid()
+    with _wsgi_executor_lock:
+        if _wsgi_executor is None or _wsgi_executor_pid != pid:
+            _wsgi_executor = ThreadPoolExecutor(max_workers=ASGI_WSGI_THREADS, thread_name_prefix="wsgi")
+            _wsgi_executor_pid = pid
+        return _wsgi_executor
+
+class _RequestBody(io.RawIOBase):
+    """wsgi.input that pulls the request body from the ASGI receive channel as the WSGI thread reads it."""
+    def __init__(self, loop: asyncio.AbstractEventLoop, receive, buffered: bytes = b"", more_body: bool = True):
+        self._loop = loop
+        self._receive = receive
+        self._buffer = bytearray(buffered)
+        self._more_body = more_body
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, target) -> int:
+        while not self._buffer and self._more_body:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message["type"] == "http.disconnect":
+                self._more_body = False
+                break
+            self._buffer += message.get("body", b"")
+            self._more_body = message.get("more_body", False)
+        size = min(len(target), len(self._buffer))
+        target[:size] = self._buffer[:size]
+        del self._buffer[:size]
+        return size
+
+def _wsgi_environ(scope: Dict[str, Any], body: io.BufferedReader) -> Dict[str, Any]:
+    server = scope.get("server") or ("localhost", None)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": scope["client"][0] if scope.get("client") else "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False
+    }
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin-1")
+        value = raw_value.decode("latin-1")
+        if name == "content-type":
+            key = "CONTENT_TYPE"
+        elif name == "content-length":
+            key = "CONTENT_LENGTH"
+        else:
+            key = f"HTTP_{name.upper().replace('-', '_')}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+def _run_wsgi(environ: Dict[str, Any], loop: asyncio.AbstractEventLoop, send) -> None:
+    """Run the Flask app on this thread and forward its response chunk by chunk, so SSE keeps streaming."""
+    response: Dict[str, Any] = {}
+
+    def send_message(message: Dict[str, Any]) -> None:
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    def send_start() -> None:
+        if not response.get("started"):
+            send_message({"type": "http.response.start", "status": response["status"], "headers": response["headers"]})
+            response["started"] = True
+
+    def start_response(status: str, headers: List[Tuple[str, str]], exc_info=None):
+        if exc_info and response.get("started"):
+            raise exc_info[1].with_traceback(exc_info[2])
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+        return write
+
+    def write(data: bytes) -> None:
+        send_start()
+        send_message({"type": "http.response.body", "body": data, "more_body": True})
+
+    iterable = app.wsgi_app(environ, start_response)
+    try:
+        for chunk in iterable:
+            if chunk:
+                write(chunk)
+        send_start()
+        send_message({"type": "http.response.body", "body": b"", "more_body": False})
+    finally:
+        close = getattr(iterable, "close", None)
+        if close is not None:
+            close()
+
+async def call_flask(scope: Dict[str, Any], receive, send, buffered: bytes = b"", more_body: bool = True) -> None:
+    """Serve the request with the Flask app; buffered is body already read from receive."""
+    loop = asyncio.get_running_loop()
+    body = io.BufferedReader(_RequestBody(loop, receive, buffered, more_body))
+    await loop.run_in_executor(get_wsgi_executor(), _run_wsgi, _wsgi_environ(scope, body), loop, send)
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+# The headers add_cors_headers() puts on every Flask response
+CORS_HEADERS: Headers = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-headers", b"Content-Type, Authorization, X-Requested-With"),
+    (b"access-control-allow-methods", b"GET, POST, PUT, DELETE, OPTIONS"),
+    (b"access-control-allow-credentials", b"true")
+]
+
+async def _send_json(send, status: int, payload: Dict[str, Any], extra_headers: Optional[Headers] = None) -> None:
+    body = app.json.dumps(payload, separators=(",", ":")).encode("utf-8") + b"\n"
+    headers = [
+        (b"content-type", app.json.mimetype.encode("latin-1")),
+        (b"content-length", str(len(body)).encode("latin-1"))
+    ] + CORS_HEADERS + (extra_headers or [])
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+async def process_sermon(scope: Dict[str, Any], receive, send) -> None:
+    """
+    Async /api/process-sermon for JSON requests. Anything the sync view
+    answers differently (job mode, empty or non-JSON bodies) is passed to it.
+    """
+    started = time.perf_counter()
+    body = await _read_body(receive)
+    headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope.get("headers", [])}
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    try:
+        data = json.loads(body) if "json" in headers.get("content-type", "") else None
+    except ValueError:
+        data = None
+    wants_job = isinstance(data, dict) and (
+        data.get('async') is True or query.get('async', [''])[0].lower() in ('1', 'true', 'yes')
+    )
+    if not isinstance(data, dict) or not data or wants_job:
+        return await call_flask(scope, receive, send, buffered=body, more_body=False)
+
+    # Pipeline tasks and to_thread calls copy this context, so every stage logs under the request id
+    request_id = log_helpers.clean_request_id(headers.get(log_helpers.REQUEST_ID_HEADER.lower()))
+    with log_helpers.request_context(request_id):
+        app.logger.info("Processing sermon request", extra={"sermon_request": sermon_request_fields(data)})
+        try:
+            sermon_input = SermonInput(**data)
+            validate_content_type(sermon_input.content_type)
+            if 'no-cache' in headers.get('cache-control', '').lower():
+                sermon_input.use_cache = False
+            result = await run_sermon_pipeline_async(sermon_input)
+            status, payload = 200, {"success": True, **result}
+        except PipelineError as e:
+            status, payload = e.status_code, {"success": False, "error": str(e), **e.details}
+        except ValueError as e:
+            app.logger.error(f"Validation error: {str(e)}")
+            status, payload = 400, {"success": False, "error": str(e)}
+        except Exception as e:
+            app.logger.error(f"Process sermon error: {str(e)}", exc_info=True)
+            status, payload = 500, {"success": False, "error": str(e)}
+    await _send_json(send, status, payload, [(log_helpers.REQUEST_ID_HEADER.lower().encode("latin-1"), request_id.encode("latin-1"))])
+    metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, method="POST",
+                                         endpoint="/api/process-sermon", status=status)
+    metrics.HTTP_REQUEST_BYTES.observe(len(body), method="POST", endpoint="/api/process-sermon")
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(max_workers=ASGI_BLOCKING_THREADS, thread_name_prefix="asgi-blocking")
+            )
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await llm_client.close_async_client()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def application(scope: Dict[str, Any], receive, send) -> None:
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+    if scope["method"] == "POST" and scope["path"] == "/api/process-sermon":
+        return await process_sermon(scope, receive, send)
+    return await call_flask(scope, receive, send)
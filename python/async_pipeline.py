@@ -0,0 +1,428 @@
+"""
+asyncio implementation of the sermon pipeline, served by asgi.py. Stages,
+prompts, parsing, persistence and stage timing are the ones app.py uses (its
+pipeline helpers are called from both); only the waiting changes. LLM calls go through the async OpenRouter client, so a pipeline
+waiting on OpenRouter holds a coroutine instead of a thread, and independent
+calls (condense sections, designer calls) run together with asyncio.gather.
+Blocking work (YouTube metadata, PDF extraction, database reads and the final
+save, structured-output repairs) runs on the loop's default executor.
+"""
+import json
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from app import (
+    app,
+    CONDENSE_CHUNK_TOKENS,
+    CONDENSE_PROMPT_TEMPLATE,
+    CONDENSE_THRESHOLD_TOKENS,
+    DESIGNER_BATCH_PROMPT_TEMPLATE,
+    DESIGNER_MAX_WORKERS,
+    DESIGNER_PROMPT_TEMPLATE,
+    GAME_PLAN_FORMAT,
+    JSON_ARRAY_REPLY,
+    JSON_OBJECT_REPLY,
+    PLANNER_PROMPT_TEMPLATE,
+    QUESTION_FORMAT,
+    QUESTION_LIST_FORMAT,
+    STRUCTURED_OUTPUT,
+    WRITER_PROMPT_TEMPLATE,
+    SermonInput,
+    _no_event,
+    _no_progress,
+    check_extracted_text,
+    designed_question_rows,
+    designer_batch_size,
+    extract_sermon_pdf,
+    finish_pipeline,
+    game_from_plan,
+    new_sermon,
+    openrouter_error,
+    openrouter_payload,
+    overlaps_writer_and_designer,
+    parse_designed_batch,
+    parse_designed_question,
+    parse_game_plan,
+    parse_written_questions,
+    persist_generated_game,
+    pipeline_deadline,
+    questions_error,
+    reuse_existing_game,
+    save_unlinked_llm_calls,
+    sermon_fingerprint,
+    start_stage,
+    structured_question,
+    validate_content_type,
+    youtube_fingerprint,
+    youtube_summary_prompt
+)
+from database import SessionFactory
+from utils import llm_cache, llm_client, llm_journal, log_helpers
+from utils.json_stream import aiter_json_values, iter_json_values
+from utils.text_helpers import estimate_tokens, split_into_sections
+from utils.timing import StageTimer
+
+DEFAULT_MODEL = "google/gemini-2.0-flash-001"
+
+async def call_openrouter_async(prompt: str, model: str = DEFAULT_MODEL,
+                                stage: Optional[str] = None, use_cache: bool = True,
+                                response_format: Optional[Dict[str, Any]] = None,
+                                validate: Optional[llm_cache.Validator] = None) -> str:
+    """Async call_openrouter: same payload, cache entries, validation and error translation."""
+    payload = openrouter_payload(prompt, model, response_format)
+
+    async def fetch() -> str:
+        response_data = await llm_client.get_async_client().chat(payload, timeout=120)
+        log_helpers.log_payload(app.logger, "OpenRouter API response", model=model, stage=stage, response=response_data)
+        return llm_client.message_content(response_data)
+
+    try:
+        return await llm_cache.cached_completion_async(payload, fetch, stage=stage, use_cache=use_cache, validate=validate)
+    except llm_client.LLMClientError as e:
+        raise openrouter_error(e)
+
+async def stream_openrouter_json_async(prompt: str, model: str = DEFAULT_MODEL,
+                                       stage: Optional[str] = None, use_cache: bool = True,
+                                       response_format: Optional[Dict[str, Any]] = None,
+                                       validate: Optional[llm_cache.Validator] = None) -> AsyncIterator[Any]:
+    """
+    Async stream_openrouter_json: yields each element of the streamed JSON
+    array as it closes, through the same parser and completeness check, and
+    caches only a stream whose array closed and that passes validate.
+    """
+    payload = openrouter_payload(prompt, model, response_format)
+    with llm_journal.track(model, stage, use_cache) as call:
+        cache = llm_cache.get_cache() if use_cache else None
+        key = llm_cache.cache_key(payload)
+        cached = await asyncio.to_thread(cache.get, key, stage) if cache is not None else None
+        if cached is not None and not llm_cache.usable(cached, validate):
+            app.logger.info("Evicting unparseable LLM cache entry for stage %s", stage or 'default')
+            await asyncio.to_thread(cache.delete, key)
+            cached = None
+        if cached is not None:
+            call["cache_status"] = "hit"
+            try:
+                for value in iter_json_values([cached], require_array=True):
+                    yield value
+            except ValueError:
+                await asyncio.to_thread(cache.delete, key)
+                raise
+            return
+        if cache is None:
+            call["cache_status"] = "bypass"
+
+        received: List[str] = []
+        async def chunks() -> AsyncIterator[str]:
+            stream = llm_client.get_async_client().stream(
+                payload, timeout=120, on_usage=lambda chunk: llm_journal.apply_usage(call, chunk)
+            )
+            try:
+                async for chunk in stream:
+                    received.append(chunk)
+                    yield chunk
+            finally:
+                # Release the connection without waiting for trailing tokens
+                await stream.aclose()
+
+        try:
+            async for value in aiter_json_values(chunks(), require_array=True):
+                yield value
+        except llm_client.LLMClientError as e:
+            raise openrouter_error(e)
+        except ValueError as e:
+            app.logger.warning(f"Discarding streamed {stage or 'default'} response: {str(e)}")
+            raise
+        # aiter_json_values returns only once the array has closed, so completion is the whole answer
+        completion = "".join(received)
+        log_helpers.log_payload(app.logger, "OpenRouter API streamed response", model=model, stage=stage, response=completion)
+        llm_journal.estimate_usage(call, payload, completion)
+        if cache is not None and llm_cache.usable(completion, validate):
+            await asyncio.to_thread(cache.set, key, completion, stage)
+
+async def extract_text_from_youtube_async(youtube_url: str, use_cache: bool = True) -> str:
+    try:
+        prompt = await asyncio.to_thread(youtube_summary_prompt, youtube_url)
+        generated_content = await call_openrouter_async(prompt, stage="youtube", use_cache=use_cache)
+        app.logger.info("Generated content: %s characters", len(generated_content))
+        return generated_content
+    except Exception as e:
+        app.logger.error(f"YouTube processing error: {str(e)}", exc_info=True)
+        raise Exception(f"YouTube processing error: {str(e)}")
+
+async def design_question_async(question_data: Dict[str, Any], use_cache: bool = True,
+                                structured: bool = False) -> Dict[str, Any]:
+    designer_prompt = DESIGNER_PROMPT_TEMPLATE.format(question_json=json.dumps(question_data))
+    response = await call_openrouter_async(
+        designer_prompt,
+        stage="designer",
+        use_cache=use_cache,
+        response_format=QUESTION_FORMAT if structured else None,
+        validate=JSON_OBJECT_REPLY
+    )
+    if structured:
+        # A schema repair is a blocking LLM call
+        return await asyncio.to_thread(parse_designed_question, response, True, use_cache)
+    return parse_designed_question(response)
+
+async def design_question_batch_async(batch: List[Dict[str, Any]], use_cache: bool = True,
+                                      structured: bool = False) -> List[Optional[Dict[str, Any]]]:
+    designer_prompt = DESIGNER_BATCH_PROMPT_TEMPLATE.format(count=len(batch), questions_json=json.dumps(batch))
+    response = await call_openrouter_async(
+        designer_prompt,
+        stage="designer",
+        use_cache=use_cache,
+        response_format=QUESTION_LIST_FORMAT if structured else None,
+        validate=JSON_ARRAY_REPLY
+    )
+    if structured:
+        return await asyncio.to_thread(parse_designed_batch, response, len(batch), True, use_cache)
+    return parse_designed_batch(response, len(batch))
+
+def _bounded(limit: asyncio.Semaphore, call: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    async def run(*args):
+        async with limit:
+            return await call(*args)
+    return run
+
+async def design_questions_async(
+    questions: List[Dict[str, Any]],
+    use_cache: bool = True,
+    batch_size: Optional[int] = None,
+    structured: bool = False,
+    max_concurrency: Optional[int] = None
+) -> List[Optional[Dict[str, Any]]]:
+    """
+    Async design_questions: every designer call is gathered at once, at most
+    max_concurrency (DESIGNER_MAX_WORKERS) in flight per pipeline. Results
+    keep the question order; a failed question yields None. With batch_size,
+    elements that fail validation are redesigned one by one.
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(questions)
+    limit = asyncio.Semaphore(max_concurrency or DESIGNER_MAX_WORKERS)
+
+    pending = list(range(len(questions)))
+    if batch_size:
+        chunks = [pending[start:start + batch_size] for start in range(0, len(pending), batch_size)]
+        design_batch = _bounded(limit, design_question_batch_async)
+        batch_results = await asyncio.gather(
+            *(design_batch([questions[index] for index in chunk], use_cache, structured) for chunk in chunks),
+            return_exceptions=True
+        )
+        pending = []
+        for chunk, batch in zip(chunks, batch_results):
+            if isinstance(batch, BaseException):
+                app.logger.error(f"Error processing question batch {chunk[0] + 1}-{chunk[-1] + 1}: {str(batch)}")
+                batch = [None] * len(chunk)
+            for index, result in zip(chunk, batch):
+                if result is None:
+                    pending.append(index)
+                else:
+                    results[index] = result
+        if pending:
+            app.logger.info("Falling back to per-question design for %s question(s)", len(pending))
+
+    design = _bounded(limit, design_question_async)
+    designed = await asyncio.gather(
+        *(design(questions[index], use_cache, structured) for index in pending),
+        return_exceptions=True
+    )
+    for index, result in zip(pending, designed):
+        if isinstance(result, BaseException):
+            app.logger.error(f"Error processing question {index + 1}: {str(result)}")
+            result = None
+        results[index] = result
+    return results
+
+async def write_and_design_questions_async(
+    writer_prompt: str,
+    questions: List[Dict[str, Any]],
+    on_written: Callable[[], None],
+    use_cache: bool = True,
+    structured: bool = False,
+    max_concurrency: Optional[int] = None
+) -> List[Optional[Dict[str, Any]]]:
+    """
+    Async write_and_design_questions: a designer task starts for each question
+    as soon as it is parsed from the writer stream. Written questions are
+    appended to the caller's list and on_written() is called once the writer
+    stream ends; results keep their order.
+    """
+    limit = asyncio.Semaphore(max_concurrency or DESIGNER_MAX_WORKERS)
+
+    async def design_streamed(question_data: Any) -> Dict[str, Any]:
+        async with limit:
+            if structured:
+                question_data = await asyncio.to_thread(structured_question, question_data, use_cache)
+                if question_data is None:
+                    raise ValueError("Written question does not match the schema")
+            return await design_question_async(question_data, use_cache, structured)
+
+    tasks: List["asyncio.Task[Dict[str, Any]]"] = []
+    try:
+        async for question_data in stream_openrouter_json_async(
+            writer_prompt,
+            stage="writer",
+            use_cache=use_cache,
+            response_format=QUESTION_LIST_FORMAT if structured else None,
+            validate=JSON_ARRAY_REPLY
+        ):
+            tasks.append(asyncio.ensure_future(design_streamed(question_data)))
+            questions.append(question_data)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    app.logger.info("Writer streamed %s questions; %s designer calls started before it finished", len(questions), max(0, len(tasks) - 1))
+    on_written()
+    designed = await asyncio.gather(*tasks, return_exceptions=True)
+    results: List[Optional[Dict[str, Any]]] = []
+    for index, result in enumerate(designed):
+        if isinstance(result, BaseException):
+            app.logger.error(f"Error processing question {index + 1}: {str(result)}")
+            result = None
+        results.append(result)
+    return results
+
+async def condense_sermon_text_async(text: str, use_cache: bool = True, depth: int = 0) -> str:
+    """Async condense_sermon_text: all section summaries are gathered at once."""
+    sections = split_into_sections(text, CONDENSE_CHUNK_TOKENS)
+    max_words = max(100, CONDENSE_CHUNK_TOKENS // 8)
+    app.logger.info("Condensing sermon of ~%s tokens in %s sections", estimate_tokens(text), len(sections))
+
+    async def summarize(index: int) -> str:
+        prompt = CONDENSE_PROMPT_TEMPLATE.format(
+            section=index + 1, total=len(sections), max_words=max_words, section_text=sections[index]
+        )
+        return (await call_openrouter_async(prompt, stage="condense", use_cache=use_cache)).strip()
+
+    summarize = _bounded(asyncio.Semaphore(DESIGNER_MAX_WORKERS), summarize)
+    summaries = await asyncio.gather(*(summarize(index) for index in range(len(sections))), return_exceptions=True)
+    for index, summary in enumerate(summaries):
+        if isinstance(summary, BaseException):
+            # Keep the original section rather than losing its content
+            app.logger.error(f"Error condensing section {index + 1}: {str(summary)}")
+            summaries[index] = sections[index]
+
+    condensed = "\n\n".join(summaries)
+    app.logger.info("Condensed sermon to ~%s tokens", estimate_tokens(condensed))
+    if estimate_tokens(condensed) > CONDENSE_THRESHOLD_TOKENS and depth < 2 and len(sections) > 1:
+        return await condense_sermon_text_async(condensed, use_cache=use_cache, depth=depth + 1)
+    return condensed
+
+def _find_existing_game(fingerprint: str, force_regenerate: bool) -> Optional[Dict[str, Any]]:
+    session = SessionFactory()
+    try:
+        return reuse_existing_game(session, fingerprint, force_regenerate, _no_progress, _no_event)
+    finally:
+        session.close()
+
+def _save_game(sermon, game, question_rows):
+    session = SessionFactory()
+    try:
+        return persist_generated_game(session, sermon, game, question_rows)
+    finally:
+        session.close()
+
+async def run_sermon_pipeline_async(sermon_input: SermonInput, pdf_path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Async run_sermon_pipeline: same stages, reuse rules, response payload and
+    LLM call journal. Each database step runs on its own short-lived session
+    in the executor, so no connection is held while the pipeline waits on OpenRouter.
+    """
+    with llm_journal.collecting() as journal:
+        try:
+            with pipeline_deadline():
+                return await _run_sermon_pipeline_async(sermon_input, pdf_path)
+        finally:
+            await asyncio.to_thread(save_unlinked_llm_calls, journal)
+
+async def _run_sermon_pipeline_async(sermon_input: SermonInput, pdf_path: Optional[str]) -> Dict[str, Any]:
+    validate_content_type(sermon_input.content_type)
+    timer = StageTimer()
+    structured = STRUCTURED_OUTPUT if sermon_input.structured_output is None else sermon_input.structured_output
+    use_cache = sermon_input.use_cache
+
+    # YouTube sermons are fingerprinted by video id, so a duplicate skips extraction too
+    fingerprint = youtube_fingerprint(sermon_input)
+    if fingerprint is not None:
+        existing = await asyncio.to_thread(_find_existing_game, fingerprint, sermon_input.force_regenerate)
+        if existing is not None:
+            return existing
+
+    timer.mark("extraction")
+    if sermon_input.content_type == 'youtube':
+        text = await extract_text_from_youtube_async(sermon_input.content, use_cache=use_cache)
+    elif sermon_input.content_type == 'pdf':
+        text = await asyncio.to_thread(extract_sermon_pdf, sermon_input, pdf_path)
+    else:
+        text = sermon_input.content
+
+    check_extracted_text(text)
+
+    if fingerprint is None:
+        fingerprint = sermon_fingerprint(text, sermon_input.custom_prompt)
+        existing = await asyncio.to_thread(_find_existing_game, fingerprint, sermon_input.force_regenerate)
+        if existing is not None:
+            return existing
+
+    sermon = new_sermon(sermon_input, fingerprint)
+
+    if estimate_tokens(text) > CONDENSE_THRESHOLD_TOKENS:
+        start_stage(timer, "condense")
+        text = await condense_sermon_text_async(text, use_cache=use_cache)
+
+    start_stage(timer, "planner")
+    planner_response = await call_openrouter_async(
+        PLANNER_PROMPT_TEMPLATE.format(text=text, custom_prompt=sermon_input.custom_prompt),
+        stage="planner",
+        use_cache=use_cache,
+        response_format=GAME_PLAN_FORMAT if structured else None,
+        validate=JSON_OBJECT_REPLY
+    )
+    if structured:
+        game_plan = await asyncio.to_thread(parse_game_plan, planner_response, True, use_cache)
+    else:
+        game_plan = parse_game_plan(planner_response)
+    game = game_from_plan(game_plan)
+
+    start_stage(timer, "writer")
+    question_writer_prompt = WRITER_PROMPT_TEMPLATE.format(game_plan_json=json.dumps(game_plan.dict()))
+    questions: List[Dict[str, Any]] = []
+    if overlaps_writer_and_designer(sermon_input):
+        try:
+            designed_results = await write_and_design_questions_async(
+                question_writer_prompt,
+                questions,
+                lambda: timer.mark("designer"),
+                use_cache=use_cache,
+                structured=structured
+            )
+        except Exception as e:
+            raise questions_error(e, questions)
+    else:
+        question_writer_response = await call_openrouter_async(
+            question_writer_prompt,
+            stage="writer",
+            use_cache=use_cache,
+            response_format=QUESTION_LIST_FORMAT if structured else None,
+            validate=JSON_ARRAY_REPLY
+        )
+        if structured:
+            questions = await asyncio.to_thread(parse_written_questions, question_writer_response, True, use_cache)
+        else:
+            questions = parse_written_questions(question_writer_response)
+
+        start_stage(timer, "designer")
+        designed_results = await design_questions_async(
+            questions,
+            use_cache=use_cache,
+            batch_size=designer_batch_size(sermon_input, len(questions)),
+            structured=structured
+        )
+
+    designed_questions, question_rows = designed_question_rows(designed_results)
+
+    start_stage(timer, "save")
+    sermon_id, game_id = await asyncio.to_thread(_save_game, sermon, game, question_rows)
+    return finish_pipeline(timer, sermon_input, game_plan, designed_questions, sermon_id, game_id)
@@ -0,0 +1,122 @@
+"""
+GET /api/games/<id> and GET /api/games against a database with 100k
+questions, before and after migrate.py adds the foreign-key and ordering
+indexes. The database is seeded without those indexes, timed, migrated in
+place, and timed again.
+
+    python benchmarks/bench_games_at_scale.py [--questions 100000] [--per-game 12] [--requests 300]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, Sermon, Game, Question, upgrade_schema
+from queries import game_json, list_games
+
+# Indexes that did not exist before; dropped after create_all to recreate the old schema
+NEW_INDEXES = (
+    "ix_questions_game_id",
+    "ix_questions_created_at",
+    "ix_sermons_created_at",
+    "ix_games_created_at_id",
+    "ix_games_sermon_id_created_at_id",
+    "ix_games_theme_created_at_id"
+)
+
+def seed(engine, question_count, per_game):
+    game_count = question_count // per_game
+    sermon_count = max(1, game_count // 2)
+    started_at = datetime(2024, 1, 1)
+    with engine.begin() as connection:
+        connection.execute(insert(Sermon), [
+            {"title": f"Sermon {s}", "content_type": "text", "content": "benchmark", "created_at": started_at}
+            for s in range(sermon_count)
+        ])
+        connection.execute(insert(Game), [{
+            "sermon_id": g % sermon_count + 1,
+            "theme": f"Theme {g % 40}",
+            "main_topics": ["faith", "hope", "love"],
+            "game_structure": {"format": "quiz", "rules": "answer each question " * 20},
+            "created_at": started_at + timedelta(minutes=g)
+        } for g in range(game_count)])
+        for start in range(0, question_count, 20000):
+            connection.execute(insert(Question), [{
+                # Questions of one game are interleaved with others, as with concurrent pipelines
+                "game_id": q % game_count + 1,
+                "text": f"Question {q}?",
+                "correct_answer": "answer",
+                "question_type": "single-answer-multiple-choice",
+                "options": ["a", "b", "c"],
+                "hints": ["hint"],
+                "learning_points": ["point"],
+                "difficulty": "easy"
+            } for q in range(start, min(start + 20000, question_count))])
+    return game_count, sermon_count
+
+def timed(Session, call, requests):
+    started = time.perf_counter()
+    for _ in range(requests):
+        session = Session()
+        try:
+            call(session)
+        finally:
+            session.close()
+    return (time.perf_counter() - started) / requests * 1000
+
+def measure(Session, game_count, sermon_count, requests):
+    deep_cursor = None
+    session = Session()
+    for _ in range(20):
+        _, deep_cursor = list_games(session, limit=50, cursor=deep_cursor)
+    session.close()
+
+    cases = (
+        ("get_game", lambda s: game_json(s, random.randint(1, game_count))),
+        ("list_games first page", lambda s: list_games(s, limit=50)),
+        ("list_games page 21", lambda s: list_games(s, limit=50, cursor=deep_cursor)),
+        ("list_games by sermon", lambda s: list_games(s, limit=50, sermon_id=random.randint(1, sermon_count))),
+        ("list_games by theme", lambda s: list_games(s, limit=50, theme=f"Theme {random.randint(0, 39)}"))
+    )
+    return {name: timed(Session, call, requests) for name, call in cases}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=100000)
+    parser.add_argument("--per-game", type=int, default=12)
+    parser.add_argument("--requests", type=int, default=300)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            for name in NEW_INDEXES:
+                connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        game_count, sermon_count = seed(engine, args.questions, args.per_game)
+        print(f"Seeded {args.questions} questions in {game_count} games")
+        Session = sessionmaker(bind=engine)
+
+        before = measure(Session, game_count, sermon_count, args.requests)
+        started = time.perf_counter()
+        applied = upgrade_schema(engine)
+        with engine.begin() as connection:
+            connection.execute(text("ANALYZE"))
+        print(f"Migrated in place: {len(applied)} change(s) in {time.perf_counter() - started:.2f}s")
+        after = measure(Session, game_count, sermon_count, args.requests)
+
+        print(f"{'':24} {'before':>12} {'after':>12}")
+        for name in before:
+            print(f"{name:24} {before[name]:9.3f} ms {after[name]:9.3f} ms")
+        engine.dispose()
+
+if __name__ == "__main__":
+    main()
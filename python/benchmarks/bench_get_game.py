@@ -0,0 +1,116 @@
+"""
+Per-request cost of loading and serializing a game for GET /api/games/<id>:
+the previous two-query ORM fetch plus json.dumps, against the single-query
+row serialization in queries.py.
+
+    python benchmarks/bench_get_game.py [--games 200] [--questions 12] [--requests 2000]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, Sermon, Game, Question
+from queries import game_json
+
+def orm_json(session, game_id):
+    """The previous implementation: two queries, fully hydrated ORM objects, then encoding."""
+    game = session.query(Game).filter_by(id=game_id).first()
+    if not game:
+        return None
+    questions = session.query(Question).filter_by(game_id=game_id).all()
+    return json.dumps({
+        "id": game.id,
+        "theme": game.theme,
+        "main_topics": game.main_topics,
+        "game_structure": game.game_structure,
+        "questions": [{
+            "id": q.id,
+            "question": q.text,
+            "correct_answer": q.correct_answer,
+            "question_type": q.question_type,
+            "options": q.options,
+            "hints": q.hints,
+            "learning_points": q.learning_points
+        } for q in questions]
+    })
+
+def seed(Session, games, questions_per_game):
+    session = Session()
+    sermon = Sermon(title="Benchmark", content_type="text", content="benchmark")
+    session.add(sermon)
+    session.flush()
+    for g in range(games):
+        game = Game(
+            sermon_id=sermon.id,
+            theme=f"Theme {g}",
+            main_topics=["faith", "hope", "love"],
+            game_structure={"format": "quiz", "rules": "answer each question"}
+        )
+        session.add(game)
+        session.flush()
+        session.add_all(Question(
+            game_id=game.id,
+            text=f"Question {q} of game {g}?",
+            correct_answer="answer",
+            question_type="single-answer-multiple-choice",
+            options=["a", "b", "c"],
+            hints=["hint one", "hint two"],
+            learning_points=["point one", "point two"],
+            difficulty="easy"
+        ) for q in range(questions_per_game))
+    session.commit()
+    session.close()
+
+def run(Session, engine, load, game_ids, requests):
+    statements = 0
+    def count(*args):
+        nonlocal statements
+        statements += 1
+    event.listen(engine, "before_cursor_execute", count)
+    started = time.perf_counter()
+    for _ in range(requests):
+        session = Session()
+        try:
+            load(session, random.choice(game_ids))
+        finally:
+            session.close()
+    elapsed = time.perf_counter() - started
+    event.remove(engine, "before_cursor_execute", count)
+    return elapsed / requests * 1e6, statements / requests
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--games", type=int, default=200)
+    parser.add_argument("--questions", type=int, default=12)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+        seed(Session, args.games, args.questions)
+        game_ids = list(range(1, args.games + 1))
+
+        # Same output from both paths before timing anything
+        session = Session()
+        assert json.loads(orm_json(session, 1)) == json.loads(game_json(session, 1))
+        session.close()
+
+        for name, load in (("orm (before)", orm_json), ("single query (after)", game_json)):
+            run(Session, engine, load, game_ids, min(200, args.requests))  # warm up
+            per_request_us, queries = run(Session, engine, load, game_ids, args.requests)
+            print(f"{name:22} {per_request_us:8.1f} us/request  {queries:.1f} queries/request")
+        engine.dispose()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import os
+import time
+import logging
+from typing import Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Any SQLAlchemy URL; point it at a server database (e.g. postgresql+psycopg2://...) for multi-host deployments
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///sermon_games.db")
+
+# Connection pool per worker process
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
+
+# SQLite tuning: how long a writer waits for the lock, and how much of the file is memory-mapped
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get("SQLITE_CACHE_SIZE_KB", "16384"))
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """
+    WAL lets readers run while a write is in progress, busy_timeout makes
+    writers queue for the lock instead of failing with "database is locked",
+    and synchronous=NORMAL skips the per-commit fsync that WAL makes safe to drop.
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
+def create_db_engine(url: Optional[str] = None, **options) -> Engine:
+    """
+    Build the engine for url (DATABASE_URL by default). SQLite connections get
+    the WAL/busy_timeout/mmap pragmas; server databases get a pre-pinged,
+    recycled connection pool. Extra options are passed to create_engine.
+    """
+    url = make_url(url or DATABASE_URL)
+    if url.get_backend_name() == "sqlite":
+        engine_options = {
+            "connect_args": {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT
+        }
+        if url.database in (None, "", ":memory:"):
+            # In-memory databases keep SQLAlchemy's default per-thread connection pool
+            engine_options = {"connect_args": {"check_same_thread": False}}
+    else:
+        engine_options = {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE,
+            "pool_pre_ping": True
+        }
+    engine_options.update(options)
+    engine = create_engine(url, **engine_options)
+
+    if url.get_backend_name() == "sqlite":
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+
+    # A forked worker must not reuse the parent's pooled connections
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
+
+    logger.info("Database engine created for %s", url.render_as_string(hide_password=True))
+    return engine
+
+engine = create_db_engine()
+
+# Independent sessions for background work (jobs, streaming threads); always close them
+SessionFactory = sessionmaker(bind=engine)
+
+# Commit time (flush included) of every session goes to the db_commit_duration_seconds histogram
+@event.listens_for(SessionFactory, "before_commit")
+def _start_commit_timer(session) -> None:
+    session.info["commit_started"] = time.perf_counter()
+
+@event.listens_for(SessionFactory, "after_commit")
+def _observe_commit(session) -> None:
+    started = session.info.pop("commit_started", None)
+    if started is not None:
+        metrics.DB_COMMIT_SECONDS.observe(time.perf_counter() - started)
+
+# Thread-local session for request handlers; app.py removes it when each request ends
+Session = scoped_session(SessionFactory)
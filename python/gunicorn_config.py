@@ -0,0 +1,89 @@
+"""
+Production gunicorn settings. Request handlers spend almost all of their time
+waiting on OpenRouter, so each worker process runs many threads: processes
+scale with CPU count, threads with the expected number of concurrent LLM-bound
+requests. Every value can be overridden from the environment.
+
+    gunicorn -c gunicorn_config.py app:app
+    gunicorn -c gunicorn_config.py -k uvicorn_worker.UvicornWorker asgi:application
+
+With the uvicorn worker, /api/process-sermon runs on each worker's event loop
+and the thread settings below only size the database pool.
+"""
+import os
+import math
+import tempfile
+import multiprocessing
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CPU_COUNT = multiprocessing.cpu_count()
+
+# Concurrent requests (pipelines, transcriptions, reads) the host should hold in flight
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", "64"))
+
+# Longest a synchronous /api/process-sermon request is expected to run
+PIPELINE_TIMEOUT_SECONDS = int(os.environ.get("PIPELINE_TIMEOUT_SECONDS", "600"))
+
+bind = os.environ.get("GUNICORN_BIND", f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+
+# One process per core for the CPU-bound parts (JSON, PDF orchestration); threads cover the I/O waits
+workers = int(os.environ.get("WEB_CONCURRENCY", str(max(2, CPU_COUNT))))
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", str(max(4, math.ceil(LLM_CONCURRENCY / workers)))))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", str(max(100, threads * 4))))  # gevent/eventlet only
+
+# Size the per-process pools to the thread count so no request thread waits on a connection
+os.environ.setdefault("DB_POOL_SIZE", str(threads))
+os.environ.setdefault("LLM_POOL_SIZE", str(threads * int(os.environ.get("DESIGNER_MAX_WORKERS", "6"))))
+
+# Import the app once in the master so workers fork with it loaded. The database
+# engine, LLM client, LLM cache and PDF process pool are all rebuilt per process
+# after the fork; the connection pre-warm runs in each worker instead of the master.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1").lower() in ("1", "true", "yes")
+_prewarm = os.environ.get("LLM_PREWARM", "1").lower() in ("1", "true", "yes")
+if preload_app:
+    os.environ["LLM_PREWARM"] = "0"
+
+# Recycle workers periodically; the jitter keeps them from restarting together
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", str(max(1, max_requests // 10))))
+
+# Longer than the pipeline so a synchronous sermon is never killed or cut off by a reload
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", str(PIPELINE_TIMEOUT_SECONDS + 60)))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", str(PIPELINE_TIMEOUT_SECONDS + 30)))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "5"))
+
+# Heartbeat files on tmpfs so a slow disk can't make workers look hung
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# Workers write metric snapshots to one directory per master, which /metrics sums in any worker
+_own_metrics_dir = "METRICS_DIR" not in os.environ
+os.environ.setdefault("METRICS_DIR", os.path.join(worker_tmp_dir or tempfile.gettempdir(), f"sermon-metrics-{os.getpid()}"))
+
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", "-")
+errorlog = "-"
+loglevel = os.environ.get("GUNICORN_LOG_LEVEL", "info")
+
+def on_starting(server):
+    from selfcheck import run_self_check
+    if not run_self_check(verbose=False):
+        raise SystemExit("Startup self-check failed")
+    from utils import metrics
+    metrics.reset_directory(os.environ["METRICS_DIR"])
+    server.log.info(f"{workers} {worker_class} workers x {threads} threads for ~{LLM_CONCURRENCY} concurrent requests")
+
+def post_fork(server, worker):
+    # Never share the master's pooled database connections with a worker
+    from database import engine
+    engine.dispose(close=False)
+    if _prewarm:
+        from utils import llm_client
+        llm_client.prewarm_in_background()
+
+def on_exit(server):
+    if _own_metrics_dir:
+        import shutil
+        shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
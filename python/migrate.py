@@ -0,0 +1,57 @@
+"""
+Bring a live database up to date with models.py without dropping data:
+creates missing tables, adds missing columns and builds missing indexes,
+all in one transaction. A NOT NULL column is filled with its default on
+existing rows; one without a default is reported and nothing is applied.
+Safe to run repeatedly.
+
+    python migrate.py              # apply pending changes to DATABASE_URL
+    python migrate.py --dry-run    # print the pending DDL only
+    python migrate.py --url sqlite:///other.db
+"""
+import sys
+import time
+import argparse
+
+from sqlalchemy import text
+
+from database import create_db_engine
+from models import SchemaMigrationError, schema_changes, upgrade_schema
+
+def describe(change, engine) -> str:
+    return " ".join(str(change.compile(dialect=engine.dialect)).split())
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Database URL (default: DATABASE_URL)")
+    parser.add_argument("--dry-run", action="store_true", help="Print the pending changes without applying them")
+    args = parser.parse_args()
+
+    engine = create_db_engine(args.url)
+    try:
+        try:
+            pending = schema_changes(engine)
+        except SchemaMigrationError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+        if not pending:
+            print("Database schema is up to date.")
+            return 0
+        for change in pending:
+            print(f"{'Pending' if args.dry_run else 'Applying'}: {describe(change, engine)}")
+        if args.dry_run:
+            return 0
+
+        started = time.perf_counter()
+        applied = upgrade_schema(engine)
+        if engine.dialect.name == "sqlite":
+            # Refresh the planner statistics so the new indexes are used right away
+            with engine.begin() as connection:
+                connection.execute(text("ANALYZE"))
+        print(f"Applied {len(applied)} change(s) in {time.perf_counter() - started:.2f}s.")
+        return 0
+    finally:
+        engine.dispose()
+
+if __name__ == "__main__":
+    sys.exit(main())
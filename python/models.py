@@ -1,6 +1,8 @@
 from datetime import datetime
 from typing import List, Optional, Dict, Any
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, JSON
+from sqlalchemy import Boolean, Column, Integer, Float, String, DateTime, ForeignKey, Text, JSON, Index, inspect, literal
+from sqlalchemy.exc import CompileError
+from sqlalchemy.schema import DDL, DDLElement, CreateIndex, CreateTable
 from sqlalchemy.orm import relationship, declarative_base
 from pydantic import BaseModel, Field
 
@@ -17,7 +19,8 @@ class Sermon(Base):
     content_type = Column(String(50), nullable=False)  # 'youtube', 'pdf', 'text'
     source_url = Column(String(255), nullable=True)  # Optional URL source
     custom_prompt = Column(Text, nullable=True)  # Custom instructions
-    created_at = Column(DateTime, default=datetime.utcnow)
+    content_fingerprint = Column(String(64), nullable=True, unique=True, index=True)  # SHA-256 of normalized content + prompt
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     games = relationship("Game", back_populates="sermon")
 
 class Game(Base):
@@ -32,11 +35,18 @@ class Game(Base):
     sermon = relationship("Sermon", back_populates="games")
     questions = relationship("Question", back_populates="game")
 
+    # Keyset pagination of /api/games, unfiltered and filtered by sermon or theme
+    __table_args__ = (
+        Index("ix_games_created_at_id", "created_at", "id"),
+        Index("ix_games_sermon_id_created_at_id", "sermon_id", "created_at", "id"),
+        Index("ix_games_theme_created_at_id", "theme", "created_at", "id"),
+    )
+
 class Question(Base):
     __tablename__ = "questions"
     
     id = Column(Integer, primary_key=True, index=True)
-    game_id = Column(Integer, ForeignKey("games.id"))
+    game_id = Column(Integer, ForeignKey("games.id"), index=True)
     text = Column(Text, nullable=False)  # This is likely named 'text' instead of 'question'
     correct_answer = Column(JSON, nullable=False)
     question_type = Column(String(50), nullable=False)
@@ -44,9 +54,116 @@ class Question(Base):
     hints = Column(JSON, nullable=True)
     learning_points = Column(JSON, nullable=True)
     difficulty = Column(String(20), nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     game = relationship("Game", back_populates="questions")
 
+class SermonJob(Base):
+    __tablename__ = "sermon_jobs"
+    
+    id = Column(String(32), primary_key=True)  # uuid4 hex
+    status = Column(String(20), nullable=False, default="queued")  # 'queued', 'running', 'completed', 'failed'
+    stage = Column(String(50), nullable=False, default="queued")  # Current pipeline stage
+    progress = Column(Integer, nullable=False, default=0)  # 0-100
+    attempts = Column(Integer, nullable=False, default=0)  # Incremented each time a worker claims the job
+    payload = Column(JSON, nullable=False)  # The original SermonInput, so the job can be resumed
+    upload_path = Column(String(1024), nullable=True)  # Spooled PDF upload, removed once the job finishes
+    sermon_id = Column(Integer, ForeignKey("sermons.id"), nullable=True, index=True)
+    game_id = Column(Integer, ForeignKey("games.id"), nullable=True, index=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # resume_stale_jobs() scans unfinished jobs by last update
+    __table_args__ = (
+        Index("ix_sermon_jobs_status_updated_at", "status", "updated_at"),
+    )
+
+class LLMCall(Base):
+    __tablename__ = "llm_calls"
+
+    id = Column(Integer, primary_key=True)
+    sermon_id = Column(Integer, ForeignKey("sermons.id"), nullable=True, index=True)  # Null if the pipeline failed before saving
+    game_id = Column(Integer, ForeignKey("games.id"), nullable=True, index=True)
+    request_id = Column(String(64), nullable=True, index=True)  # X-Request-ID of the request (or job) that made the call, as logged
+    stage = Column(String(50), nullable=False)  # 'youtube', 'condense', 'planner', 'writer', 'designer', 'repair', ...
+    model = Column(String(255), nullable=False)
+    cache_status = Column(String(10), nullable=False)  # 'hit', 'miss' or 'bypass' (LLM cache disabled for the call)
+    outcome = Column(String(20), nullable=False)  # 'ok', 'rate_limited', 'client_error', 'server_error', 'error', 'cancelled'
+    prompt_tokens = Column(Integer, nullable=True)
+    completion_tokens = Column(Integer, nullable=True)
+    cached_tokens = Column(Integer, nullable=True)  # Prompt tokens served from the provider's prompt cache
+    cost = Column(Float, nullable=True)  # OpenRouter credits, when reported
+    usage_estimated = Column(Boolean, nullable=True, default=False)  # Token counts estimated locally (no usage block received)
+    latency_ms = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class SchemaMigrationError(Exception):
+    """A model column is missing from the database and can't be added without a value for the existing rows."""
+
+def schema_changes(engine) -> List[DDLElement]:
+    """
+    List the DDL that brings an existing database up to date with the models
+    without dropping data: missing tables, missing columns and missing
+    indexes. Nothing is executed; an up-to-date database yields an empty list.
+    Raises SchemaMigrationError for NOT NULL columns that need a manual
+    migration because they have no default to fill the existing rows with.
+    """
+    inspector = inspect(engine)
+    changes: List[DDLElement] = []
+    manual: List[str] = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            changes.append(CreateTable(table))
+            changes.extend(CreateIndex(index) for index in table.indexes)
+            continue
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            change = _add_column(engine, column)
+            if change is None:
+                manual.append(f"{table.name}.{column.name}")
+            else:
+                changes.append(change)
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        changes.extend(CreateIndex(index) for index in table.indexes if index.name not in existing_indexes)
+    if manual:
+        raise SchemaMigrationError(f"NOT NULL column(s) without a default need a manual migration: {', '.join(manual)}")
+    return changes
+
+def _add_column(engine, column: Column) -> Optional[DDL]:
+    """
+    ALTER TABLE ... ADD COLUMN for column, with identifiers quoted for the
+    engine's dialect. A NOT NULL column takes its server default, or its
+    scalar Python default as one, so existing rows get a value; None if it
+    has neither.
+    """
+    dialect = engine.dialect
+    specification = dialect.ddl_compiler(dialect, None).get_column_specification(column)
+    if not column.nullable and column.server_default is None:
+        if column.default is None or not column.default.is_scalar:
+            return None
+        try:
+            value = literal(column.default.arg, type_=column.type).compile(dialect=dialect, compile_kwargs={"literal_binds": True})
+        except (CompileError, NotImplementedError):
+            return None
+        specification = f"{specification} DEFAULT {value}"
+    table_name = dialect.identifier_preparer.format_table(column.table)
+    # DDL() applies %-formatting to its statement
+    return DDL(f"ALTER TABLE {table_name} ADD COLUMN {specification}".replace("%", "%%"))
+
+def upgrade_schema(engine) -> List[DDLElement]:
+    """
+    Apply schema_changes() in one transaction and return what was applied.
+    create_all() only creates whole tables, so it can't do this on its own.
+    """
+    changes = schema_changes(engine)
+    if changes:
+        with engine.begin() as connection:
+            for change in changes:
+                connection.execute(change)
+    return changes
+
 # Pydantic Models (for API)
 class SermonBase(BaseModel):
     title: str
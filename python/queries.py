@@ -0,0 +1,249 @@
+import json
+import base64
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Text, bindparam, case, cast, func, insert, select, tuple_, update
+
+from models import Game, LLMCall, Question, Sermon
+
+# Columns served by GET /api/games/<id>; nothing else is read from the database.
+# JSON columns are CAST to text in SQL, so the database returns their JSON text
+# (drivers such as psycopg2 would otherwise decode them), and spliced into the
+# response as-is, so they are never decoded and re-encoded.
+GAME_COLUMNS = (
+    Game.id,
+    Game.theme,
+    cast(Game.main_topics, Text),
+    cast(Game.game_structure, Text)
+)
+QUESTION_COLUMNS = (
+    Question.id,
+    Question.text,
+    cast(Question.correct_answer, Text),
+    Question.question_type,
+    cast(Question.options, Text),
+    cast(Question.hints, Text),
+    cast(Question.learning_points, Text)
+)
+
+_game_with_questions = (
+    select(*GAME_COLUMNS, *QUESTION_COLUMNS)
+    .outerjoin(Question, Question.game_id == Game.id)
+    .where(Game.id == bindparam("game_id"))
+    .order_by(Question.id)
+)
+
+def _raw(value: Any) -> str:
+    """JSON text of a column read through cast(..., Text); encodes it if a driver decoded it anyway."""
+    if value is None:
+        return "null"
+    return value if isinstance(value, str) else json.dumps(value)
+
+def game_json(session, game_id: int) -> Optional[str]:
+    """
+    Load a game and its questions in a single LEFT JOIN query and return the
+    game object of the API response as JSON text. The statement runs on the
+    session's connection as plain Core, so no ORM objects or identity-map
+    entries are created. Returns None if the game doesn't exist.
+    """
+    rows = session.connection().execute(_game_with_questions, {"game_id": game_id}).all()
+    if not rows:
+        return None
+
+    dumps = json.dumps
+    questions = ",".join(
+        f'{{"id":{question_id},"question":{dumps(text)},"correct_answer":{_raw(correct_answer)},'
+        f'"question_type":{dumps(question_type)},"options":{_raw(options)},'
+        f'"hints":{_raw(hints)},"learning_points":{_raw(learning_points)}}}'
+        for (_, _, _, _, question_id, text, correct_answer, question_type, options, hints, learning_points) in rows
+        if question_id is not None
+    )
+    game_id, theme, main_topics, game_structure = rows[0][:4]
+    return (
+        f'{{"id":{game_id},"theme":{dumps(theme)},"main_topics":{_raw(main_topics)},'
+        f'"game_structure":{_raw(game_structure)},"questions":[{questions}]}}'
+    )
+
+# Fields GET /api/games can return; game_structure is only read when asked for
+GAME_LIST_FIELDS = {
+    "id": Game.id,
+    "theme": Game.theme,
+    "main_topics": Game.main_topics,
+    "game_structure": Game.game_structure,
+    "sermon_id": Game.sermon_id,
+    "created_at": Game.created_at
+}
+DEFAULT_GAME_LIST_FIELDS = ("id", "theme", "main_topics", "sermon_id", "created_at")
+
+def encode_cursor(created_at: datetime, game_id: int) -> str:
+    """Opaque keyset cursor for the (created_at, id) position of the last game on a page."""
+    raw = json.dumps([created_at.isoformat(), game_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, game_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(game_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {str(e)}")
+
+def list_games(
+    session,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    sermon_id: Optional[int] = None,
+    theme: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    fields: Sequence[str] = DEFAULT_GAME_LIST_FIELDS
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Return one page of games, newest first, and the cursor for the next page
+    (None on the last page). Pages are keyed on (created_at, id) so each one is
+    an index range scan no matter how deep the client pages. Only the columns
+    named in fields are selected.
+    """
+    unknown = [field for field in fields if field not in GAME_LIST_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(GAME_LIST_FIELDS)}")
+
+    # created_at and id are always read because the cursor is built from them
+    columns = [Game.created_at.label("_created_at"), Game.id.label("_id")]
+    columns += [GAME_LIST_FIELDS[field].label(field) for field in fields]
+    statement = select(*columns).order_by(Game.created_at.desc(), Game.id.desc()).limit(limit + 1)
+
+    if cursor:
+        cursor_created_at, cursor_id = decode_cursor(cursor)
+        statement = statement.where(tuple_(Game.created_at, Game.id) < tuple_(cursor_created_at, cursor_id))
+    if sermon_id is not None:
+        statement = statement.where(Game.sermon_id == sermon_id)
+    if theme:
+        statement = statement.where(Game.theme == theme)
+    if created_after is not None:
+        statement = statement.where(Game.created_at >= created_after)
+    if created_before is not None:
+        statement = statement.where(Game.created_at < created_before)
+
+    rows = session.connection().execute(statement).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]._created_at, rows[-1]._id)
+
+    games = []
+    for row in rows:
+        game = {field: getattr(row, field) for field in fields}
+        if game.get("created_at") is not None:
+            game["created_at"] = game["created_at"].isoformat()
+        games.append(game)
+    return games, next_cursor
+
+def save_generated_game(session, sermon: Sermon, game: Game, questions: List[Dict[str, Any]],
+                        llm_calls: Sequence[Dict[str, Any]] = ()) -> Tuple[int, int]:
+    """
+    Write a generated sermon, its game and questions in one transaction and
+    return (sermon_id, game_id). Questions are plain column dicts inserted with
+    a single executemany, as are llm_calls (journal rows of the LLM calls
+    that produced the game). The sermon takes over its content fingerprint
+    from any earlier sermon with the same content, so the new game is the one
+    reused from then on. Nothing is written if any statement fails.
+    """
+    try:
+        if sermon.content_fingerprint is not None:
+            session.execute(
+                update(Sermon)
+                .where(Sermon.content_fingerprint == sermon.content_fingerprint)
+                .values(content_fingerprint=None)
+            )
+        session.add(sermon)
+        session.flush()
+        game.sermon_id = sermon.id
+        session.add(game)
+        session.flush()
+        if questions:
+            session.execute(insert(Question), [{**question, "game_id": game.id} for question in questions])
+        if llm_calls:
+            session.execute(insert(LLMCall), [{**call, "sermon_id": sermon.id, "game_id": game.id} for call in llm_calls])
+        sermon_id, game_id = sermon.id, game.id
+        session.commit()
+        return sermon_id, game_id
+    except Exception:
+        session.rollback()
+        raise
+
+def save_llm_calls(session, llm_calls: Sequence[Dict[str, Any]]) -> None:
+    """Write journal rows of LLM calls not saved with a game (the pipeline failed) in one executemany."""
+    if not llm_calls:
+        return
+    try:
+        session.execute(insert(LLMCall), list(llm_calls))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+# Dimensions GET /api/llm/usage can group by
+USAGE_DIMENSIONS = {
+    "day": func.date(LLMCall.created_at),
+    "model": LLMCall.model,
+    "stage": LLMCall.stage,
+    "game_id": LLMCall.game_id
+}
+
+USAGE_TOTALS = (
+    func.count(LLMCall.id).label("calls"),
+    func.sum(case((LLMCall.cache_status == "hit", 1), else_=0)).label("cache_hits"),
+    func.sum(case((LLMCall.outcome != "ok", 1), else_=0)).label("errors"),
+    func.coalesce(func.sum(LLMCall.prompt_tokens), 0).label("prompt_tokens"),
+    func.coalesce(func.sum(LLMCall.completion_tokens), 0).label("completion_tokens"),
+    func.coalesce(func.sum(LLMCall.cached_tokens), 0).label("cached_tokens"),
+    func.sum(LLMCall.cost).label("cost"),
+    func.sum(case((LLMCall.usage_estimated.is_(True), 1), else_=0)).label("estimated_calls"),
+    func.avg(LLMCall.latency_ms).label("avg_latency_ms")
+)
+
+def llm_usage(
+    session,
+    group_by: Sequence[str] = ("day",),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    game_id: Optional[int] = None,
+    sermon_id: Optional[int] = None,
+    request_id: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Aggregate the LLM call journal: calls, cache hits, errors, tokens, cost
+    and mean latency per combination of the group_by dimensions (see
+    USAGE_DIMENSIONS), optionally limited to a time range, game, sermon or
+    request id.
+    Cost is None for groups where OpenRouter reported no cost.
+    """
+    unknown = [dimension for dimension in group_by if dimension not in USAGE_DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Unknown group_by: {', '.join(unknown)}. Allowed: {', '.join(USAGE_DIMENSIONS)}")
+
+    keys = [USAGE_DIMENSIONS[dimension].label(dimension) for dimension in group_by]
+    statement = select(*keys, *USAGE_TOTALS).group_by(*keys).order_by(*keys)
+    if since is not None:
+        statement = statement.where(LLMCall.created_at >= since)
+    if until is not None:
+        statement = statement.where(LLMCall.created_at < until)
+    if game_id is not None:
+        statement = statement.where(LLMCall.game_id == game_id)
+    if sermon_id is not None:
+        statement = statement.where(LLMCall.sermon_id == sermon_id)
+    if request_id is not None:
+        statement = statement.where(LLMCall.request_id == request_id)
+
+    rows = []
+    for row in session.connection().execute(statement):
+        usage = dict(row._mapping)
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        if usage["avg_latency_ms"] is not None:
+            usage["avg_latency_ms"] = round(float(usage["avg_latency_ms"]), 1)
+        if "day" in usage and usage["day"] is not None:
+            usage["day"] = str(usage["day"])
+        rows.append(usage)
+    return rows
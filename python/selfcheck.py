@@ -0,0 +1,97 @@
+"""
+Startup self-check: verifies the environment the server needs and reports
+problems instead of patching source files. Run directly with
+`python selfcheck.py`; gunicorn_config.py and run.py call it at startup.
+"""
+import os
+import sys
+import platform
+import tempfile
+import importlib.util
+from typing import List, Tuple
+
+REQUIRED_MODULES = ("flask", "flask_cors", "sqlalchemy", "pydantic", "requests", "PyPDF2", "dotenv", "pytube", "openai")
+
+# The placeholder key app.py falls back to when OPENROUTER_API_KEY is unset
+FALLBACK_KEY_PREFIX = "sk-or-v1-c69bd3a136c4"
+
+Problem = Tuple[str, str]  # (level, message), level is "error" or "warning"
+
+def check_modules() -> List[Problem]:
+    missing = [module for module in REQUIRED_MODULES if importlib.util.find_spec(module) is None]
+    if missing:
+        return [("error", f"Missing required dependencies: {', '.join(missing)}. Run: python3 -m pip install -r requirements.txt")]
+    return []
+
+def check_magic() -> List[Problem]:
+    try:
+        import magic  # noqa: F401
+    except ImportError as e:
+        if "failed to find libmagic" in str(e) and platform.system() == "Darwin":
+            return [("error", "libmagic not found. Install it with `brew install libmagic` and reinstall python-magic-bin")]
+        return [("error", f"Error importing magic module: {e}")]
+    return []
+
+def check_openai() -> List[Problem]:
+    """Transcription uses the v0.x openai API (openai.Audio); v1.x removed it."""
+    try:
+        import openai
+    except ImportError:
+        return []  # Reported by check_modules
+    if hasattr(openai, "OpenAI"):
+        version = getattr(openai, "__version__", "unknown")
+        return [("warning", f"openai {version} uses the v1.x API; /api/transcribe needs openai==0.28.1 from requirements.txt")]
+    return []
+
+def check_api_key() -> List[Problem]:
+    key = os.environ.get("OPENROUTER_API_KEY", "")
+    if not key or key.startswith(FALLBACK_KEY_PREFIX):
+        return [("warning", "OPENROUTER_API_KEY is not set; LLM calls will fail")]
+    return []
+
+def check_database() -> List[Problem]:
+    try:
+        from sqlalchemy import text
+        from database import engine
+        from models import SchemaMigrationError, schema_changes
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+    except Exception as e:
+        return [("error", f"Database is not reachable: {e}")]
+    try:
+        pending = schema_changes(engine)
+    except SchemaMigrationError as e:
+        return [("error", str(e))]
+    except Exception as e:
+        return [("error", f"Database is not reachable: {e}")]
+    if pending:
+        return [("warning", f"{len(pending)} schema change(s) pending; they are applied at startup, or run `python migrate.py`")]
+    return []
+
+def check_upload_dir() -> List[Problem]:
+    directory = os.environ.get("UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "sermon_uploads"))
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=directory):
+            pass
+    except OSError as e:
+        return [("error", f"Upload directory {directory} is not writable: {e}")]
+    return []
+
+def run_self_check(verbose: bool = True) -> bool:
+    """Run every check, print the problems found and return False if any is fatal."""
+    problems: List[Problem] = []
+    for check in (check_modules, check_magic, check_openai, check_api_key, check_database, check_upload_dir):
+        problems.extend(check())
+        if problems and problems[-1][0] == "error" and check is check_modules:
+            break  # The remaining checks import these modules
+    for level, message in problems:
+        print(f"[self-check] {level.upper()}: {message}", file=sys.stderr)
+    if verbose and not problems:
+        print("[self-check] OK", file=sys.stderr)
+    return not any(level == "error" for level, _ in problems)
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    sys.exit(0 if run_self_check() else 1)
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# The application modules live next to this directory, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Tests that import app get a throwaway database, an in-memory LLM cache and no network
+_TEST_DIR = tempfile.mkdtemp(prefix="sermon-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_TEST_DIR, 'sermon_games.db')}")
+os.environ.setdefault("LLM_CACHE", "memory")
+os.environ.setdefault("LLM_PREWARM", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
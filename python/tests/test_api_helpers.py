@@ -0,0 +1,158 @@
+"""
+Model fallback: ordering by rolling health and the circuit breaker, and
+hedged races whose loser is aborted even while it still waits for its
+first byte.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from utils import api_helpers, model_health, rate_governor
+from utils.llm_client import ABORTED_STATUS, AbortHandle, LLMClientError, OpenRouterClient, abortable
+from utils.model_health import BREAKER_COOLDOWN_SECONDS, BREAKER_FAILURES, HEALTH_MIN_SAMPLES, ModelHealthRegistry
+
+SLOW_MODEL = "test/slow"
+FAST_MODEL = "test/fast"
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = ModelHealthRegistry()
+    monkeypatch.setattr(api_helpers, "get_registry", lambda: registry)
+    return registry
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(model_health.time, "monotonic", lambda: now[0])
+    return now
+
+@pytest.fixture
+def server():
+    """OpenRouter stand-in: the slow model never sends a byte until teardown, any other model streams "answer"."""
+    release = threading.Event()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if payload["model"] == SLOW_MODEL:
+                release.wait(30)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for content in ("ans", "wer"):
+                event = {"choices": [{"delta": {"content": content}}]}
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+            self.wfile.write(b"data: [DONE]\n\n")
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    release.set()
+    httpd.shutdown()
+    httpd.server_close()
+
+def _in_flight(model):
+    governor = rate_governor.get_governor()
+    with governor._lock:
+        return governor._limiter(model).in_flight
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached in time"
+        time.sleep(0.02)
+
+def _record(registry, model, latencies, succeeded=True):
+    for latency in latencies:
+        registry.record(model, latency, succeeded=succeeded)
+
+def test_order_ranks_measured_models_by_latency_and_errors(registry):
+    _record(registry, "a", [2.0] * HEALTH_MIN_SAMPLES)
+    _record(registry, "b", [1.0] * HEALTH_MIN_SAMPLES)
+    # c is fastest, but failing half its calls makes it cost 0.5 * (1 + 4 * 0.5) = 1.5
+    for _ in range(HEALTH_MIN_SAMPLES):
+        registry.record("c", 0.5, succeeded=True)
+        registry.record("c", 0.5, succeeded=False)
+    assert registry.order(["unmeasured", "a", "b", "c"]) == ["b", "c", "a", "unmeasured"]
+
+def test_open_circuit_is_skipped_until_its_cooldown_ends(registry, clock):
+    _record(registry, "a", [1.0] * BREAKER_FAILURES, succeeded=False)
+    assert registry.order(["a", "b"]) == ["b"]
+    assert registry.stats()["a"]["circuit_open"]
+
+    clock[0] += BREAKER_COOLDOWN_SECONDS
+    assert registry.order(["a", "b"]) == ["a", "b"]
+    # A failed trial call reopens the circuit at once; a success would have closed it
+    registry.record("a", 1.0, succeeded=False)
+    assert registry.order(["a", "b"]) == ["b"]
+    clock[0] += BREAKER_COOLDOWN_SECONDS
+    registry.record("a", 1.0, succeeded=True)
+    registry.record("a", 1.0, succeeded=False)
+    assert registry.order(["a", "b"]) == ["a", "b"]
+
+def test_every_model_is_tried_when_every_circuit_is_open(registry):
+    for model in ("a", "b"):
+        _record(registry, model, [1.0] * BREAKER_FAILURES, succeeded=False)
+    assert sorted(registry.order(["a", "b"])) == ["a", "b"]
+
+def test_hedge_delay_follows_p95_within_bounds(registry):
+    assert registry.hedge_delay("a", 10, 1, 30) == 10
+    _record(registry, "a", [0.1 * n for n in range(1, 21)])
+    assert registry.hedge_delay("a", 10, 1, 30) == 2.0
+    assert registry.hedge_delay("a", 10, 1, 1.5) == 1.5
+    assert registry.hedge_delay("a", 10, 5, 30) == 5
+
+def test_sequential_fallback_skips_an_open_circuit(registry, monkeypatch):
+    _record(registry, "broken", [1.0] * BREAKER_FAILURES, succeeded=False)
+    tried = []
+    def attempt(prompt, model, api_key, base_url):
+        tried.append(model)
+        if model == "flaky":
+            raise LLMClientError("502 Error", status_code=502)
+        return f"from {model}"
+    monkeypatch.setattr(api_helpers, "_chat_attempt", attempt)
+    assert api_helpers.call_with_fallback_models("p", ["broken", "flaky", "ok"], api_key="k", hedge=False) == "from ok"
+    assert tried == ["flaky", "ok"]
+    assert registry.stats()["flaky"]["error_rate"] == 1.0
+
+def test_hedged_race_aborts_a_loser_waiting_for_its_first_byte(registry, server, monkeypatch):
+    monkeypatch.setattr(api_helpers, "LLM_HEDGE_DEFAULT_DELAY", 0.2)
+    started = time.monotonic()
+    content = api_helpers.call_with_fallback_models("p", [SLOW_MODEL, FAST_MODEL], api_key="k", base_url=server, hedge=True)
+    assert content == "answer"
+    assert time.monotonic() - started < 5
+    # The slow attempt gives its slot back long before its 60 s read timeout, and is not counted as a failure
+    _wait_for(lambda: _in_flight(SLOW_MODEL) == 0)
+    stats = registry.stats()
+    assert stats[FAST_MODEL]["calls"] == 1
+    assert SLOW_MODEL not in stats or stats[SLOW_MODEL]["calls"] == 0
+
+def test_aborted_request_fails_at_once_without_a_retry(server):
+    client = OpenRouterClient(api_key="k", base_url=server)
+    handle = AbortHandle()
+    errors = []
+
+    def attempt():
+        with abortable(handle):
+            try:
+                list(client.stream({"model": SLOW_MODEL, "messages": []}, timeout=(5, 60)))
+            except LLMClientError as e:
+                errors.append(e)
+
+    thread = threading.Thread(target=attempt)
+    thread.start()
+    time.sleep(0.3)
+    handle.abort()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert [error.status_code for error in errors] == [ABORTED_STATUS]
+    assert _in_flight(SLOW_MODEL) == 0
+    client.close()
@@ -0,0 +1,76 @@
+"""
+game_json splices JSON columns into the response as the text the database
+returns. These tests parse its output on a backend whose driver decodes JSON
+columns itself, as psycopg2 does on Postgres, and on TEST_DATABASE_URL when
+it is set.
+"""
+import os
+import json
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from models import Base, Game, Question, Sermon
+from queries import game_json
+
+def _json_decoding_sqlite(tmp_path):
+    # Like psycopg2, hand back columns declared JSON already decoded
+    sqlite3.register_converter("JSON", json.loads)
+    return create_engine(
+        f"sqlite:///{tmp_path / 'games.db'}",
+        connect_args={"detect_types": sqlite3.PARSE_DECLTYPES}
+    )
+
+BACKENDS = ["sqlite-json-decoding"]
+if os.environ.get("TEST_DATABASE_URL"):
+    BACKENDS.append("test-database-url")
+
+@pytest.fixture(params=BACKENDS)
+def engine(request, tmp_path):
+    if request.param == "sqlite-json-decoding":
+        engine = _json_decoding_sqlite(tmp_path)
+    else:
+        engine = create_engine(os.environ["TEST_DATABASE_URL"])
+    Base.metadata.create_all(engine)
+    yield engine
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+def test_game_json_is_valid_json_when_the_driver_decodes_json_columns(engine):
+    with Session(engine) as session:
+        sermon = Sermon(title="Sermon", content="text", content_type="text")
+        game = Game(
+            sermon=sermon,
+            theme="Grace",
+            main_topics=["grace", "faith"],
+            game_structure={"rounds": 2, "timed": True, "bonus": None}
+        )
+        session.add_all([
+            sermon,
+            game,
+            Question(game=game, text="Which city?", correct_answer="Paris", question_type="single-answer-multiple-choice",
+                     options=["Paris", "Rome"], hints=["It has a tower"], learning_points=[]),
+            Question(game=game, text="How many?", correct_answer=12, question_type="slider", options=None)
+        ])
+        session.flush()
+        game_id = game.id
+        session.commit()
+
+        body = json.loads(game_json(session, game_id))
+
+    assert body["main_topics"] == ["grace", "faith"]
+    assert body["game_structure"] == {"rounds": 2, "timed": True, "bonus": None}
+    first, second = body["questions"]
+    assert first["correct_answer"] == "Paris"
+    assert first["options"] == ["Paris", "Rome"]
+    assert first["hints"] == ["It has a tower"]
+    assert first["learning_points"] == []
+    assert second["correct_answer"] == 12
+    assert second["options"] is None
+    assert second["hints"] is None
+
+def test_game_json_returns_none_for_a_missing_game(engine):
+    with Session(engine) as session:
+        assert game_json(session, 12345) is None
@@ -0,0 +1,90 @@
+"""
+The incremental parser behind the streamed writer stage: values are yielded
+as they close, whatever the chunking, and a stream that ends early raises
+instead of passing for a shorter list.
+"""
+import asyncio
+
+import pytest
+
+from utils.json_stream import JSONStreamParser, aiter_json_values, find_json_span, iter_json_values
+
+QUESTIONS = '[{"question": "Who said \\"[it]\\"?", "answer": "{x}"}, {"question": "q2"}]'
+
+def _chunked(text, size):
+    return [text[index:index + size] for index in range(0, len(text), size)]
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1000])
+def test_elements_are_yielded_whatever_the_chunking(size):
+    values = list(iter_json_values(_chunked(QUESTIONS, size), require_array=True))
+    assert values == [{"question": 'Who said "[it]"?', "answer": "{x}"}, {"question": "q2"}]
+
+def test_each_element_is_returned_as_soon_as_it_closes():
+    parser = JSONStreamParser()
+    assert parser.feed('[{"a": 1}, {"b"') == [{"a": 1}]
+    assert parser.feed(': 2}') == [{"b": 2}]
+    assert not parser.done
+    assert parser.feed(']') == []
+    assert parser.done
+
+def test_truncated_array_raises_after_the_complete_elements():
+    values = []
+    with pytest.raises(ValueError, match="ended before the JSON array closed"):
+        for value in iter_json_values(['[{"a":1},{"b":2},{"c":'], require_array=True):
+            values.append(value)
+    assert values == [{"a": 1}, {"b": 2}]
+
+def test_truncated_object_raises():
+    with pytest.raises(ValueError, match="ended before the JSON object closed"):
+        list(iter_json_values(['{"a": [1, 2']))
+
+def test_stream_without_json_raises_only_when_an_array_is_required():
+    assert list(iter_json_values(["no json here"])) == []
+    with pytest.raises(ValueError, match="No JSON array"):
+        list(iter_json_values(["no json here"], require_array=True))
+
+def test_root_object_is_rejected_when_an_array_is_required():
+    with pytest.raises(ValueError, match="not an array"):
+        list(iter_json_values(['{"questions": []}'], require_array=True))
+
+def test_code_fence_after_a_bracketed_preamble():
+    text = 'Sure! Here are [3] questions:\n```json\n[{"a":1}]\n```'
+    assert list(iter_json_values(_chunked(text, 4), require_array=True)) == [{"a": 1}]
+
+def test_preamble_brackets_without_a_fence_are_skipped_for_an_array_of_objects():
+    text = 'Items [a] and [1, 2] first: [{"a": 1}, {"b": 2}] trailing [x]'
+    assert list(iter_json_values([text], require_array=True)) == [{"a": 1}, {"b": 2}]
+
+def test_backticks_inside_strings_do_not_restart():
+    text = '[{"code": "```py\\nprint(1)\\n```"}]'
+    assert list(iter_json_values([text], require_array=True)) == [{"code": "```py\nprint(1)\n```"}]
+
+def test_upstream_is_closed_once_the_array_ends():
+    closed = []
+    def chunks():
+        try:
+            yield '[{"a": 1}]'
+            yield ' trailing tokens'
+            raise AssertionError("read past the end of the array")
+        finally:
+            closed.append(True)
+    assert list(iter_json_values(chunks(), require_array=True)) == [{"a": 1}]
+    assert closed == [True]
+
+def test_find_json_span_prefers_the_fenced_block():
+    assert find_json_span('Sure! Here are [3] questions:\n```json\n[{"a":1}]\n```') == '[{"a":1}]'
+    assert find_json_span('Result: {"a": "}"} done') == '{"a": "}"}'
+    assert find_json_span('```\nnot json\n```\n[1]') == '[1]'
+    assert find_json_span('{"a": 1') is None
+
+def test_async_stream_shares_the_truncation_check():
+    async def chunks(parts):
+        for part in parts:
+            yield part
+
+    async def collect(parts):
+        return [value async for value in aiter_json_values(chunks(parts), require_array=True)]
+
+    assert asyncio.run(collect(['Here [1]:\n```json\n[{"a":', '1}]\n```'])) == [{"a": 1}]
+    with pytest.raises(ValueError, match="ended before the JSON array closed"):
+        asyncio.run(collect(['[{"a":1},{"b":']))
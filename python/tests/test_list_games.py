@@ -0,0 +1,95 @@
+"""
+Keyset pagination of GET /api/games: cursors round-trip, pages neither skip
+nor repeat games that share a created_at, and filters combine with paging.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from models import Base, Game, Sermon
+from queries import decode_cursor, encode_cursor, list_games
+
+START = datetime(2026, 1, 1, 12, 0, 0)
+
+@pytest.fixture
+def session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'games.db'}")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        sermons = [Sermon(title=f"Sermon {index}", content="text", content_type="text") for index in range(2)]
+        session.add_all(sermons)
+        session.flush()
+        # Ten games over five timestamps, so every page boundary has a created_at tie to break by id
+        for index in range(10):
+            session.add(Game(
+                sermon_id=sermons[index % 2].id,
+                theme="Grace" if index % 3 == 0 else "Hope",
+                main_topics=[f"topic {index}"],
+                game_structure={"rounds": index},
+                created_at=START + timedelta(hours=index // 2)
+            ))
+        session.commit()
+        yield session
+    engine.dispose()
+
+def _all_pages(session, limit, **filters):
+    pages, cursor = [], None
+    while True:
+        games, cursor = list_games(session, limit=limit, cursor=cursor, fields=("id", "created_at"), **filters)
+        pages.append(games)
+        if cursor is None:
+            return pages
+
+def _newest_first(session, **filters):
+    games, cursor = list_games(session, limit=100, fields=("id",), **filters)
+    assert cursor is None
+    return [game["id"] for game in games]
+
+def test_cursor_round_trips():
+    created_at = datetime(2026, 3, 4, 5, 6, 7, 891011)
+    assert decode_cursor(encode_cursor(created_at, 42)) == (created_at, 42)
+
+@pytest.mark.parametrize("cursor", ["not-base64!", "bm90IGpzb24", encode_cursor(START, 1)[:-3]])
+def test_malformed_cursor_is_a_value_error(session, cursor):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        list_games(session, cursor=cursor)
+
+@pytest.mark.parametrize("limit", [1, 3, 4, 10])
+def test_pages_cover_every_game_once_in_order(session, limit):
+    pages = _all_pages(session, limit)
+    ids = [game["id"] for page in pages for game in page]
+    assert ids == _newest_first(session)
+    assert len(ids) == len(set(ids)) == 10
+    assert all(len(page) == limit for page in pages[:-1])
+    keys = [(game["created_at"], game["id"]) for page in pages for game in page]
+    assert keys == sorted(keys, reverse=True)
+
+def test_last_full_page_has_no_cursor(session):
+    games, cursor = list_games(session, limit=10)
+    assert len(games) == 10 and cursor is None
+
+def test_filters_combine_with_paging(session):
+    sermon_id = session.query(Sermon.id).order_by(Sermon.id).first()[0]
+    filters = {
+        "sermon_id": sermon_id,
+        "theme": "Grace",
+        "created_after": START + timedelta(hours=1),
+        "created_before": START + timedelta(hours=5)
+    }
+    expected = [
+        game.id for game in session.query(Game).order_by(Game.created_at.desc(), Game.id.desc())
+        if game.sermon_id == sermon_id and game.theme == "Grace"
+        and filters["created_after"] <= game.created_at < filters["created_before"]
+    ]
+    assert expected
+    assert _newest_first(session, **filters) == expected
+    assert [game["id"] for page in _all_pages(session, 1, **filters) for game in page] == expected
+
+def test_fields_projection(session):
+    games, _ = list_games(session, limit=1, fields=("id", "game_structure"))
+    assert set(games[0]) == {"id", "game_structure"}
+    assert games[0]["game_structure"] == {"rounds": 9}
+    with pytest.raises(ValueError, match="Unknown fields: password"):
+        list_games(session, fields=("id", "password"))
@@ -0,0 +1,109 @@
+"""
+LLM cache tiers: per-entry TTL, LRU eviction by count (memory) and by size
+(SQLite), and the validate hook that keeps unparseable completions out.
+"""
+import json
+
+import pytest
+
+from utils import llm_cache
+from utils.llm_cache import LLMCache, MemoryLRUCache, SQLiteCache, cached_completion
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now[0])
+    return now
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = LLMCache(MemoryLRUCache(16))
+    monkeypatch.setattr(llm_cache, "get_cache", lambda: cache)
+    return cache
+
+def _array(text):
+    if not isinstance(json.loads(text), list):
+        raise ValueError("not an array")
+
+def test_cache_key_ignores_stream_flag_and_key_order():
+    payload = {"model": "m", "messages": [{"role": "user", "content": "x"}], "temperature": 0}
+    reordered = {"temperature": 0, "stream": True, "messages": payload["messages"], "model": "m"}
+    assert llm_cache.cache_key(payload) == llm_cache.cache_key(reordered)
+    assert llm_cache.cache_key(payload) != llm_cache.cache_key({**payload, "temperature": 1})
+
+def test_stage_ttl_defaults_and_env_override(monkeypatch):
+    assert llm_cache.stage_ttl("writer") == 7 * 24 * 3600
+    assert llm_cache.stage_ttl("unknown") == llm_cache.stage_ttl(None) == 24 * 3600
+    monkeypatch.setenv("LLM_CACHE_TTL_WRITER", "60")
+    assert llm_cache.stage_ttl("writer") == 60
+
+def test_memory_entries_expire(clock):
+    memory = MemoryLRUCache()
+    memory.set("k", "v", ttl=10)
+    clock[0] += 9
+    assert memory.get("k") == "v"
+    clock[0] += 2
+    assert memory.get("k") is None
+    assert len(memory) == 0
+
+def test_memory_evicts_least_recently_used():
+    memory = MemoryLRUCache(max_entries=2)
+    memory.set("a", "1", 60)
+    memory.set("b", "2", 60)
+    assert memory.get("a") == "1"  # b is now the least recently used
+    memory.set("c", "3", 60)
+    assert memory.get("b") is None
+    assert memory.get("a") == "1" and memory.get("c") == "3"
+
+def test_sqlite_expires_and_evicts_by_size(tmp_path, clock):
+    disk = SQLiteCache(str(tmp_path / "cache.db"), max_bytes=10)
+    disk.set("old", "12345", 60)
+    clock[0] += 1
+    disk.set("new", "67890", 60)
+    clock[0] += 1
+    assert disk.get("old") == "12345"  # refreshes last_access, so "new" is evicted next
+    clock[0] += 1
+    disk.set("newest", "abcde", 60)
+    assert disk.get("new") is None
+    assert disk.get("old") == "12345" and disk.get("newest") == "abcde"
+    clock[0] += 61
+    assert disk.get("old") is None
+
+def test_disk_hit_is_promoted_to_memory(tmp_path):
+    tiered = LLMCache(MemoryLRUCache(), SQLiteCache(str(tmp_path / "cache.db")))
+    tiered.disk.set("k", "v", 60)
+    assert tiered.get("k", "writer") == "v"
+    assert tiered.memory.get("k") == "v"
+    assert tiered.stats()["hits"] == 1
+
+def test_zero_ttl_stage_is_not_stored(monkeypatch, cache):
+    monkeypatch.setenv("LLM_CACHE_TTL_PLANNER", "0")
+    cache.set("k", "v", "planner")
+    assert cache.get("k", "planner") is None
+
+def test_completion_failing_validation_is_returned_but_not_cached(cache):
+    payload = {"model": "m", "messages": [{"role": "user", "content": "invalid"}]}
+    assert cached_completion(payload, lambda: "Sorry, no JSON", stage="writer", validate=_array) == "Sorry, no JSON"
+    assert cache.get(llm_cache.cache_key(payload), "writer") is None
+    assert cached_completion(payload, lambda: "[1]", stage="writer", validate=_array) == "[1]"
+    assert cache.get(llm_cache.cache_key(payload), "writer") == "[1]"
+
+def test_cached_entry_failing_validation_is_evicted_and_refetched(cache):
+    payload = {"model": "m", "messages": [{"role": "user", "content": "poisoned"}]}
+    key = llm_cache.cache_key(payload)
+    cache.set(key, "not json", "writer")
+    fetched = []
+    def fetch():
+        fetched.append(True)
+        return "[1, 2]"
+    assert cached_completion(payload, fetch, stage="writer", validate=_array) == "[1, 2]"
+    assert fetched == [True]
+    assert cache.get(key, "writer") == "[1, 2]"
+    assert cached_completion(payload, fetch, stage="writer", validate=_array) == "[1, 2]"
+    assert fetched == [True]
+
+def test_use_cache_false_bypasses_lookup_and_store(cache):
+    payload = {"model": "m", "messages": [{"role": "user", "content": "bypass"}]}
+    cache.set(llm_cache.cache_key(payload), "stale", "writer")
+    assert cached_completion(payload, lambda: "fresh", stage="writer", use_cache=False) == "fresh"
+    assert cache.get(llm_cache.cache_key(payload), "writer") == "stale"
@@ -0,0 +1,69 @@
+"""
+LLM calls made outside a pipeline run (the YouTube summary of
+/api/transcribe, the standalone agents) are journaled without a sermon or
+game instead of being lost.
+"""
+import uuid
+
+import pytest
+
+import app
+from models import LLMCall
+from utils import llm_client
+
+class FakeClient:
+    def __init__(self, content):
+        self.content = content
+        self.payloads = []
+
+    def chat(self, payload, **options):
+        self.payloads.append(payload)
+        llm_client.llm_journal.note_response({"usage": {"prompt_tokens": 120, "completion_tokens": 30, "cost": 0.001}})
+        return {"choices": [{"message": {"content": self.content}}]}
+
+@pytest.fixture
+def client(monkeypatch):
+    client = FakeClient("A sermon about grace, summarized at length for the quiz writer.")
+    monkeypatch.setattr(llm_client, "get_client", lambda: client)
+    return client
+
+def _journaled(request_id):
+    session = app.SessionFactory()
+    try:
+        return session.query(LLMCall).filter_by(request_id=request_id).all()
+    finally:
+        session.close()
+
+def test_transcribe_journals_the_youtube_summary_call(client, monkeypatch):
+    monkeypatch.setattr(app, "get_youtube_metadata", lambda video_id: {"title": "Grace", "description": ""})
+    request_id = uuid.uuid4().hex
+    video_id = uuid.uuid4().hex[:11]
+    response = app.app.test_client().post(
+        "/api/transcribe",
+        json={"content_type": "youtube", "content": f"https://www.youtube.com/watch?v={video_id}"},
+        headers={"X-Request-ID": request_id}
+    )
+    assert response.status_code == 200
+    assert response.get_json()["transcription"] == client.content
+
+    [call] = _journaled(request_id)
+    assert (call.stage, call.cache_status, call.outcome) == ("youtube", "miss", "ok")
+    assert (call.prompt_tokens, call.completion_tokens) == (120, 30)
+    assert call.sermon_id is None and call.game_id is None
+
+def test_transcribe_of_plain_text_journals_nothing(client):
+    request_id = uuid.uuid4().hex
+    response = app.app.test_client().post(
+        "/api/transcribe", json={"content_type": "text", "content": "In the beginning"}, headers={"X-Request-ID": request_id}
+    )
+    assert response.get_json()["transcription"] == "In the beginning"
+    assert _journaled(request_id) == []
+    assert client.payloads == []
+
+def test_standalone_agent_calls_are_journaled(client):
+    agents = pytest.importorskip("agents", exc_type=ImportError)
+    request_id = uuid.uuid4().hex
+    with app.log_helpers.request_context(request_id):
+        agents.ContentAnalyzer(api_key="k").call_openrouter(f"Analyze sermon {request_id}")
+    [call] = _journaled(request_id)
+    assert call.stage == "agent" and call.sermon_id is None
@@ -0,0 +1,221 @@
+"""
+Rate governor: the per-model token bucket and in-flight cap, their AIMD
+adaptation, Retry-After handling, and the retry budget and deadline of one
+governed call.
+"""
+import asyncio
+import time
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from utils import rate_governor
+from utils.rate_governor import DeadlineExceeded, ModelLimiter, RateGovernor, RateLimitTimeout, retry_after_seconds
+
+class APIError(Exception):
+    def __init__(self, status_code=None, headers=None, timed_out=False):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.timed_out = timed_out
+
+def _governor(**options):
+    options = {"retry_base": 0.001, "retry_max": 0.01, **options}
+    return RateGovernor(**options)
+
+def _failing(errors, result="ok"):
+    """A request that raises each of errors in turn, then returns result; records the time_left it was given."""
+    calls = []
+    def request(time_left):
+        calls.append(time_left)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    return request, calls
+
+def test_retry_after_seconds():
+    assert retry_after_seconds({"Retry-After": "2.5"}) == 2.5
+    assert retry_after_seconds({"retry-after": "-3"}) == 0.0
+    http_date = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 28 <= retry_after_seconds({"Retry-After": http_date}) <= 30
+    assert retry_after_seconds({"Retry-After": "soon"}) is None
+    assert retry_after_seconds({}) is None and retry_after_seconds(None) is None
+
+def test_token_bucket_spaces_requests_at_the_rate():
+    limiter = ModelLimiter(rate=2, burst=2, max_in_flight=10)
+    now = limiter._refilled_at
+    assert limiter.try_acquire(now) == 0.0
+    assert limiter.try_acquire(now) == 0.0
+    assert limiter.try_acquire(now) == pytest.approx(0.5)
+    assert limiter.try_acquire(now + 0.5) == 0.0
+
+def test_in_flight_cap_waits_for_a_release():
+    limiter = ModelLimiter(rate=100, burst=100, max_in_flight=1)
+    now = limiter._refilled_at
+    assert limiter.try_acquire(now) == 0.0
+    assert limiter.try_acquire(now) is None
+    limiter.release(now, 200, None)
+    assert limiter.try_acquire(now) == 0.0
+
+def test_throttling_halves_rate_and_cap_once_per_cooldown():
+    limiter = ModelLimiter(rate=40, burst=40, max_in_flight=8, decrease_cooldown=1.0)
+    now = limiter._refilled_at + 10
+    limiter.in_flight = 3
+    limiter.release(now, 429, None)
+    assert (limiter.rate, limiter.limit) == (20, 4)
+    limiter.release(now + 0.5, 503, None)  # same burst of failures
+    assert (limiter.rate, limiter.limit) == (20, 4)
+    limiter.release(now + 1.5, 429, None)
+    assert (limiter.rate, limiter.limit) == (10, 2)
+    assert (limiter.throttled, limiter.errors) == (2, 1)
+
+def test_successes_recover_additively_up_to_the_configured_limits():
+    limiter = ModelLimiter(rate=50, burst=50, max_in_flight=4)
+    limiter.rate, limiter.limit = 10.0, 2.0
+    limiter.in_flight = 1
+    limiter.release(0.0, 200, None)
+    assert limiter.rate == pytest.approx(11.0)
+    assert limiter.limit == pytest.approx(2.5)
+    for _ in range(500):
+        limiter.in_flight = 1
+        limiter.release(0.0, 200, None)
+    assert (limiter.rate, limiter.limit) == (50, 4)
+
+def test_rate_never_drops_below_its_floor():
+    limiter = ModelLimiter(rate=2, burst=2, max_in_flight=1, decrease_cooldown=0)
+    for step in range(20):
+        limiter.in_flight = 1
+        limiter.release(float(step), 429, None)
+    assert limiter.rate == limiter.min_rate == pytest.approx(0.1)
+    assert limiter.limit == 1.0
+
+def test_retry_after_pauses_the_model():
+    limiter = ModelLimiter(rate=100, burst=100, max_in_flight=10)
+    now = limiter._refilled_at
+    limiter.in_flight = 1
+    limiter.release(now, 429, 2.0)
+    assert limiter.try_acquire(now + 0.5) == pytest.approx(1.5)
+    assert limiter.try_acquire(now + 2.0) == 0.0
+
+def test_retryable_failures_are_retried_and_slots_released():
+    governor = _governor()
+    request, calls = _failing([APIError(429), APIError(503), APIError(None)])
+    assert governor.call("m", request) == "ok"
+    assert len(calls) == 4
+    stats = governor.stats()["m"]
+    assert (stats["in_flight"], stats["retries"], stats["throttled"], stats["errors"]) == (0, 3, 1, 1)
+
+def test_client_errors_are_not_retried():
+    governor = _governor()
+    request, calls = _failing([APIError(400)])
+    with pytest.raises(APIError):
+        governor.call("m", request)
+    assert len(calls) == 1
+    assert governor.stats()["m"]["in_flight"] == 0
+
+def test_retries_stop_at_max_retries():
+    governor = _governor(max_retries=2)
+    request, calls = _failing([APIError(429)] * 5)
+    with pytest.raises(APIError):
+        governor.call("m", request)
+    assert len(calls) == 3
+
+def test_retry_after_longer_than_retry_max_is_not_waited_for():
+    governor = _governor(retry_max=1.0)
+    request, calls = _failing([APIError(429, {"Retry-After": "30"})])
+    with pytest.raises(APIError):
+        governor.call("m", request)
+    assert len(calls) == 1
+
+def test_read_timeouts_use_their_own_retry_budget():
+    request, calls = _failing([APIError(timed_out=True)])
+    with pytest.raises(APIError):
+        _governor().call("m", request)
+    assert len(calls) == 1
+
+    request, calls = _failing([APIError(timed_out=True), APIError(timed_out=True)])
+    with pytest.raises(APIError):
+        _governor(timeout_retries=1).call("m", request)
+    assert len(calls) == 2
+
+def test_each_attempt_gets_the_time_left_before_the_call_deadline():
+    governor = _governor(call_deadline=30)
+    request, calls = _failing([APIError(503)])
+    governor.call("m", request)
+    assert 29 < calls[0] <= 30
+    assert calls[1] <= calls[0]
+
+def test_no_retry_starts_that_would_end_past_the_deadline():
+    governor = _governor(call_deadline=0.2, retry_base=1.0, retry_max=1.0)
+    request, calls = _failing([APIError(429, {"Retry-After": "0.5"})])
+    started = time.monotonic()
+    with pytest.raises(APIError):
+        governor.call("m", request)
+    assert len(calls) == 1
+    assert time.monotonic() - started < 0.2
+
+def test_deadline_scope_caps_calls_and_rejects_them_once_passed():
+    governor = _governor(call_deadline=300)
+    request, calls = _failing([])
+    with rate_governor.deadline_scope(5):
+        governor.call("m", request)
+        assert calls[0] <= 5
+        with rate_governor.deadline_scope(60):  # a nested scope never extends the outer one
+            assert rate_governor.time_left() <= 5
+    assert rate_governor.time_left() is None
+    with rate_governor.deadline_scope(0):
+        with pytest.raises(DeadlineExceeded):
+            governor.call("m", request)
+    assert len(calls) == 1
+
+def test_queue_timeout_when_no_slot_frees_up():
+    governor = _governor(max_in_flight=1, queue_timeout=0.05)
+    governor.acquire("m")
+    with pytest.raises(RateLimitTimeout):
+        governor.acquire("m")
+    assert governor.stats()["m"]["queue_timeouts"] == 1
+
+def test_queued_request_gets_the_released_slot():
+    governor = _governor(max_in_flight=1, queue_timeout=5)
+    governor.acquire("m")
+    loop_started = time.monotonic()
+
+    async def main():
+        waiter = asyncio.ensure_future(governor.acquire_async("m"))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        governor.release("m", 200)
+        return await waiter
+    waited = asyncio.run(main())
+    assert 0.04 <= waited <= time.monotonic() - loop_started
+
+def test_async_call_retries_like_the_sync_one():
+    governor = _governor()
+    attempts = []
+    async def request(time_left):
+        attempts.append(time_left)
+        if len(attempts) == 1:
+            raise APIError(502)
+        return "ok"
+    assert asyncio.run(governor.call_async("m", request)) == "ok"
+    assert len(attempts) == 2
+
+def test_stream_retries_only_before_the_first_chunk():
+    governor = _governor()
+    opened = []
+    def open_stream(time_left):
+        opened.append(time_left)
+        def chunks():
+            if len(opened) == 1:
+                raise APIError(503)
+            yield "a"
+            raise APIError(503)
+        return chunks()
+    received = []
+    with pytest.raises(APIError):
+        for chunk in governor.stream("m", open_stream):
+            received.append(chunk)
+    assert received == ["a"]
+    assert len(opened) == 2
+    assert governor.stats()["m"]["in_flight"] == 0
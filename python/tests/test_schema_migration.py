@@ -0,0 +1,52 @@
+"""
+The non-destructive migration runner: missing columns are added with their
+defaults filling existing rows, identifiers are quoted for the dialect, and
+a NOT NULL column that can't be filled is reported instead of skipped.
+"""
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, text
+from sqlalchemy.orm import Session
+
+from models import SchemaMigrationError, SermonJob, _add_column, schema_changes, upgrade_schema
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    yield engine
+    engine.dispose()
+
+def _old_jobs_table(engine, *columns):
+    with engine.begin() as connection:
+        connection.execute(text(f"CREATE TABLE sermon_jobs (id VARCHAR(32) PRIMARY KEY, {', '.join(columns)})"))
+        connection.execute(text("INSERT INTO sermon_jobs (id, status, payload) VALUES ('old', 'queued', '{}')"))
+
+def test_missing_not_null_columns_get_their_default_on_existing_rows(engine):
+    _old_jobs_table(engine, "status VARCHAR(20) NOT NULL", "payload JSON NOT NULL", "created_at DATETIME", "updated_at DATETIME")
+    applied = upgrade_schema(engine)
+    assert applied
+    assert schema_changes(engine) == []
+    with Session(engine) as session:
+        job = session.get(SermonJob, "old")
+        assert (job.stage, job.progress, job.attempts, job.error) == ("queued", 0, 0, None)
+
+def test_not_null_column_without_a_default_needs_a_manual_migration(engine):
+    _old_jobs_table(engine, "status VARCHAR(20) NOT NULL", "payload JSON NOT NULL", "created_at DATETIME", "updated_at DATETIME")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE llm_calls (id INTEGER PRIMARY KEY, stage VARCHAR(50) NOT NULL, model VARCHAR(255) NOT NULL)"))
+    with pytest.raises(SchemaMigrationError, match=r"llm_calls\.cache_status, llm_calls\.outcome, llm_calls\.latency_ms"):
+        upgrade_schema(engine)
+    # Nothing is applied, not even the changes that were possible
+    with engine.connect() as connection:
+        columns = [row[1] for row in connection.execute(text("PRAGMA table_info(sermon_jobs)"))]
+    assert "attempts" not in columns
+
+def test_identifiers_are_quoted_for_the_dialect(engine):
+    table = Table("order", MetaData(), Column("id", Integer, primary_key=True), Column("group", String(10), nullable=False, default="100%"))
+    change = _add_column(engine, table.c.group)
+    assert " ".join(str(change.compile(dialect=engine.dialect)).split()) == \
+        'ALTER TABLE "order" ADD COLUMN "group" VARCHAR(10) NOT NULL DEFAULT \'100%\''
+    with engine.begin() as connection:
+        connection.execute(text('CREATE TABLE "order" (id INTEGER PRIMARY KEY)'))
+        connection.execute(text('INSERT INTO "order" (id) VALUES (1)'))
+        connection.execute(change)
+        assert connection.execute(text('SELECT "group" FROM "order"')).scalar() == "100%"
@@ -0,0 +1,116 @@
+"""
+Content fingerprinting: a sermon identical to one already processed reuses
+its game without any LLM call, unless force_regenerate is set, in which
+case the new game takes over the fingerprint.
+"""
+import json
+import uuid
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+import app
+from models import Game, Sermon
+
+PLAN = {"theme": "Grace", "main_topics": ["forgiveness"], "game_structure": {"rounds": 1}}
+QUESTIONS = [{"question": "Who forgave?", "correct_answer": "The father"}, {"question": "Who left?", "correct_answer": "The son"}]
+
+@pytest.fixture
+def llm(monkeypatch):
+    """Stage names of the LLM calls made, answered with a fixed plan, questions and designs."""
+    calls = []
+
+    def call_openrouter(prompt, stage=None, **options):
+        calls.append(stage)
+        if stage == "planner":
+            return json.dumps(PLAN)
+        if stage == "writer":
+            return json.dumps(QUESTIONS)
+        question = next(question for question in QUESTIONS if question["question"] in prompt)
+        return json.dumps({**question, "question_type": "true-false", "fake_answers": ["Nobody"]})
+
+    monkeypatch.setattr(app, "call_openrouter", call_openrouter)
+    monkeypatch.setattr(app, "PIPELINE_OVERLAP", False)
+    return calls
+
+@pytest.fixture
+def content():
+    return f"The parable of the prodigal son, sermon {uuid.uuid4().hex}."
+
+def _run(content, **fields):
+    session = app.SessionFactory()
+    try:
+        return app.run_sermon_pipeline(app.SermonInput(content_type="text", content=content, **fields), session)
+    finally:
+        session.close()
+
+def _fingerprinted_sermons(content, custom_prompt=""):
+    session = app.SessionFactory()
+    try:
+        fingerprint = app.sermon_fingerprint(content, custom_prompt)
+        return [sermon.id for sermon in session.query(Sermon).filter_by(content_fingerprint=fingerprint)]
+    finally:
+        session.close()
+
+def test_fingerprint_ignores_whitespace_but_not_the_custom_prompt():
+    assert app.sermon_fingerprint("Grace  upon\ngrace ", " kids ") == app.sermon_fingerprint("Grace upon grace", "kids")
+    assert app.sermon_fingerprint("Grace upon grace", "kids") != app.sermon_fingerprint("Grace upon grace", "adults")
+    assert app.sermon_fingerprint("Grace upon grace", "") == app.sermon_fingerprint("Grace upon grace", None)
+
+def test_youtube_fingerprint_is_keyed_on_the_video_id():
+    watch = app.SermonInput(content_type="youtube", content="https://www.youtube.com/watch?v=dQw4w9WgXcQ")
+    short = app.SermonInput(content_type="youtube", content="https://youtu.be/dQw4w9WgXcQ")
+    assert app.youtube_fingerprint(watch) == app.youtube_fingerprint(short) is not None
+    assert app.youtube_fingerprint(app.SermonInput(content_type="text", content="Grace")) is None
+
+def test_identical_content_reuses_the_game_without_llm_calls(llm, content):
+    first = _run(content)
+    assert llm == ["planner", "writer", "designer", "designer"]
+    assert not first["deduplicated"]
+
+    llm.clear()
+    again = _run("  " + content.replace(" ", "\n") + " ")
+    assert llm == []
+    assert again["deduplicated"]
+    assert (again["sermon_id"], again["game_id"]) == (first["sermon_id"], first["game_id"])
+    assert again["game_plan"] == PLAN
+    assert [question["question"] for question in again["questions"]] == [question["question"] for question in QUESTIONS]
+
+def test_a_different_custom_prompt_is_a_different_sermon(llm, content):
+    first = _run(content)
+    other = _run(content, custom_prompt="For kids")
+    assert not other["deduplicated"]
+    assert other["game_id"] != first["game_id"]
+
+def test_force_regenerate_runs_the_pipeline_and_takes_over_the_fingerprint(llm, content):
+    first = _run(content)
+    llm.clear()
+    regenerated = _run(content, force_regenerate=True)
+    assert llm == ["planner", "writer", "designer", "designer"]
+    assert regenerated["game_id"] != first["game_id"]
+    assert _fingerprinted_sermons(content) == [regenerated["sermon_id"]]
+
+    llm.clear()
+    reused = _run(content)
+    assert llm == []
+    assert reused["game_id"] == regenerated["game_id"]
+
+def test_a_concurrent_duplicate_is_saved_without_the_fingerprint(llm, content, monkeypatch):
+    real_save = app.save_generated_game
+    attempts = []
+
+    def save_generated_game(session, sermon, game, question_rows, llm_calls=()):
+        attempts.append(sermon.content_fingerprint)
+        if len(attempts) == 1:
+            raise IntegrityError("INSERT INTO sermons", {}, Exception("UNIQUE constraint failed: sermons.content_fingerprint"))
+        return real_save(session, sermon, game, question_rows, llm_calls)
+
+    monkeypatch.setattr(app, "save_generated_game", save_generated_game)
+    result = _run(content)
+    assert attempts == [app.sermon_fingerprint(content, ""), None]
+    assert _fingerprinted_sermons(content) == []
+    session = app.SessionFactory()
+    try:
+        assert session.get(Game, result["game_id"]).sermon_id == result["sermon_id"]
+    finally:
+        session.close()
@@ -0,0 +1,125 @@
+"""
+Background sermon jobs: a job is claimed by one worker at a time, its
+heartbeat keeps a long run from looking stale, and jobs orphaned by a dead
+worker are resumed.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import app
+from models import SermonJob
+
+STALE = timedelta(seconds=app.JOB_STALE_SECONDS + 60)
+
+@pytest.fixture(autouse=True)
+def clean_jobs():
+    yield
+    session = app.SessionFactory()
+    session.query(SermonJob).delete()
+    session.commit()
+    session.close()
+
+def _job(job_id, status="queued", attempts=0, age=timedelta(0)):
+    session = app.SessionFactory()
+    session.add(SermonJob(
+        id=job_id,
+        status=status,
+        attempts=attempts,
+        payload={"content_type": "text", "content": "In the beginning"},
+        updated_at=datetime.utcnow() - age
+    ))
+    session.commit()
+    session.close()
+
+def _get(job_id):
+    session = app.SessionFactory()
+    try:
+        return session.get(SermonJob, job_id)
+    finally:
+        session.close()
+
+def test_a_queued_job_is_claimed_once():
+    _job("queued")
+    assert app._claim_job("queued", 0)
+    job = _get("queued")
+    assert (job.status, job.attempts) == ("running", 1)
+    # Another worker read the job before the claim, or after it
+    assert not app._claim_job("queued", 0)
+    assert not app._claim_job("queued", 1)
+
+def test_a_running_job_is_taken_over_only_once_its_heartbeat_is_stale():
+    _job("fresh", status="running", attempts=1)
+    _job("stale", status="running", attempts=1, age=STALE)
+    assert not app._claim_job("fresh", 1)
+    assert app._claim_job("stale", 1)
+    assert _get("stale").attempts == 2
+
+@pytest.mark.parametrize("status", ["completed", "failed"])
+def test_a_finished_job_is_never_claimed(status):
+    _job("finished", status=status, attempts=1, age=STALE)
+    assert not app._claim_job("finished", 1)
+
+def test_heartbeat_refreshes_the_job_until_another_worker_owns_it(monkeypatch):
+    monkeypatch.setattr(app, "JOB_HEARTBEAT_SECONDS", 0.01)
+    _job("beating", status="running", attempts=1, age=STALE)
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=app._heartbeat_job, args=("beating", 1, stop), daemon=True)
+    heartbeat.start()
+    try:
+        deadline = time.monotonic() + 5
+        while datetime.utcnow() - _get("beating").updated_at > timedelta(seconds=app.JOB_STALE_SECONDS):
+            assert time.monotonic() < deadline, "heartbeat never refreshed the job"
+            time.sleep(0.01)
+        assert not app._claim_job("beating", 1)
+
+        # A takeover bumps attempts; the old owner's heartbeat notices and stops on its own
+        app._update_job("beating", attempts=2)
+        heartbeat.join(5)
+        assert not heartbeat.is_alive()
+    finally:
+        stop.set()
+
+def test_stale_unfinished_jobs_are_resumed(monkeypatch):
+    _job("stale-queued", age=STALE)
+    _job("stale-running", status="running", attempts=1, age=STALE)
+    _job("fresh-running", status="running", attempts=1)
+    _job("stale-completed", status="completed", attempts=1, age=STALE)
+    submitted = []
+
+    class Executor:
+        def submit(self, fn, job_id):
+            submitted.append(job_id)
+
+    monkeypatch.setattr(app, "_job_executor", Executor())
+    assert app.resume_stale_jobs() == 2
+    assert sorted(submitted) == ["stale-queued", "stale-running"]
+
+def test_a_resumed_job_runs_once_and_records_its_result(monkeypatch):
+    _job("orphan", status="running", attempts=1, age=STALE)
+    runs = []
+
+    def pipeline(sermon_input, session, report_progress, pdf_path=None):
+        runs.append(sermon_input.content)
+        report_progress("writer", 50)
+        return {"sermon_id": None, "game_id": None}
+
+    monkeypatch.setattr(app, "run_sermon_pipeline", pipeline)
+    app.run_sermon_job("orphan")
+    app.run_sermon_job("orphan")
+    job = _get("orphan")
+    assert runs == ["In the beginning"]
+    assert (job.status, job.stage, job.progress, job.attempts) == ("completed", "completed", 100, 2)
+
+def test_a_failing_job_records_its_error(monkeypatch):
+    _job("doomed")
+
+    def pipeline(sermon_input, session, report_progress, pdf_path=None):
+        raise ValueError("No text could be extracted")
+
+    monkeypatch.setattr(app, "run_sermon_pipeline", pipeline)
+    app.run_sermon_job("doomed")
+    job = _get("doomed")
+    assert (job.status, job.error) == ("failed", "No text could be extracted")
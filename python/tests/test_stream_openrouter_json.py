@@ -0,0 +1,105 @@
+"""
+stream_openrouter_json caches a streamed writer answer only once its array
+has closed; a stream cut off part way raises and leaves no cache entry.
+"""
+import asyncio
+
+import pytest
+
+import app
+import async_pipeline
+from utils import llm_cache, llm_client
+
+class FakeClient:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.calls = 0
+
+    def stream(self, payload, timeout=None, on_usage=None):
+        self.calls += 1
+        yield from self.chunks
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    def install(chunks):
+        client = FakeClient(chunks)
+        monkeypatch.setattr(llm_client, "get_client", lambda: client)
+        return client
+    return install
+
+def _key(prompt):
+    return llm_cache.cache_key(app.openrouter_payload(prompt, "google/gemini-2.0-flash-001"))
+
+def test_truncated_stream_raises_and_is_not_cached(fake_client):
+    prompt = "writer prompt (truncated)"
+    fake_client(['[{"question":"q1"},', '{"question":"q2"'])
+    received = []
+    with pytest.raises(ValueError, match="ended before the JSON array closed"):
+        for value in app.stream_openrouter_json(prompt, stage="writer"):
+            received.append(value)
+    assert received == [{"question": "q1"}]
+    assert llm_cache.get_cache().get(_key(prompt), "writer") is None
+
+def test_complete_stream_is_cached_and_replayed(fake_client):
+    prompt = "writer prompt (complete)"
+    client = fake_client(['[{"question":"q1"},', '{"question":"q2"}]'])
+    assert list(app.stream_openrouter_json(prompt, stage="writer")) == [{"question": "q1"}, {"question": "q2"}]
+    assert list(app.stream_openrouter_json(prompt, stage="writer")) == [{"question": "q1"}, {"question": "q2"}]
+    assert client.calls == 1
+
+def test_truncated_cache_entry_is_evicted_on_replay(fake_client):
+    prompt = "writer prompt (poisoned)"
+    llm_cache.get_cache().set(_key(prompt), '[{"question":"q1"},{"question"', "writer")
+    with pytest.raises(ValueError):
+        list(app.stream_openrouter_json(prompt, stage="writer"))
+    assert llm_cache.get_cache().get(_key(prompt), "writer") is None
+
+class FakeAsyncClient:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.calls = 0
+
+    async def stream(self, payload, timeout=None, on_usage=None):
+        self.calls += 1
+        for chunk in self.chunks:
+            yield chunk
+
+def _collect_async(prompt, received):
+    async def run():
+        async for value in async_pipeline.stream_openrouter_json_async(prompt, stage="writer"):
+            received.append(value)
+    asyncio.run(run())
+    return received
+
+def test_async_truncated_stream_raises_and_is_not_cached(monkeypatch):
+    prompt = "async writer prompt (truncated)"
+    monkeypatch.setattr(llm_client, "get_async_client", lambda: FakeAsyncClient(['[{"question":"q1"},', '{"question":"q2"']))
+    received = []
+    with pytest.raises(ValueError, match="ended before the JSON array closed"):
+        _collect_async(prompt, received)
+    assert received == [{"question": "q1"}]
+    assert llm_cache.get_cache().get(_key(prompt), "writer") is None
+
+def test_async_complete_stream_is_cached(monkeypatch):
+    prompt = "async writer prompt (complete)"
+    client = FakeAsyncClient(['[{"question":"q1"}]'])
+    monkeypatch.setattr(llm_client, "get_async_client", lambda: client)
+    assert _collect_async(prompt, []) == [{"question": "q1"}]
+    assert _collect_async(prompt, []) == [{"question": "q1"}]
+    assert client.calls == 1
+
+def test_streamed_answer_failing_validation_is_not_cached(fake_client):
+    prompt = "writer prompt (rejected)"
+    fake_client(['[{"question":"q1"}]'])
+    def reject(text):
+        raise ValueError("rejected")
+    assert list(app.stream_openrouter_json(prompt, stage="writer", validate=reject)) == [{"question": "q1"}]
+    assert llm_cache.get_cache().get(_key(prompt), "writer") is None
+
+def test_cached_stream_failing_validation_is_refetched(fake_client):
+    prompt = "writer prompt (stale object)"
+    llm_cache.get_cache().set(_key(prompt), '{"not": "an array"}', "writer")
+    client = fake_client(['[{"question":"q1"}]'])
+    assert list(app.stream_openrouter_json(prompt, stage="writer", validate=app.JSON_ARRAY_REPLY)) == [{"question": "q1"}]
+    assert client.calls == 1
+    assert llm_cache.get_cache().get(_key(prompt), "writer") == '[{"question":"q1"}]'
@@ -1,10 +1,23 @@
-import requests
+import os
 import time
 import logging
+import threading
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from typing import List, Optional, Dict, Any, Generator, Callable
+from utils.llm_client import AbortHandle, LLMClientError, abortable, get_client
+from utils.json_stream import iter_json_values
+from utils.model_health import get_registry
 
 logger = logging.getLogger(__name__)
 
+# Hedged fallback: race the next model once the current one is slower than its own p95
+LLM_HEDGE = os.environ.get("LLM_HEDGE", "1").lower() in ("1", "true", "yes")
+LLM_HEDGE_DEFAULT_DELAY = float(os.environ.get("LLM_HEDGE_DEFAULT_DELAY", "10"))  # until a model has latency samples
+LLM_HEDGE_MIN_DELAY = float(os.environ.get("LLM_HEDGE_MIN_DELAY", "1"))
+LLM_HEDGE_MAX_DELAY = float(os.environ.get("LLM_HEDGE_MAX_DELAY", "30"))
+LLM_HEDGE_THREADS = int(os.environ.get("LLM_HEDGE_THREADS", "32"))
+
 def stream_openrouter_response(
     prompt: str,
     model: str, 
@@ -13,54 +26,163 @@ def stream_openrouter_response(
     timeout: int = 30
 ) -> Generator[str, None, None]:
     """Stream responses from OpenRouter to avoid timeouts on large responses."""
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "https://jesustech-hackathon.com",
-        "X-Title": "JesusTech Hackathon"
-    }
-    
     data = {
         "model": model,
         "messages": [{"role": "user", "content": prompt}],
-        "stream": True,
         "max_tokens": 1500  # Limit token count to reduce processing time
     }
     
     try:
-        response = requests.post(
-            f"{base_url}/chat/completions",
-            headers=headers,
-            json=data,
-            stream=True,
-            timeout=timeout
-        )
-        
-        response.raise_for_status()
-        
-        # Process the streaming response
-        content = ""
-        for line in response.iter_lines():
-            if line:
-                line_text = line.decode('utf-8')
-                # Skip the "data: " prefix and empty lines
-                if line_text.startswith("data: ") and line_text != "data: [DONE]":
-                    try:
-                        json_str = line_text[6:]  # Remove "data: " prefix
-                        chunk = json.loads(json_str)
-                        if "choices" in chunk and chunk["choices"]:
-                            delta = chunk["choices"][0].get("delta", {})
-                            if "content" in delta:
-                                content_chunk = delta["content"]
-                                content += content_chunk
-                                yield content_chunk
-                    except json.JSONDecodeError:
-                        logger.warning(f"Failed to parse streaming response chunk: {line_text}")
-        
+        yield from get_client().stream(data, timeout=timeout, api_key=api_key, base_url=base_url)
     except Exception as e:
         logger.error(f"Error streaming from OpenRouter: {str(e)}")
         raise
 
+def stream_json_values(
+    prompt: str,
+    model: str,
+    api_key: str,
+    base_url: str = "https://openrouter.ai/api/v1",
+    timeout: int = 30
+) -> Generator[Any, None, None]:
+    """
+    Stream a JSON response from OpenRouter and yield each element of the root
+    array (or the root object) as soon as it is complete. The upstream stream
+    is closed as soon as the root value ends, so trailing tokens aren't paid for.
+    """
+    yield from iter_json_values(stream_openrouter_response(prompt, model, api_key, base_url, timeout))
+
+class HedgeCancelled(Exception):
+    """Raised inside a hedged attempt whose race was already won by another model."""
+
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+_hedge_executor_pid: Optional[int] = None
+_hedge_executor_lock = threading.Lock()
+
+def get_hedge_executor() -> ThreadPoolExecutor:
+    global _hedge_executor, _hedge_executor_pid
+    pid = os.getpid()
+    with _hedge_executor_lock:
+        if _hedge_executor is None or _hedge_executor_pid != pid:
+            _hedge_executor = ThreadPoolExecutor(max_workers=LLM_HEDGE_THREADS, thread_name_prefix="llm-hedge")
+            _hedge_executor_pid = pid
+        return _hedge_executor
+
+def _fallback_payload(prompt: str, model: str) -> Dict[str, Any]:
+    return {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": 1500
+    }
+
+def _timed(model: str, attempt: Callable[[], str]) -> str:
+    """Run attempt and record its latency and outcome in the model's health; cancelled races are not recorded."""
+    started = time.monotonic()
+    try:
+        content = attempt()
+    except HedgeCancelled:
+        raise
+    except Exception:
+        get_registry().record(model, time.monotonic() - started, succeeded=False)
+        raise
+    get_registry().record(model, time.monotonic() - started, succeeded=True)
+    return content
+
+def _chat_attempt(prompt: str, model: str, api_key: Optional[str], base_url: str) -> str:
+    response_data = get_client().chat(
+        _fallback_payload(prompt, model),
+        timeout=(10, 60),  # Connection timeout, read timeout
+        api_key=api_key,
+        base_url=base_url
+    )
+    if "choices" in response_data and response_data["choices"]:
+        return response_data["choices"][0]["message"]["content"]
+    raise ValueError(f"No choices in response from {model}")
+
+def _streamed_attempt(prompt: str, model: str, api_key: Optional[str], base_url: str, abort: AbortHandle) -> str:
+    """
+    Streamed under abort so a losing attempt can be abandoned: abort() shuts
+    its connection down, so even a request still waiting for its first byte
+    fails at once and frees its thread and governor slot.
+    """
+    parts = []
+    with abortable(abort):
+        chunks = get_client().stream(_fallback_payload(prompt, model), timeout=(10, 60), api_key=api_key, base_url=base_url)
+        try:
+            for chunk in chunks:
+                if abort.aborted:
+                    raise HedgeCancelled(model)
+                parts.append(chunk)
+        except LLMClientError as e:
+            if abort.aborted:
+                raise HedgeCancelled(model) from e
+            raise
+        finally:
+            chunks.close()
+    if abort.aborted:
+        raise HedgeCancelled(model)
+    if not parts:
+        raise ValueError(f"Empty response from {model}")
+    return "".join(parts)
+
+def _call_sequentially(prompt: str, models: List[str], api_key: Optional[str], base_url: str) -> str:
+    last_error = None
+    for model in models:
+        try:
+            logger.info("Trying model: %s", model)
+            return _timed(model, lambda: _chat_attempt(prompt, model, api_key, base_url))
+        except Exception as e:
+            logger.warning(f"Failed with model {model}: {str(e)}")
+            last_error = e
+    raise Exception(f"All models failed. Last error: {str(last_error)}")
+
+def _call_hedged(prompt: str, models: List[str], api_key: Optional[str], base_url: str) -> str:
+    registry = get_registry()
+    executor = get_hedge_executor()
+    waiting = list(models)
+    racing: Dict[Future, str] = {}
+    aborts: Dict[str, AbortHandle] = {}
+    last_error = None
+
+    def start_next() -> str:
+        model = waiting.pop(0)
+        logger.info("Trying model: %s", model)
+        abort = aborts[model] = AbortHandle()
+        # Each attempt runs in a copy of the caller's context, keeping its request id, LLM journal and deadline
+        attempt = lambda: _streamed_attempt(prompt, model, api_key, base_url, abort)
+        racing[executor.submit(contextvars.copy_context().run, _timed, model, attempt)] = model
+        return model
+
+    latest = start_next()
+    try:
+        while racing:
+            delay = None
+            if waiting:
+                delay = registry.hedge_delay(latest, LLM_HEDGE_DEFAULT_DELAY, LLM_HEDGE_MIN_DELAY, LLM_HEDGE_MAX_DELAY)
+            done, _ = wait(list(racing), timeout=delay, return_when=FIRST_COMPLETED)
+            if not done:
+                logger.info("No answer from %s after %.1fs, hedging with %s", latest, delay, waiting[0])
+                latest = start_next()
+                continue
+            for future in done:
+                model = racing.pop(future)
+                try:
+                    content = future.result()
+                except Exception as e:
+                    logger.warning(f"Failed with model {model}: {str(e)}")
+                    last_error = e
+                    continue
+                if racing:
+                    logger.info("Model %s won the race against %s", model, ', '.join(racing.values()))
+                return content
+            # Only a failure falls through to here; go straight to the next model if nothing else is racing
+            if not racing and waiting:
+                latest = start_next()
+    finally:
+        for model in racing.values():
+            aborts[model].abort()
+    raise Exception(f"All models failed. Last error: {str(last_error)}")
+
 def call_with_fallback_models(
     prompt: str,
     models: List[str] = [
@@ -70,44 +192,25 @@ def call_with_fallback_models(
         "gpt-4o"
     ],
     api_key: str = None,
-    base_url: str = "https://openrouter.ai/api/v1"
+    base_url: str = "https://openrouter.ai/api/v1",
+    hedge: Optional[bool] = None
 ) -> str:
-    """Try multiple models in sequence if earlier ones fail."""
-    last_error = None
-    
-    for model in models:
-        try:
-            logger.info(f"Trying model: {model}")
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "https://jesustech-hackathon.com",
-                "X-Title": "JesusTech Hackathon"
-            }
-            
-            data = {
-                "model": model,
-                "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": 1500
-            }
-            
-            response = requests.post(
-                f"{base_url}/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=(10, 60)  # Connection timeout, read timeout
-            )
-            
-            response.raise_for_status()
-            response_data = response.json()
-            
-            if "choices" in response_data and response_data["choices"]:
-                return response_data["choices"][0]["message"]["content"]
-            
-        except Exception as e:
-            logger.warning(f"Failed with model {model}: {str(e)}")
-            last_error = e
-            continue  # Try next model
-    
-    # If we get here, all models failed
-    raise Exception(f"All models failed. Last error: {str(last_error)}")
+    """
+    Try multiple models until one answers, fastest and most reliable first
+    according to their rolling latency and error stats. Models whose circuit
+    breaker is open (too many consecutive failures) are skipped until their
+    cooldown ends.
+
+    With hedging (LLM_HEDGE, on by default) a model that has not answered
+    within its own p95 latency is raced against the next one; the first
+    answer wins and the other attempts are cancelled. Without it models are
+    tried strictly one after another.
+
+    A library helper: the sermon pipeline makes its stage calls through
+    app.call_openrouter, which adds caching, structured output and reply
+    validation, and does not fall back to other models.
+    """
+    ordered = get_registry().order(models)
+    if hedge if hedge is not None else LLM_HEDGE:
+        return _call_hedged(prompt, ordered, api_key, base_url)
+    return _call_sequentially(prompt, ordered, api_key, base_url)
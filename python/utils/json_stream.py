@@ -0,0 +1,239 @@
+import json
+import logging
+from typing import Any, AsyncIterable, AsyncIterator, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = " \t\r\n"
+
+class JSONStreamParser:
+    """
+    Incremental parser for LLM output that contains one JSON value, possibly
+    wrapped in a preamble or a ```json code fence. Feed it text chunks as they
+    stream in; feed() returns every value that completed in that chunk:
+    each element of a root array as soon as it closes, or the root object
+    once it closes. Braces and brackets inside string literals are ignored.
+
+    A bracket in the preamble ("Here are [3] questions:") would otherwise be
+    taken for the root, so the root is abandoned and searched for again when
+    a backtick (a code fence) appears outside a string inside it, and, with
+    objects_only, when the root array's first element is not an object.
+    """
+    def __init__(self, objects_only: bool = False):
+        self.objects_only = objects_only
+        self.root_type: Optional[str] = None  # '[' or '{' once the root value has started
+        self.done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._element: List[str] = []  # Text of the value currently being collected
+        self._collecting = False
+
+    def feed(self, chunk: str) -> List[Any]:
+        completed: List[Any] = []
+        for char in chunk:
+            if self.done:
+                break
+            if self.root_type is None:
+                self._open_root(char)
+                continue
+            self._consume(char, completed)
+        return completed
+
+    def _open_root(self, char: str) -> None:
+        # Skip preamble and code fences until the root value opens
+        if char in "[{":
+            self.root_type = char
+            self._depth = 1
+            if char == "{":
+                self._collecting = True
+                self._element = [char]
+
+    def _restart(self, char: str) -> None:
+        """The value taken for the root was part of the preamble; look for the root again from char."""
+        self.root_type = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._element = []
+        self._collecting = False
+        self._open_root(char)
+
+    def _consume(self, char: str, completed: List[Any]) -> None:
+        if self._in_string:
+            if self._collecting:
+                self._element.append(char)
+            if self._escape:
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+            return
+
+        if char == "`":
+            # Never valid JSON outside a string: the root so far was prose before a code fence
+            self._restart(char)
+            return
+
+        depth_before = self._depth
+        if char in "[{":
+            self._depth += 1
+        elif char in "]}":
+            self._depth -= 1
+
+        if self.root_type == "{":
+            self._element.append(char)
+            if char == '"':
+                self._in_string = True
+            if self._depth == 0:
+                self._emit(completed)
+                self.done = True
+            return
+
+        # Root array: collect the elements at depth 1
+        if depth_before == 1 and not self._collecting:
+            if char in _WHITESPACE or char == ",":
+                return
+            if char == "]":
+                self.done = True
+                return
+            if self.objects_only and char != "{":
+                self._restart(char)
+                return
+            self._collecting = True
+            self._element = [char]
+            if char == '"':
+                self._in_string = True
+            return
+
+        if depth_before == 1 and self._collecting:
+            # Only a scalar element can still be open at depth 1
+            if char == "," or char in _WHITESPACE or char == "]":
+                self._emit(completed)
+                if char == "]":
+                    self.done = True
+                return
+
+        if self._collecting:
+            self._element.append(char)
+            if char == '"':
+                self._in_string = True
+            if self._depth == 1 and char in "]}":
+                self._emit(completed)
+
+    def _emit(self, completed: List[Any]) -> None:
+        text = "".join(self._element)
+        self._element = []
+        self._collecting = False
+        try:
+            completed.append(json.loads(text))
+        except json.JSONDecodeError as e:
+            logger.warning(f"Skipping malformed streamed JSON value: {str(e)}")
+
+def _feed(parser: JSONStreamParser, chunk: str, require_array: bool) -> List[Any]:
+    values = parser.feed(chunk)
+    if require_array and parser.root_type == "{":
+        raise ValueError("Streamed JSON is not an array")
+    return values
+
+def _check_complete(parser: JSONStreamParser, require_array: bool) -> None:
+    """Raise ValueError for a stream that ran out before its root value closed (cut off, or over max_tokens)."""
+    if parser.root_type is None:
+        if require_array:
+            raise ValueError("No JSON array found in streamed response")
+    elif not parser.done:
+        raise ValueError(f"Stream ended before the JSON {'array' if parser.root_type == '[' else 'object'} closed")
+
+def iter_json_values(chunks: Iterable[str], require_array: bool = False) -> Iterator[Any]:
+    """
+    Yield JSON values from a stream of text chunks as they complete. Stops
+    pulling from the upstream iterator once the root value is closed, and
+    closes it so a streaming HTTP response is released without waiting for
+    trailing tokens. A stream that ends inside the root value raises
+    ValueError once the values before the cut have been yielded, so returning
+    normally means the whole value was read. With require_array the root must
+    be an array of objects: a root object raises ValueError, and brackets in
+    a preamble are skipped.
+    """
+    parser = JSONStreamParser(objects_only=require_array)
+    iterator = iter(chunks)
+    try:
+        for chunk in iterator:
+            yield from _feed(parser, chunk, require_array)
+            if parser.done:
+                break
+        _check_complete(parser, require_array)
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+
+async def aiter_json_values(chunks: AsyncIterable[str], require_array: bool = False) -> AsyncIterator[Any]:
+    """iter_json_values for an async stream of chunks; the upstream generator is closed with aclose()."""
+    parser = JSONStreamParser(objects_only=require_array)
+    iterator = chunks.__aiter__()
+    try:
+        async for chunk in iterator:
+            for value in _feed(parser, chunk, require_array):
+                yield value
+            if parser.done:
+                break
+        _check_complete(parser, require_array)
+    finally:
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+def _fence_body_start(text: str) -> int:
+    """Index just past the line that opens the first ``` code fence in text, or 0 without one."""
+    fence = text.find("```")
+    if fence < 0:
+        return 0
+    line_end = text.find("\n", fence)
+    return len(text) if line_end < 0 else line_end + 1
+
+def find_json_span(text: str) -> Optional[str]:
+    """
+    Return the first complete JSON object or array in text, matching braces
+    and brackets outside of string literals. When the text has a ``` code
+    fence the search starts inside it, so brackets in a preamble are skipped.
+    Returns None if none is closed.
+    """
+    fence_body = _fence_body_start(text)
+    if fence_body:
+        span = _json_span_from(text, fence_body)
+        if span is not None:
+            return span
+    return _json_span_from(text, 0)
+
+def _json_span_from(text: str, offset: int) -> Optional[str]:
+    start = -1
+    for index in range(offset, len(text)):
+        if text[index] in "[{":
+            start = index
+            break
+    if start < 0:
+        return None
+
+    depth = 0
+    in_string = False
+    escape = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "[{":
+            depth += 1
+        elif char in "]}":
+            depth -= 1
+            if depth == 0:
+                return text[start:index + 1]
+    return None
@@ -0,0 +1,322 @@
+import os
+import json
+import asyncio
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Awaitable, Callable
+
+# Checks a fetched completion before it is cached; raises if the stage couldn't use it
+Validator = Callable[[str], Any]
+
+from utils import llm_journal
+
+logger = logging.getLogger(__name__)
+
+# Default time-to-live per pipeline stage, in seconds. Override with LLM_CACHE_TTL_<STAGE>.
+DEFAULT_STAGE_TTLS = {
+    "youtube": 24 * 3600,  # Video summaries are generated from metadata that can change
+    "condense": 7 * 24 * 3600,
+    "planner": 7 * 24 * 3600,
+    "writer": 7 * 24 * 3600,
+    "designer": 7 * 24 * 3600,
+    "agent": 7 * 24 * 3600,
+    "repair": 7 * 24 * 3600,
+    "default": 24 * 3600
+}
+
+def cache_key(payload: Dict[str, Any]) -> str:
+    """SHA-256 over the canonical JSON of model, messages and generation params."""
+    canonical = json.dumps(
+        {k: v for k, v in payload.items() if k != "stream"},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def stage_ttl(stage: Optional[str]) -> int:
+    stage = stage or "default"
+    env_value = os.environ.get(f"LLM_CACHE_TTL_{stage.upper()}")
+    if env_value is not None:
+        return int(env_value)
+    return DEFAULT_STAGE_TTLS.get(stage, DEFAULT_STAGE_TTLS["default"])
+
+class MemoryLRUCache:
+    """Thread-safe in-process LRU with per-entry expiry."""
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl: int) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class SQLiteCache:
+    """
+    On-disk cache shared by every worker process on the host. Entries past
+    their TTL are ignored on read; once the stored values exceed max_bytes the
+    least recently used rows are evicted.
+    """
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_last_access ON llm_cache (last_access)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return row[0]
+
+    def set(self, key: str, value: str, ttl: int) -> None:
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now + ttl, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def _evict(self, now: float) -> None:
+        self._conn.execute("DELETE FROM llm_cache WHERE expires_at < ?", (now,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used rows until we are back under the limit
+        excess = total - self.max_bytes
+        doomed: List[str] = []
+        for key, size in self._conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access"):
+            doomed.append(key)
+            excess -= size
+            if excess <= 0:
+                break
+        self._conn.executemany("DELETE FROM llm_cache WHERE key = ?", [(key,) for key in doomed])
+        logger.debug("Evicted %s LLM cache entries", len(doomed))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+class LLMCache:
+    """Tiered cache: memory LRU in front of the optional SQLite store, with hit/miss counters."""
+    def __init__(self, memory: Optional[MemoryLRUCache] = None, disk: Optional[SQLiteCache] = None):
+        self.memory = memory
+        self.disk = disk
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stage_stats: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, stage: str, outcome: str) -> None:
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            stats = self.stage_stats.setdefault(stage, {"hits": 0, "misses": 0})
+            stats[outcome] += 1
+
+    def get(self, key: str, stage: Optional[str] = None) -> Optional[str]:
+        stage = stage or "default"
+        value = self.memory.get(key) if self.memory is not None else None
+        if value is None and self.disk is not None:
+            try:
+                value = self.disk.get(key)
+            except sqlite3.Error as e:
+                logger.warning(f"LLM cache read failed: {str(e)}")
+            if value is not None and self.memory is not None:
+                # Promote disk hits so the next lookup stays in memory
+                self.memory.set(key, value, stage_ttl(stage))
+        self._count(stage, "hits" if value is not None else "misses")
+        return value
+
+    def set(self, key: str, value: str, stage: Optional[str] = None) -> None:
+        ttl = stage_ttl(stage)
+        if ttl <= 0:
+            return
+        if self.memory is not None:
+            self.memory.set(key, value, ttl)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value, ttl)
+            except sqlite3.Error as e:
+                logger.warning(f"LLM cache write failed: {str(e)}")
+
+    def delete(self, key: str) -> None:
+        """Drop an entry from every tier, e.g. one a stage could not parse."""
+        if self.memory is not None:
+            self.memory.delete(key)
+        if self.disk is not None:
+            try:
+                self.disk.delete(key)
+            except sqlite3.Error as e:
+                logger.warning(f"LLM cache delete failed: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self.memory) if self.memory is not None else 0,
+                "disk_entries": len(self.disk) if self.disk is not None else 0,
+                "stages": {stage: dict(counts) for stage, counts in self.stage_stats.items()}
+            }
+
+_cache: Optional[LLMCache] = None
+_cache_pid: Optional[int] = None
+_cache_lock = threading.Lock()
+
+def get_cache() -> Optional[LLMCache]:
+    """
+    Return the process-wide cache configured from the environment, or None when
+    LLM_CACHE is "off". LLM_CACHE lists the backends to use: "memory", "sqlite"
+    or "memory,sqlite" (default).
+    """
+    global _cache, _cache_pid
+    pid = os.getpid()
+    if _cache_pid == pid:
+        return _cache
+    with _cache_lock:
+        if _cache_pid != pid:
+            backends = [b.strip() for b in os.environ.get("LLM_CACHE", "memory,sqlite").lower().split(",")]
+            memory = disk = None
+            if "memory" in backends:
+                memory = MemoryLRUCache(int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "1024")))
+            if "sqlite" in backends:
+                try:
+                    disk = SQLiteCache(
+                        os.environ.get("LLM_CACHE_PATH", "llm_cache.db"),
+                        int(os.environ.get("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+                    )
+                except sqlite3.Error as e:
+                    logger.warning(f"SQLite LLM cache unavailable, using memory only: {str(e)}")
+            _cache = LLMCache(memory, disk) if (memory is not None or disk is not None) else None
+            _cache_pid = pid
+        return _cache
+
+def usable(content: str, validate: Optional[Validator]) -> bool:
+    """Whether content passes validate (always, without one), i.e. may be cached or replayed."""
+    if validate is None:
+        return True
+    try:
+        validate(content)
+        return True
+    except Exception:
+        return False
+
+def cached_completion(payload: Dict[str, Any], fetch: Callable[[], str],
+                      stage: Optional[str] = None, use_cache: bool = True,
+                      validate: Optional[Validator] = None) -> str:
+    """
+    Return the cached completion for payload, or call fetch() and cache its
+    result. use_cache=False bypasses both the lookup and the store.
+    validate(content) should raise if the stage can't parse the completion:
+    such a completion is returned but not cached, so a retry asks again, and
+    a cached entry that fails it is evicted and fetched afresh.
+    Every call is timed and journaled (see utils.llm_journal).
+    """
+    with llm_journal.track(payload.get("model", ""), stage, use_cache) as call:
+        cache = get_cache() if use_cache else None
+        if cache is not None:
+            key = cache_key(payload)
+            cached = cache.get(key, stage)
+            if cached is not None and usable(cached, validate):
+                logger.debug("LLM cache hit for stage %s", stage or 'default')
+                call["cache_status"] = "hit"
+                return cached
+            if cached is not None:
+                logger.info("Evicting unparseable LLM cache entry for stage %s", stage or 'default')
+                cache.delete(key)
+        else:
+            call["cache_status"] = "bypass"
+        with llm_journal.fetching(call):
+            content = fetch()
+        llm_journal.estimate_usage(call, payload, content)
+        if cache is not None and usable(content, validate):
+            cache.set(key, content, stage)
+        return content
+
+async def cached_completion_async(payload: Dict[str, Any], fetch: Callable[[], Awaitable[str]],
+                                  stage: Optional[str] = None, use_cache: bool = True,
+                                  validate: Optional[Validator] = None) -> str:
+    """
+    cached_completion for coroutines: fetch is awaited on a miss. Lookups and
+    stores run on the default executor because the SQLite tier blocks.
+    """
+    with llm_journal.track(payload.get("model", ""), stage, use_cache) as call:
+        cache = get_cache() if use_cache else None
+        if cache is not None:
+            key = cache_key(payload)
+            cached = await asyncio.to_thread(cache.get, key, stage)
+            if cached is not None and usable(cached, validate):
+                logger.debug("LLM cache hit for stage %s", stage or 'default')
+                call["cache_status"] = "hit"
+                return cached
+            if cached is not None:
+                logger.info("Evicting unparseable LLM cache entry for stage %s", stage or 'default')
+                await asyncio.to_thread(cache.delete, key)
+        else:
+            call["cache_status"] = "bypass"
+        with llm_journal.fetching(call):
+            content = await fetch()
+        llm_journal.estimate_usage(call, payload, content)
+        if cache is not None and usable(content, validate):
+            await asyncio.to_thread(cache.set, key, content, stage)
+        return content
@@ -0,0 +1,549 @@
+import os
+import json
+import socket
+import asyncio
+import weakref
+import threading
+import contextlib
+import contextvars
+import importlib.util
+import logging
+from typing import Dict, Any, Optional, AsyncGenerator, Callable, Generator, Iterator, List, Tuple, Union
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from utils import llm_journal, rate_governor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "https://openrouter.ai/api/v1"
+DEFAULT_MODEL = "google/gemini-2.0-flash-001"
+
+Timeout = Union[float, Tuple[float, float]]
+UsageCallback = Callable[[Dict[str, Any]], None]
+
+# Status given to a request aborted through its AbortHandle (nginx's "client closed request"); never retried
+ABORTED_STATUS = 499
+
+class LLMClientError(Exception):
+    """
+    Raised for transport errors, non-2xx responses and unparseable bodies.
+    timed_out is set when OpenRouter did not answer in time, either within
+    the request's read timeout or before the governed call's deadline.
+    """
+    def __init__(self, message: str, status_code: Optional[int] = None,
+                 response_text: Optional[str] = None, headers: Optional[Dict[str, str]] = None,
+                 timed_out: bool = False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response_text = response_text
+        self.headers = headers or {}
+        self.timed_out = timed_out
+
+class AbortHandle:
+    """
+    Lets another thread abort the requests made inside abortable(handle).
+    The pooled connections they hold are shut down, so a read still waiting
+    on OpenRouter fails at once instead of at its read timeout, and the
+    failure is raised as ABORTED_STATUS so the governor frees the slot
+    without retrying. Only the requests transport is covered: over HTTP/2
+    the connection is shared with other streams and is left open.
+    """
+    def __init__(self):
+        self.aborted = False
+        self._connections: List[Any] = []
+        self._lock = threading.Lock()
+
+    def abort(self) -> None:
+        with self._lock:
+            self.aborted = True
+            for connection in self._connections:
+                _shutdown(connection)
+
+    def _add(self, connection) -> None:
+        with self._lock:
+            connection._abort_handle = self
+            self._connections.append(connection)
+            if self.aborted:
+                _shutdown(connection)
+
+    def _discard(self, connection) -> None:
+        with self._lock:
+            connection._abort_handle = None
+            if connection in self._connections:
+                self._connections.remove(connection)
+
+_abort_handle: contextvars.ContextVar[Optional[AbortHandle]] = contextvars.ContextVar("llm_abort_handle", default=None)
+
+@contextlib.contextmanager
+def abortable(handle: AbortHandle) -> Iterator[AbortHandle]:
+    """Make the requests sent by this thread (or task) inside the block abortable through handle."""
+    token = _abort_handle.set(handle)
+    try:
+        yield handle
+    finally:
+        _abort_handle.reset(token)
+
+def _shutdown(connection) -> None:
+    sock = getattr(connection, "sock", None)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+def _check_aborted() -> None:
+    handle = _abort_handle.get()
+    if handle is not None and handle.aborted:
+        raise LLMClientError("Request aborted", status_code=ABORTED_STATUS)
+
+def _transport_error(error: Exception) -> LLMClientError:
+    handle = _abort_handle.get()
+    if handle is not None and handle.aborted:
+        return LLMClientError(f"Request aborted: {str(error)}", status_code=ABORTED_STATUS)
+    return LLMClientError(str(error), timed_out=_is_read_timeout(error))
+
+class _AbortablePool:
+    """Connection pool mixin registering each checked-out connection with the current AbortHandle until it is returned."""
+    def _get_conn(self, timeout=None):
+        connection = super()._get_conn(timeout)
+        handle = _abort_handle.get()
+        if handle is not None:
+            handle._add(connection)
+        return connection
+
+    def _put_conn(self, connection) -> None:
+        handle = getattr(connection, "_abort_handle", None)
+        if handle is not None:
+            handle._discard(connection)
+        super()._put_conn(connection)
+
+class _AbortableHTTPConnectionPool(_AbortablePool, HTTPConnectionPool):
+    pass
+
+class _AbortableHTTPSConnectionPool(_AbortablePool, HTTPSConnectionPool):
+    pass
+
+class _AbortableAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _AbortableHTTPConnectionPool,
+            "https": _AbortableHTTPSConnectionPool
+        }
+
+class OpenRouterClient:
+    """
+    Shared OpenRouter client holding one keep-alive connection pool per process.
+    Uses httpx with HTTP/2 multiplexing when enabled and the h2 package is
+    installed, otherwise a pooled requests.Session.
+    """
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: str = DEFAULT_BASE_URL,
+        pool_size: int = 32,
+        http2: bool = False
+    ):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.http2 = http2 and importlib.util.find_spec("httpx") is not None and importlib.util.find_spec("h2") is not None
+        if http2 and not self.http2:
+            logger.warning("HTTP/2 requested but httpx/h2 is not installed; falling back to HTTP/1.1 keep-alive")
+
+        if self.http2:
+            import httpx
+            self._http = httpx.Client(
+                http2=True,
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+            )
+        else:
+            self._http = requests.Session()
+            adapter = _AbortableAdapter(pool_connections=4, pool_maxsize=pool_size)
+            self._http.mount("https://", adapter)
+            self._http.mount("http://", adapter)
+
+    def headers(self, api_key: Optional[str] = None) -> Dict[str, str]:
+        return request_headers(api_key or self.api_key)
+
+    def _url(self, path: str, base_url: Optional[str] = None) -> str:
+        return f"{(base_url or self.base_url).rstrip('/')}/{path.lstrip('/')}"
+
+    def _timeout(self, timeout: Timeout):
+        if not self.http2:
+            return timeout
+        return _httpx_timeout(timeout)
+
+    def _raise_for_status(self, status_code: int, text: str, headers: Dict[str, str], url: str) -> None:
+        _raise_for_status(status_code, text, headers, url)
+
+    def chat(
+        self,
+        payload: Dict[str, Any],
+        timeout: Timeout = 120,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        POST a chat completion request and return the decoded JSON body. The
+        request waits for a slot from the rate governor and is retried on 429/5xx.
+        """
+        response_data = _governed_call(payload, lambda time_left: self._post_chat(payload, _capped(timeout, time_left), api_key, base_url))
+        llm_journal.note_response(response_data)
+        return response_data
+
+    def _post_chat(self, payload: Dict[str, Any], timeout: Timeout, api_key: Optional[str], base_url: Optional[str]) -> Dict[str, Any]:
+        url = self._url("chat/completions", base_url)
+        _check_aborted()
+        try:
+            response = self._http.post(url, headers=self.headers(api_key), json=_with_usage(payload), timeout=self._timeout(timeout))
+        except Exception as e:
+            raise _transport_error(e)
+
+        self._raise_for_status(response.status_code, response.text, response.headers, url)
+        try:
+            return response.json()
+        except ValueError as e:
+            logger.error(f"JSON parsing error: {str(e)}", extra={"response": response.text})
+            raise LLMClientError(f"Failed to parse API response: {str(e)}", response.status_code, response.text)
+
+    def complete(self, prompt: str, model: str = DEFAULT_MODEL, timeout: Timeout = 120,
+                 api_key: Optional[str] = None, **params) -> str:
+        """Send a single user prompt and return the text of the first choice."""
+        response_data = self.chat(
+            {"model": model, "messages": [{"role": "user", "content": prompt}], **params},
+            timeout=timeout,
+            api_key=api_key
+        )
+        return message_content(response_data)
+
+    def stream(
+        self,
+        payload: Dict[str, Any],
+        timeout: Timeout = 30,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        on_usage: Optional[UsageCallback] = None
+    ) -> Generator[str, None, None]:
+        """
+        POST a streaming chat completion and yield content deltas as they
+        arrive; governed like chat(). on_usage receives the final chunk that
+        carries the usage block, if the stream is read that far.
+        """
+        try:
+            yield from rate_governor.get_governor().stream(
+                _model(payload), lambda time_left: self._open_stream(payload, _capped(timeout, time_left), api_key, base_url, on_usage)
+            )
+        except rate_governor.RateLimitTimeout as e:
+            raise LLMClientError(str(e), status_code=429)
+        except rate_governor.DeadlineExceeded as e:
+            raise LLMClientError(str(e), timed_out=True)
+
+    def _open_stream(self, payload: Dict[str, Any], timeout: Timeout, api_key: Optional[str],
+                     base_url: Optional[str], on_usage: Optional[UsageCallback] = None) -> Generator[str, None, None]:
+        url = self._url("chat/completions", base_url)
+        payload = {**_with_usage(payload), "stream": True}
+        headers = self.headers(api_key)
+        _check_aborted()
+        try:
+            if self.http2:
+                with self._http.stream("POST", url, headers=headers, json=payload, timeout=self._timeout(timeout)) as response:
+                    if response.status_code >= 400:
+                        response.read()
+                    self._raise_for_status(response.status_code, response.text if response.status_code >= 400 else "", response.headers, url)
+                    yield from _iter_sse_content(response.iter_lines(), on_usage)
+            else:
+                response = self._http.post(url, headers=headers, json=payload, stream=True, timeout=timeout)
+                try:
+                    self._raise_for_status(response.status_code, response.text if response.status_code >= 400 else "", response.headers, url)
+                    yield from _iter_sse_content(response.iter_lines(decode_unicode=True), on_usage)
+                finally:
+                    response.close()
+        except LLMClientError:
+            raise
+        except Exception as e:
+            raise _transport_error(e)
+
+    def prewarm(self) -> None:
+        """Resolve DNS and open a pooled TLS connection so the first LLM call skips the handshake."""
+        host = urlparse(self.base_url).hostname
+        try:
+            socket.getaddrinfo(host, 443)
+            self._http.head(self.base_url, timeout=self._timeout((5, 5)))
+            logger.info("Pre-warmed connection to %s", host)
+        except Exception as e:
+            logger.warning(f"Connection pre-warm to {host} failed: {str(e)}")
+
+    def close(self) -> None:
+        self._http.close()
+
+class AsyncOpenRouterClient:
+    """
+    asyncio counterpart of OpenRouterClient over an httpx.AsyncClient. A
+    request waiting on OpenRouter holds a coroutine instead of a thread, so
+    one event loop can keep hundreds of calls in flight. An instance belongs
+    to the event loop it was created on; use get_async_client().
+    """
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: str = DEFAULT_BASE_URL,
+        pool_size: int = 256,
+        http2: bool = False
+    ):
+        import httpx
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        if http2 and not self.http2:
+            logger.warning("HTTP/2 requested but h2 is not installed; falling back to HTTP/1.1 keep-alive")
+        self._http = httpx.AsyncClient(
+            http2=self.http2,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+
+    def _url(self, path: str, base_url: Optional[str] = None) -> str:
+        return f"{(base_url or self.base_url).rstrip('/')}/{path.lstrip('/')}"
+
+    async def chat(
+        self,
+        payload: Dict[str, Any],
+        timeout: Timeout = 120,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """POST a chat completion request and return the decoded JSON body; governed like OpenRouterClient.chat()."""
+        try:
+            response_data = await rate_governor.get_governor().call_async(
+                _model(payload), lambda time_left: self._post_chat(payload, _capped(timeout, time_left), api_key, base_url)
+            )
+        except rate_governor.RateLimitTimeout as e:
+            raise LLMClientError(str(e), status_code=429)
+        except rate_governor.DeadlineExceeded as e:
+            raise LLMClientError(str(e), timed_out=True)
+        llm_journal.note_response(response_data)
+        return response_data
+
+    async def _post_chat(self, payload: Dict[str, Any], timeout: Timeout, api_key: Optional[str],
+                         base_url: Optional[str]) -> Dict[str, Any]:
+        url = self._url("chat/completions", base_url)
+        try:
+            response = await self._http.post(
+                url, headers=request_headers(api_key or self.api_key), json=_with_usage(payload), timeout=_httpx_timeout(timeout)
+            )
+        except Exception as e:
+            raise LLMClientError(str(e), timed_out=_is_read_timeout(e))
+
+        _raise_for_status(response.status_code, response.text, response.headers, url)
+        try:
+            return response.json()
+        except ValueError as e:
+            logger.error(f"JSON parsing error: {str(e)}", extra={"response": response.text})
+            raise LLMClientError(f"Failed to parse API response: {str(e)}", response.status_code, response.text)
+
+    async def stream(
+        self,
+        payload: Dict[str, Any],
+        timeout: Timeout = 30,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        on_usage: Optional[UsageCallback] = None
+    ) -> AsyncGenerator[str, None]:
+        """POST a streaming chat completion and yield content deltas as they arrive; governed like stream()."""
+        chunks = rate_governor.get_governor().stream_async(
+            _model(payload), lambda time_left: self._open_stream(payload, _capped(timeout, time_left), api_key, base_url, on_usage)
+        )
+        try:
+            async for chunk in chunks:
+                yield chunk
+        except rate_governor.RateLimitTimeout as e:
+            raise LLMClientError(str(e), status_code=429)
+        except rate_governor.DeadlineExceeded as e:
+            raise LLMClientError(str(e), timed_out=True)
+        finally:
+            await chunks.aclose()
+
+    async def _open_stream(self, payload: Dict[str, Any], timeout: Timeout, api_key: Optional[str],
+                           base_url: Optional[str], on_usage: Optional[UsageCallback] = None) -> AsyncGenerator[str, None]:
+        url = self._url("chat/completions", base_url)
+        payload = {**_with_usage(payload), "stream": True}
+        try:
+            async with self._http.stream(
+                "POST", url, headers=request_headers(api_key or self.api_key), json=payload, timeout=_httpx_timeout(timeout)
+            ) as response:
+                if response.status_code >= 400:
+                    await response.aread()
+                _raise_for_status(response.status_code, response.text if response.status_code >= 400 else "", response.headers, url)
+                async for line in response.aiter_lines():
+                    content = _sse_content(line, on_usage)
+                    if content:
+                        yield content
+        except LLMClientError:
+            raise
+        except Exception as e:
+            raise LLMClientError(str(e), timed_out=_is_read_timeout(e))
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+def _with_usage(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Ask OpenRouter to report token usage and cost (for streams, in the final chunk)."""
+    if "usage" in payload:
+        return payload
+    return {**payload, "usage": {"include": True}}
+
+def _model(payload: Dict[str, Any]) -> str:
+    return payload.get("model") or DEFAULT_MODEL
+
+def _governed_call(payload: Dict[str, Any], request):
+    try:
+        return rate_governor.get_governor().call(_model(payload), request)
+    except rate_governor.RateLimitTimeout as e:
+        raise LLMClientError(str(e), status_code=429)
+    except rate_governor.DeadlineExceeded as e:
+        raise LLMClientError(str(e), timed_out=True)
+
+def request_headers(api_key: Optional[str]) -> Dict[str, str]:
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": "https://jesustech-hackathon.com",  # Adding a referer can help with API auth
+        "X-Title": "JesusTech Hackathon"  # Adding application info
+    }
+
+def _capped(timeout: Timeout, time_left: float) -> Timeout:
+    """timeout with no part longer than time_left, the seconds left before the governed call's deadline."""
+    time_left = max(time_left, 1.0)
+    if isinstance(timeout, tuple):
+        return (min(timeout[0], time_left), min(timeout[1], time_left))
+    return min(timeout, time_left)
+
+def _is_read_timeout(error: Exception) -> bool:
+    """
+    Whether a transport error means the server took too long to answer:
+    requests' or httpx's ReadTimeout, or urllib3's ReadTimeoutError, which
+    requests wraps in a ConnectionError when it happens mid-stream.
+    """
+    if isinstance(error, requests.exceptions.ReadTimeout) or type(error).__name__ == "ReadTimeout":
+        return True
+    cause = error.args[0] if error.args else None
+    return type(cause).__name__ == "ReadTimeoutError"
+
+def _httpx_timeout(timeout: Timeout):
+    import httpx
+    if isinstance(timeout, tuple):
+        return httpx.Timeout(timeout[1], connect=timeout[0])
+    return httpx.Timeout(timeout)
+
+def _raise_for_status(status_code: int, text: str, headers: Dict[str, str], url: str) -> None:
+    if status_code >= 400:
+        raise LLMClientError(
+            f"{status_code} Error for url: {url}",
+            status_code=status_code,
+            response_text=text,
+            headers=dict(headers)
+        )
+
+def message_content(response_data: Dict[str, Any]) -> str:
+    """Return the first choice's message content, validating the response shape."""
+    if "choices" not in response_data or not response_data["choices"] or "message" not in response_data["choices"][0]:
+        raise LLMClientError(f"Unexpected API response format: {response_data}")
+    return response_data["choices"][0]["message"]["content"]
+
+def _sse_content(line: Union[str, bytes], on_usage: Optional[UsageCallback] = None) -> Optional[str]:
+    """Content delta carried by one server-sent event line, if any; a usage block is passed to on_usage."""
+    if not line:
+        return None
+    if isinstance(line, bytes):
+        line = line.decode('utf-8')
+    # Skip the "data: " prefix and the terminating [DONE] marker
+    if not line.startswith("data: ") or line == "data: [DONE]":
+        return None
+    try:
+        chunk = json.loads(line[6:])
+    except json.JSONDecodeError:
+        logger.warning("Failed to parse streaming response chunk", extra={"chunk": line})
+        return None
+    if on_usage is not None and chunk.get("usage"):
+        on_usage(chunk)
+    if "choices" in chunk and chunk["choices"]:
+        return chunk["choices"][0].get("delta", {}).get("content") or None
+    return None
+
+def _iter_sse_content(lines, on_usage: Optional[UsageCallback] = None) -> Generator[str, None, None]:
+    for line in lines:
+        content = _sse_content(line, on_usage)
+        if content:
+            yield content
+
+_client: Optional[OpenRouterClient] = None
+_client_pid: Optional[int] = None
+_client_lock = threading.Lock()
+_client_config: Dict[str, Any] = {}
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenRouterClient]" = weakref.WeakKeyDictionary()
+
+def configure(**config) -> None:
+    """Set the options used to build the shared clients, sync and async (api_key, base_url, pool_size, http2)."""
+    global _client
+    with _client_lock:
+        _client_config.update(config)
+        if _client is not None:
+            _client.close()
+            _client = None
+        # Async clients are rebuilt lazily on their own loops
+        _async_clients.clear()
+
+def get_client() -> OpenRouterClient:
+    """
+    Return the process-wide client, creating it on first use. A new client is
+    built after a fork so worker processes never share the parent's sockets.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            config = {
+                "api_key": os.environ.get("OPENROUTER_API_KEY"),
+                "pool_size": int(os.environ.get("LLM_POOL_SIZE", "32")),
+                "http2": os.environ.get("LLM_HTTP2", "").lower() in ("1", "true", "yes"),
+                **_client_config
+            }
+            _client = OpenRouterClient(**config)
+            _client_pid = pid
+        return _client
+
+def prewarm_in_background() -> None:
+    threading.Thread(target=lambda: get_client().prewarm(), name="llm-prewarm", daemon=True).start()
+
+def get_async_client() -> AsyncOpenRouterClient:
+    """
+    Return the async client of the running event loop, creating it on first
+    use. httpx connections are bound to the loop that opened them, so each
+    loop (one per ASGI worker process) gets its own pool of LLM_ASYNC_POOL_SIZE.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        config = {
+            "api_key": os.environ.get("OPENROUTER_API_KEY"),
+            "pool_size": int(os.environ.get("LLM_ASYNC_POOL_SIZE", "256")),
+            "http2": os.environ.get("LLM_HTTP2", "").lower() in ("1", "true", "yes"),
+            **_client_config
+        }
+        client = AsyncOpenRouterClient(**config)
+        _async_clients[loop] = client
+    return client
+
+async def close_async_client() -> None:
+    """Close the running loop's async client, if one was created."""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
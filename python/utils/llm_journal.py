@@ -0,0 +1,124 @@
+"""
+Journal of LLM calls: model, stage, token usage, cost, latency and cache
+status of every completion. A pipeline run collects its calls in a Journal
+(bound to the current context, so designer threads and async tasks started
+from the run add to it) and saves them with its sermon and game.
+"""
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from utils import log_helpers, metrics
+from utils.text_helpers import estimate_tokens
+
+class Journal:
+    """Calls recorded during one pipeline run; rows for the llm_calls table."""
+    def __init__(self):
+        self.calls: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(self, call: Dict[str, Any]) -> None:
+        with self._lock:
+            self.calls.append(call)
+
+    def pending(self) -> List[Dict[str, Any]]:
+        """Calls not saved yet."""
+        with self._lock:
+            return list(self.calls)
+
+    def mark_saved(self, calls: List[Dict[str, Any]]) -> None:
+        """Drop calls (a result of pending()) once they have been written."""
+        with self._lock:
+            del self.calls[:len(calls)]
+
+_journal: "contextvars.ContextVar[Optional[Journal]]" = contextvars.ContextVar("llm_journal", default=None)
+
+# The call whose chat completion is being fetched; the client reports its usage here
+_fetching: "contextvars.ContextVar[Optional[Dict[str, Any]]]" = contextvars.ContextVar("llm_journal_fetching", default=None)
+
+def current() -> Optional[Journal]:
+    return _journal.get()
+
+@contextmanager
+def collecting() -> Iterator[Journal]:
+    """Record every LLM call made in this context (and contexts copied from it) in a new Journal."""
+    journal = Journal()
+    token = _journal.set(journal)
+    try:
+        yield journal
+    finally:
+        _journal.reset(token)
+
+@contextmanager
+def track(model: str, stage: Optional[str], use_cache: bool = True) -> Iterator[Dict[str, Any]]:
+    """
+    Time one LLM completion, observe it in the llm_call_duration_seconds metric
+    and add it to the current journal. The caller sets call["cache_status"] to
+    "hit" when the completion came from the LLM cache; token usage is filled in
+    by apply_usage() or estimate_usage().
+    """
+    call: Dict[str, Any] = {
+        "stage": stage or "default",
+        "model": model,
+        "cache_status": "miss" if use_cache else "bypass",
+        "outcome": "ok",
+        "prompt_tokens": None,
+        "completion_tokens": None,
+        "cached_tokens": None,
+        "cost": None,
+        "usage_estimated": False
+    }
+    started = time.perf_counter()
+    try:
+        yield call
+    except BaseException as e:
+        call["outcome"] = metrics.llm_outcome(e) if isinstance(e, Exception) else "cancelled"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        outcome = "cached" if call["cache_status"] == "hit" and call["outcome"] == "ok" else call["outcome"]
+        metrics.LLM_CALL_SECONDS.observe(elapsed, model=model, stage=call["stage"], outcome=outcome)
+        journal = _journal.get()
+        if journal is not None:
+            call["request_id"] = log_helpers.current_request_id()
+            call["latency_ms"] = int(elapsed * 1000)
+            call["created_at"] = datetime.utcnow()
+            journal.add(call)
+
+@contextmanager
+def fetching(call: Dict[str, Any]) -> Iterator[None]:
+    """Let the chat completion made inside the block report its usage to call (see note_response)."""
+    token = _fetching.set(call)
+    try:
+        yield
+    finally:
+        _fetching.reset(token)
+
+def apply_usage(call: Dict[str, Any], data: Dict[str, Any]) -> None:
+    """Copy the usage block of a completion response (or final stream chunk) into call."""
+    usage = data.get("usage")
+    if not usage:
+        return
+    call["prompt_tokens"] = usage.get("prompt_tokens")
+    call["completion_tokens"] = usage.get("completion_tokens")
+    call["cached_tokens"] = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    call["cost"] = usage.get("cost")
+    call["usage_estimated"] = False
+
+def note_response(data: Dict[str, Any]) -> None:
+    """Called by the client with every chat completion response."""
+    call = _fetching.get()
+    if call is not None:
+        apply_usage(call, data)
+
+def estimate_usage(call: Dict[str, Any], payload: Dict[str, Any], completion: str) -> None:
+    """Fill in estimated token counts when the response carried no usage (e.g. a stream closed early)."""
+    if call["prompt_tokens"] is not None:
+        return
+    prompt = "".join(str(message.get("content", "")) for message in payload.get("messages", []))
+    call["prompt_tokens"] = estimate_tokens(prompt)
+    call["completion_tokens"] = estimate_tokens(completion)
+    call["usage_estimated"] = True
@@ -0,0 +1,177 @@
+"""
+Structured logging for the request path. Every record is written as one JSON
+object (or a plain text line with LOG_FORMAT=text) carrying the id of the
+request it belongs to. Fields passed with extra={...} are kept as structured
+fields, each truncated to LOG_FIELD_MAX_CHARS when the record is emitted, so
+a log call costs nothing beyond a dict when its level is disabled. Large
+payloads (LLM responses) go through log_payload(), which logs them for a
+sample of requests only.
+"""
+import os
+import sys
+import json
+import uuid
+import zlib
+import random
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, Optional
+
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()  # 'json' or 'text'
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+# Longest string kept per logged field; longer values are cut and their length noted
+LOG_FIELD_MAX_CHARS = int(os.environ.get("LOG_FIELD_MAX_CHARS", "1000"))
+
+# Share of requests whose LLM responses are logged at DEBUG (0 disables them, 1 logs all)
+LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get("LOG_PAYLOAD_SAMPLE_RATE", "0.1"))
+
+# Longest list or dict kept per field, and how deep nested values are followed
+MAX_ITEMS = 50
+MAX_DEPTH = 4
+
+# Clients may pass their own request id in this header; it is echoed on the response
+REQUEST_ID_HEADER = "X-Request-ID"
+REQUEST_ID_MAX_CHARS = 64
+
+_request_id: "contextvars.ContextVar[Optional[str]]" = contextvars.ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has; anything else on a record came from extra={...}
+_RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id", "taskName"}
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+def clean_request_id(value: Optional[str]) -> str:
+    """A client-supplied request id if it is short and printable, else a new one."""
+    if value and len(value) <= REQUEST_ID_MAX_CHARS and all(c.isalnum() or c in "-_.:" for c in value):
+        return value
+    return new_request_id()
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+def bind_request_id(request_id: Optional[str] = None) -> contextvars.Token:
+    """Tag everything logged in this context (and contexts copied from it) with request_id; see reset_request_id."""
+    return _request_id.set(request_id or new_request_id())
+
+def reset_request_id(token: contextvars.Token) -> None:
+    _request_id.reset(token)
+
+@contextmanager
+def request_context(request_id: Optional[str] = None) -> Iterator[str]:
+    token = bind_request_id(request_id)
+    try:
+        yield _request_id.get()
+    finally:
+        _request_id.reset(token)
+
+def clip(value: Any, limit: Optional[int] = None, depth: int = 0) -> Any:
+    """
+    JSON-safe copy of value with every string cut to limit characters (default
+    LOG_FIELD_MAX_CHARS) and long lists and dicts shortened. Bytes are reduced
+    to their size.
+    """
+    limit = LOG_FIELD_MAX_CHARS if limit is None else limit
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        return value if len(value) <= limit else f"{value[:limit]}...[{len(value) - limit} more chars]"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    if depth >= MAX_DEPTH:
+        return f"<{type(value).__name__}>"
+    if isinstance(value, dict):
+        clipped = {str(key): clip(item, limit, depth + 1) for key, item in list(value.items())[:MAX_ITEMS]}
+        if len(value) > MAX_ITEMS:
+            clipped["..."] = f"{len(value) - MAX_ITEMS} more keys"
+        return clipped
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = list(value)
+        clipped = [clip(item, limit, depth + 1) for item in items[:MAX_ITEMS]]
+        if len(items) > MAX_ITEMS:
+            clipped.append(f"...{len(items) - MAX_ITEMS} more items")
+        return clipped
+    return clip(str(value), limit)
+
+def record_fields(record: logging.LogRecord) -> Dict[str, Any]:
+    """The extra={...} fields of a record, clipped."""
+    return {key: clip(value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+class RequestIdFilter(logging.Filter):
+    """Stamp each record with the request id bound to the context that logged it."""
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, request_id, message, then the extra fields."""
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", None),
+            "message": clip(record.getMessage())
+        }
+        entry.update(record_fields(record))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Readable single-line records for local development, extra fields appended as key=value."""
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s")
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        record.message = clip(record.message)
+        line = super().formatMessage(record)
+        fields = record_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={json.dumps(value, ensure_ascii=False, default=str)}" for key, value in fields.items())
+        return line
+
+_configured = False
+_configure_lock = threading.Lock()
+
+def configure_logging() -> None:
+    """
+    Send every logger through one stderr handler using LOG_FORMAT and
+    LOG_LEVEL. Called before Flask creates app.logger, so Flask doesn't add
+    its own handler. Idempotent.
+    """
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        handler = logging.StreamHandler(sys.stderr)
+        handler.addFilter(RequestIdFilter())
+        handler.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+        root = logging.getLogger()
+        root.addHandler(handler)
+        root.setLevel(LOG_LEVEL)
+        _configured = True
+
+def payload_sampled() -> bool:
+    """
+    Whether verbose payloads are logged for the current request. The choice is
+    derived from the request id, so a sampled request logs the payloads of all
+    its stages, in every thread and task.
+    """
+    if LOG_PAYLOAD_SAMPLE_RATE >= 1:
+        return True
+    if LOG_PAYLOAD_SAMPLE_RATE <= 0:
+        return False
+    request_id = _request_id.get()
+    if request_id is None:
+        return random.random() < LOG_PAYLOAD_SAMPLE_RATE
+    return zlib.crc32(request_id.encode("utf-8")) / 0x100000000 < LOG_PAYLOAD_SAMPLE_RATE
+
+def log_payload(logger: logging.Logger, message: str, level: int = logging.DEBUG, **fields) -> None:
+    """Log a large payload (an LLM response, say) as clipped fields, for sampled requests only."""
+    if logger.isEnabledFor(level) and payload_sampled():
+        logger.log(level, message, extra=fields)
@@ -0,0 +1,318 @@
+"""
+Prometheus metrics without a client library. Counters and histograms live in
+process memory (a lock and a list update per observation). Under gunicorn,
+METRICS_DIR points every worker of one master at a shared directory: each
+worker writes a snapshot of its series there every METRICS_FLUSH_SECONDS, and
+render() sums all snapshots, so /metrics reports the whole server whichever
+worker answers the scrape. The snapshot of a worker that has exited is folded
+into the scraping worker's own totals, keeping counters monotonic across
+worker restarts.
+"""
+import os
+import json
+import time
+import bisect
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Shared snapshot directory (set by gunicorn_config.py); unset means this process only
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", "5"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+DB_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+LabelValues = Tuple[str, ...]
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[LabelValues, Any] = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self) -> List[List[Any]]:
+        with self._lock:
+            return [[list(key), _copy(value)] for key, value in self._series.items()]
+
+    def reset(self) -> None:
+        self._series = {}
+        self._lock = threading.Lock()
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0.0) + amount
+        _changed()
+
+class Histogram(Metric):
+    """Series values are [count per bucket..., count above the last bucket, sum]."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+        _changed()
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+def _copy(value: Any) -> Any:
+    return list(value) if isinstance(value, list) else value
+
+def _add(total: Any, value: Any) -> Any:
+    if total is None:
+        return _copy(value)
+    if isinstance(total, list):
+        return [a + b for a, b in zip(total, value)]
+    return total + value
+
+_metrics: List[Metric] = []
+
+# Series of exited workers that this process has taken over: metric name -> label values -> value
+_inherited: Dict[str, Dict[LabelValues, Any]] = {}
+_inherited_lock = threading.Lock()
+# Serializes snapshot writes from the flush thread and scrapes, which share a temp file
+_write_lock = threading.Lock()
+_dirty = threading.Event()
+_flusher: Optional[threading.Thread] = None
+_flusher_lock = threading.Lock()
+
+def _changed() -> None:
+    if METRICS_DIR and not _dirty.is_set():
+        _dirty.set()
+        if _flusher is None:
+            _start_flusher()
+
+def _start_flusher() -> None:
+    global _flusher
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True)
+            _flusher.start()
+
+def _flush_loop() -> None:
+    while True:
+        _dirty.wait()
+        time.sleep(METRICS_FLUSH_SECONDS)
+        _dirty.clear()
+        try:
+            _write_snapshot()
+        except OSError as e:
+            logger.warning(f"Could not write metrics snapshot: {str(e)}")
+
+def _after_fork() -> None:
+    """A forked worker starts from zero; the parent's series are reported by the parent."""
+    global _flusher, _flusher_lock, _inherited_lock, _write_lock
+    for metric in _metrics:
+        metric.reset()
+    _inherited.clear()
+    _dirty.clear()
+    _flusher = None
+    _flusher_lock = threading.Lock()
+    _inherited_lock = threading.Lock()
+    _write_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+def _local_series() -> Dict[str, Dict[LabelValues, Any]]:
+    series: Dict[str, Dict[LabelValues, Any]] = {}
+    for metric in _metrics:
+        own = series.setdefault(metric.name, {})
+        for labels, value in metric.snapshot():
+            own[tuple(labels)] = value
+    with _inherited_lock:
+        for name, inherited in _inherited.items():
+            own = series.setdefault(name, {})
+            for labels, value in inherited.items():
+                own[labels] = _add(own.get(labels), value)
+    return series
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(METRICS_DIR, f"{pid}.json")
+
+def _write_snapshot() -> None:
+    data = {name: [[list(labels), value] for labels, value in series.items()]
+            for name, series in _local_series().items()}
+    path = _snapshot_path(os.getpid())
+    temp_path = f"{path}.tmp"
+    with _write_lock:
+        with open(temp_path, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(temp_path, path)
+
+def _read_snapshot(path: str) -> Dict[str, Dict[LabelValues, Any]]:
+    with open(path) as f:
+        data = json.load(f)
+    return {name: {tuple(labels): value for labels, value in series} for name, series in data.items()}
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _adopt_exited_workers() -> None:
+    """Fold the snapshots of exited workers into this process; the rename makes each one ours alone."""
+    adopted = []
+    for filename in os.listdir(METRICS_DIR):
+        pid_text, ext = os.path.splitext(filename)
+        if ext != ".json" or not pid_text.isdigit() or _is_alive(int(pid_text)):
+            continue
+        claimed = os.path.join(METRICS_DIR, f"{filename}.adopted-by-{os.getpid()}")
+        try:
+            os.rename(os.path.join(METRICS_DIR, filename), claimed)
+        except FileNotFoundError:
+            continue  # Another worker adopted it first
+        try:
+            snapshot = _read_snapshot(claimed)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping unreadable metrics snapshot {filename}: {str(e)}")
+            snapshot = {}
+        with _inherited_lock:
+            for name, series in snapshot.items():
+                inherited = _inherited.setdefault(name, {})
+                for labels, value in series.items():
+                    inherited[labels] = _add(inherited.get(labels), value)
+        adopted.append(claimed)
+    if adopted:
+        _write_snapshot()
+        for claimed in adopted:
+            os.remove(claimed)
+
+def collect() -> Dict[str, Dict[LabelValues, Any]]:
+    """Series of every worker sharing METRICS_DIR, or of this process alone."""
+    if not METRICS_DIR:
+        return _local_series()
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _adopt_exited_workers()
+    _write_snapshot()
+    totals: Dict[str, Dict[LabelValues, Any]] = {}
+    for filename in os.listdir(METRICS_DIR):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            snapshot = _read_snapshot(os.path.join(METRICS_DIR, filename))
+        except (OSError, ValueError):
+            continue  # Replaced or removed while we listed the directory
+        for name, series in snapshot.items():
+            merged = totals.setdefault(name, {})
+            for labels, value in series.items():
+                merged[labels] = _add(merged.get(labels), value)
+    return totals
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render() -> str:
+    """Prometheus text exposition format (version 0.0.4)."""
+    series = collect()
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for labels, value in sorted(series.get(metric.name, {}).items()):
+            if metric.kind == "counter":
+                lines.append(f"{metric.name}{_labels(metric.labelnames, labels)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets, value):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{metric.name}_bucket{_labels(metric.labelnames, labels, le)} {cumulative}")
+            cumulative += value[len(metric.buckets)]
+            le = 'le="+Inf"'
+            lines.append(f"{metric.name}_bucket{_labels(metric.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{metric.name}_sum{_labels(metric.labelnames, labels)} {_number(value[-1])}")
+            lines.append(f"{metric.name}_count{_labels(metric.labelnames, labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+def llm_outcome(error: Optional[BaseException]) -> str:
+    """Outcome label of an LLM call from the exception it raised (None for success)."""
+    if error is None:
+        return "ok"
+    # Pipeline code re-raises client errors as user-facing exceptions; the original is the context
+    status_code = getattr(error, "status_code", None) or getattr(error.__context__, "status_code", None)
+    if status_code == 429:
+        return "rate_limited"
+    if status_code is not None:
+        return "server_error" if status_code >= 500 else "client_error"
+    return "error"
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time to produce the response (streams: until the headers)",
+    ("method", "endpoint", "status")
+)
+HTTP_REQUEST_BYTES = Histogram(
+    "http_request_size_bytes", "Size of request bodies", ("method", "endpoint"), buckets=SIZE_BUCKETS
+)
+PIPELINE_STAGE_SECONDS = Histogram(
+    "sermon_pipeline_stage_duration_seconds", "Wall-clock time of each sermon pipeline stage",
+    ("stage", "content_type")
+)
+LLM_CALL_SECONDS = Histogram(
+    "llm_call_duration_seconds", "LLM completions by model, pipeline stage and outcome (cached = served from the LLM cache)",
+    ("model", "stage", "outcome")
+)
+LLM_QUEUE_WAIT_SECONDS = Histogram(
+    "llm_queue_wait_seconds", "Time LLM requests waited for the rate governor",
+    ("model",), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+LLM_RETRIES = Counter("llm_retries_total", "LLM requests retried after a throttling response or transport error", ("model",))
+DB_COMMIT_SECONDS = Histogram("db_commit_duration_seconds", "Time of database session commits, including the flush", buckets=DB_BUCKETS)
+
+def observe_stages(timings: Dict[str, float], content_type: str) -> None:
+    for stage, elapsed in timings.items():
+        PIPELINE_STAGE_SECONDS.observe(elapsed, stage=stage, content_type=content_type)
+
+def reset_directory(path: str) -> None:
+    """Empty a snapshot directory before the workers of a new server start writing to it."""
+    os.makedirs(path, exist_ok=True)
+    for filename in os.listdir(path):
+        os.remove(os.path.join(path, filename))
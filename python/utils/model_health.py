@@ -0,0 +1,131 @@
+import os
+import time
+import threading
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Rolling window of calls kept per model, and how many are needed before its stats are trusted
+HEALTH_WINDOW = int(os.environ.get("LLM_HEALTH_WINDOW", "100"))
+HEALTH_MIN_SAMPLES = int(os.environ.get("LLM_HEALTH_MIN_SAMPLES", "5"))
+
+# Consecutive failures that open a model's circuit, and how long it stays open
+BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN_SECONDS = float(os.environ.get("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+
+# Weight of the error rate when ranking models: a model failing half its calls ranks as 1 + 0.5 * 4 = 3x slower
+ERROR_PENALTY = 4.0
+
+class ModelHealth:
+    """Rolling latency/error window and circuit breaker for one model."""
+    def __init__(self, window: int = HEALTH_WINDOW):
+        self.calls: Deque[Tuple[float, bool]] = deque(maxlen=window)  # (latency seconds, succeeded)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.opened = 0
+
+    def record(self, latency: float, succeeded: bool, now: float) -> None:
+        self.calls.append((latency, succeeded))
+        if succeeded:
+            self.consecutive_failures = 0
+            self.open_until = 0.0
+            return
+        self.consecutive_failures += 1
+        # A failed trial call after the cooldown (half-open) reopens the circuit straight away
+        if self.consecutive_failures >= BREAKER_FAILURES or self.open_until:
+            self.open_until = now + BREAKER_COOLDOWN_SECONDS
+            self.opened += 1
+
+    def is_open(self, now: float) -> bool:
+        return now < self.open_until
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        latencies = sorted(latency for latency, succeeded in self.calls if succeeded)
+        if len(latencies) < HEALTH_MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(percentile / 100 * len(latencies)))]
+
+    def error_rate(self) -> float:
+        if not self.calls:
+            return 0.0
+        return sum(1 for _, succeeded in self.calls if not succeeded) / len(self.calls)
+
+    def expected_cost(self) -> float:
+        """Median latency inflated by the error rate; infinite until enough calls have succeeded."""
+        median = self.latency_percentile(50)
+        if median is None:
+            return float("inf")
+        return median * (1 + ERROR_PENALTY * self.error_rate())
+
+class ModelHealthRegistry:
+    """Process-wide health of every model called through the fallback helpers."""
+    def __init__(self):
+        self._models: Dict[str, ModelHealth] = {}
+        self._lock = threading.Lock()
+
+    def _health(self, model: str) -> ModelHealth:
+        health = self._models.get(model)
+        if health is None:
+            health = self._models[model] = ModelHealth()
+        return health
+
+    def record(self, model: str, latency: float, succeeded: bool) -> None:
+        with self._lock:
+            health = self._health(model)
+            was_open = health.open_until
+            health.record(latency, succeeded, time.monotonic())
+            if health.open_until and health.open_until != was_open:
+                logger.warning(f"Circuit opened for {model} after {health.consecutive_failures} consecutive failures")
+
+    def order(self, models: List[str]) -> List[str]:
+        """
+        Models ranked by expected cost, with models lacking enough samples kept
+        in their configured order behind measured ones. Models with an open
+        circuit are left out, unless every circuit is open.
+        """
+        now = time.monotonic()
+        with self._lock:
+            ranked = sorted(models, key=lambda model: self._health(model).expected_cost())
+            available = [model for model in ranked if not self._health(model).is_open(now)]
+        if available:
+            return available
+        logger.warning("Every model's circuit is open; trying them all")
+        return ranked
+
+    def hedge_delay(self, model: str, default: float, minimum: float, maximum: float) -> float:
+        """Seconds to wait on model before racing the next one: its p95 latency, clamped."""
+        with self._lock:
+            p95 = self._health(model).latency_percentile(95)
+        return default if p95 is None else min(maximum, max(minimum, p95))
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                model: {
+                    "calls": len(health.calls),
+                    "error_rate": round(health.error_rate(), 4),
+                    "p50_seconds": health.latency_percentile(50),
+                    "p95_seconds": health.latency_percentile(95),
+                    "circuit_open": health.is_open(now),
+                    "circuit_opened": health.opened
+                }
+                for model, health in self._models.items()
+            }
+
+_registry: Optional[ModelHealthRegistry] = None
+_registry_pid: Optional[int] = None
+_registry_lock = threading.Lock()
+
+def get_registry() -> ModelHealthRegistry:
+    global _registry, _registry_pid
+    pid = os.getpid()
+    if _registry_pid == pid:
+        return _registry
+    with _registry_lock:
+        if _registry_pid != pid:
+            _registry = ModelHealthRegistry()
+            _registry_pid = pid
+        return _registry
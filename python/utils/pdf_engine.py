@@ -0,0 +1,143 @@
+import io
+import os
+import mmap
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Union
+
+import PyPDF2
+
+logger = logging.getLogger(__name__)
+
+# Documents with at least this many pages are split across worker processes
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "24"))
+PDF_MAX_PROCESSES = int(os.environ.get("PDF_MAX_PROCESSES", str(min(4, os.cpu_count() or 1))))
+
+PdfSource = Union[bytes, str]  # Raw PDF bytes or a path to a PDF file
+
+class PdfPage(NamedTuple):
+    number: int  # 1-based page number
+    text: str
+    error: Optional[str] = None
+
+def _open(source: PdfSource):
+    """
+    Return a seekable stream over the PDF. Paths are memory-mapped, so pages
+    are paged in from the file on demand instead of being read into memory.
+    """
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise ValueError("PDF file is empty")
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return io.BytesIO(source)
+
+def _pypdf2_pages(reader: "PyPDF2.PdfReader", page_numbers: Iterable[int]) -> Iterator[PdfPage]:
+    for page_index in page_numbers:
+        try:
+            page_text = reader.pages[page_index].extract_text() or ""
+            logger.debug("Extracted %s characters from page %s", len(page_text), page_index + 1)
+            yield PdfPage(page_index + 1, page_text)
+        except Exception as e:
+            logger.error(f"Error extracting text from page {page_index + 1}: {str(e)}")
+            yield PdfPage(page_index + 1, "", str(e))
+
+def _pdfminer_pages(source: PdfSource, page_numbers: Optional[List[int]] = None) -> Iterator[PdfPage]:
+    """Page-by-page pdfminer extraction, used when PyPDF2 can't read the document."""
+    try:
+        from pdfminer.high_level import extract_pages
+        from pdfminer.layout import LTTextContainer
+    except ImportError:
+        logger.error("pdfminer not available for fallback PDF processing")
+        raise
+
+    with _open(source) as pdf_file:
+        numbers = iter(page_numbers) if page_numbers is not None else None
+        for position, layout in enumerate(extract_pages(pdf_file, page_numbers=page_numbers)):
+            page_index = next(numbers) if numbers is not None else position
+            text = "".join(element.get_text() for element in layout if isinstance(element, LTTextContainer))
+            yield PdfPage(page_index + 1, text)
+
+def _extract_shard(source: PdfSource, start: int, stop: int) -> List[PdfPage]:
+    """Process-pool worker: extract pages [start, stop), falling back to pdfminer for this shard."""
+    try:
+        with _open(source) as pdf_file:
+            reader = PyPDF2.PdfReader(pdf_file)
+            return list(_pypdf2_pages(reader, range(start, stop)))
+    except PyPDF2.errors.PdfReadError as e:
+        logger.warning(f"PyPDF2 failed on pages {start + 1}-{stop}, trying pdfminer: {str(e)}")
+        return list(_pdfminer_pages(source, list(range(start, stop))))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Shared extraction pool, created on first use in each process. forkserver
+    (spawn on platforms without it) avoids forking a multi-threaded server.
+    """
+    global _pool, _pool_pid
+    pid = os.getpid()
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _pool = ProcessPoolExecutor(max_workers=PDF_MAX_PROCESSES, mp_context=context)
+            _pool_pid = pid
+        return _pool
+
+def iter_pdf_pages(source: PdfSource) -> Iterator[PdfPage]:
+    """
+    Yield the pages of a PDF in order. Large documents are sharded into page
+    ranges extracted in parallel worker processes; each shard falls back to
+    pdfminer on its own if PyPDF2 can't read it. If PyPDF2 can't open the
+    document at all, the whole document goes through pdfminer.
+    """
+    pdf_file = _open(source)
+    try:
+        reader = PyPDF2.PdfReader(pdf_file)
+        page_count = len(reader.pages)
+    except PyPDF2.errors.PdfReadError as e:
+        pdf_file.close()
+        logger.warning(f"PyPDF2 failed, trying pdfminer: {str(e)}")
+        yield from _pdfminer_pages(source)
+        return
+
+    logger.debug("PDF loaded successfully with %s pages", page_count)
+    if page_count < PDF_PARALLEL_MIN_PAGES or PDF_MAX_PROCESSES <= 1:
+        try:
+            yield from _pypdf2_pages(reader, range(page_count))
+        finally:
+            pdf_file.close()
+        return
+    pdf_file.close()
+
+    # Shards of in-memory PDFs are pickled to the workers, so one shard per worker
+    # bounds the number of copies; file paths are cheap to share and get finer shards
+    shard_count = PDF_MAX_PROCESSES if isinstance(source, bytes) else PDF_MAX_PROCESSES * 2
+    shard_size = -(-page_count // shard_count)
+    pool = get_process_pool()
+    futures = [
+        pool.submit(_extract_shard, source, start, min(start + shard_size, page_count))
+        for start in range(0, page_count, shard_size)
+    ]
+    try:
+        for future in futures:
+            yield from future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+def extract_pdf_text(source: PdfSource) -> str:
+    """Extract the full text of a PDF, joining the page texts once at the end."""
+    pieces = []
+    for page in iter_pdf_pages(source):
+        if page.error is not None:
+            pieces.append(f"\n[Error extracting text from page {page.number}]\n")
+        elif page.text:
+            pieces.append(page.text)
+            pieces.append("\n\n")
+    return "".join(pieces)
@@ -0,0 +1,487 @@
+import os
+import time
+import random
+import asyncio
+import threading
+import logging
+import contextvars
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Mapping, Optional, Tuple, TypeVar
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Statuses worth retrying: throttling, timeouts and transient upstream failures
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+# Upper bounds (seconds) of the queue wait histogram
+WAIT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class RateLimitTimeout(Exception):
+    """Raised when a request waited LLM_QUEUE_TIMEOUT seconds without getting a slot."""
+
+class DeadlineExceeded(Exception):
+    """Raised when a governed call runs out of time (LLM_CALL_DEADLINE_SECONDS or its deadline_scope) before it could be attempted."""
+
+# Monotonic time by which the work running in this context (a sermon pipeline) must finish
+_scope_deadline: "contextvars.ContextVar[Optional[float]]" = contextvars.ContextVar("scope_deadline", default=None)
+
+@contextmanager
+def deadline_scope(seconds: float) -> Iterator[float]:
+    """
+    Give every governed call made in this context (and contexts copied from
+    it) at most seconds from now, on top of its own call deadline. A scope
+    nested in another never extends it. Yields the monotonic deadline.
+    """
+    deadline = time.monotonic() + seconds
+    outer = _scope_deadline.get()
+    token = _scope_deadline.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield _scope_deadline.get()
+    finally:
+        _scope_deadline.reset(token)
+
+def time_left() -> Optional[float]:
+    """Seconds before the enclosing deadline_scope ends (negative once it has), or None outside one."""
+    deadline = _scope_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def _check_deadline(model: str, now: float, deadline: float) -> None:
+    if now >= deadline:
+        raise DeadlineExceeded(f"Call to {model} not started: its deadline passed {now - deadline:.1f}s ago")
+
+def retry_after_seconds(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), or None."""
+    if not headers:
+        return None
+    value = next((v for k, v in headers.items() if k.lower() == "retry-after"), None)
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class ModelLimiter:
+    """
+    Token bucket plus an in-flight cap for one model, both adapted AIMD-style:
+    every success raises the rate and the cap a little, a 429 or 5xx halves
+    them (at most once per cooldown, so a burst of failures counts once).
+    A Retry-After pauses the model until it has passed.
+    """
+    def __init__(self, rate: float, burst: float, max_in_flight: int, decrease_cooldown: float = 1.0):
+        self.max_rate = rate
+        self.min_rate = max(rate / 20, 0.1)
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.max_in_flight = max_in_flight
+        self.limit = float(max_in_flight)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.decrease_cooldown = decrease_cooldown
+        self._last_decrease = 0.0
+        self._refilled_at = time.monotonic()
+        self.throttled = 0
+        self.errors = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.wait_count = 0
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS) + 1)
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def try_acquire(self, now: float) -> Optional[float]:
+        """0.0 if a slot was taken, else seconds until one may free up (None: wait for a release)."""
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.in_flight >= max(1, int(self.limit)):
+            return None
+        self._refill(now)
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        self.tokens -= 1
+        self.in_flight += 1
+        return 0.0
+
+    def release(self, now: float, status_code: Optional[int], retry_after: Optional[float]) -> None:
+        self.in_flight -= 1
+        if status_code is not None and status_code < 400:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 50)
+            self.limit = min(float(self.max_in_flight), self.limit + 1 / self.limit)
+            return
+        if status_code == 429 or (status_code is not None and status_code >= 500):
+            if status_code == 429:
+                self.throttled += 1
+            else:
+                self.errors += 1
+            if now - self._last_decrease >= self.decrease_cooldown:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.limit = max(1.0, self.limit / 2)
+                self._last_decrease = now
+        if retry_after:
+            self.paused_until = max(self.paused_until, now + retry_after)
+
+    def record_wait(self, seconds: float) -> None:
+        self.wait_count += 1
+        self.wait_sum += seconds
+        self.wait_max = max(self.wait_max, seconds)
+        for index, bound in enumerate(WAIT_BUCKETS):
+            if seconds <= bound:
+                self.wait_buckets[index] += 1
+                return
+        self.wait_buckets[-1] += 1
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        return {
+            "rate": round(self.rate, 3),
+            "max_rate": self.max_rate,
+            "in_flight": self.in_flight,
+            "in_flight_limit": int(self.limit),
+            "max_in_flight": self.max_in_flight,
+            "paused_for": round(max(0.0, self.paused_until - now), 3),
+            "throttled": self.throttled,
+            "errors": self.errors,
+            "retries": self.retries,
+            "queue_timeouts": self.timeouts,
+            "queue_wait": {
+                "count": self.wait_count,
+                "sum_seconds": round(self.wait_sum, 6),
+                "max_seconds": round(self.wait_max, 6),
+                "buckets": {**{str(bound): count for bound, count in zip(WAIT_BUCKETS, self.wait_buckets)},
+                            "+Inf": self.wait_buckets[-1]}
+            }
+        }
+
+class RateGovernor:
+    """
+    Process-wide admission control for OpenRouter calls, shared by the sync
+    and async clients. A request takes a slot from its model's limiter before
+    it is sent and queues (up to queue_timeout seconds) while none is free;
+    throttled, 5xx and transport-failed requests are retried with full-jitter
+    exponential backoff, never sooner than the server's Retry-After. A
+    request that timed out waiting for its response is retried at most
+    timeout_retries times. Queueing, attempts and backoff of one call all
+    fit in call_deadline seconds: each attempt is handed the time left,
+    to cap its own timeout, and no retry starts that would end past it.
+    """
+    def __init__(
+        self,
+        rate: float = 50.0,
+        burst: Optional[float] = None,
+        max_in_flight: int = 128,
+        queue_timeout: float = 60.0,
+        max_retries: int = 4,
+        retry_base: float = 0.5,
+        retry_max: float = 20.0,
+        model_limits: Optional[Dict[str, Tuple[float, int]]] = None,
+        timeout_retries: int = 0,
+        call_deadline: float = 300.0
+    ):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.model_limits = model_limits or {}
+        self.timeout_retries = timeout_retries
+        self.call_deadline = call_deadline
+        self._limiters: Dict[str, ModelLimiter] = {}
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, "asyncio.Future[None]"]] = []
+
+    def _limiter(self, model: str) -> ModelLimiter:
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            rate, max_in_flight = self.model_limits.get(model, (self.rate, self.max_in_flight))
+            burst = rate if model in self.model_limits else self.burst
+            limiter = ModelLimiter(rate, burst, max_in_flight)
+            self._limiters[model] = limiter
+        return limiter
+
+    def _record_wait(self, limiter: ModelLimiter, model: str, waited: float) -> None:
+        limiter.record_wait(waited)
+        metrics.LLM_QUEUE_WAIT_SECONDS.observe(waited, model=model)
+
+    def _timed_out(self, limiter: ModelLimiter, model: str, waited: float) -> RateLimitTimeout:
+        limiter.timeouts += 1
+        self._record_wait(limiter, model, waited)
+        logger.warning(f"Gave up on {model} after queueing {waited:.1f}s for an OpenRouter slot")
+        return RateLimitTimeout(f"Timed out after {waited:.1f}s waiting for an OpenRouter slot for {model}")
+
+    def _deadline(self) -> float:
+        """Monotonic time by which a call starting now must be done, within any enclosing deadline_scope."""
+        deadline = time.monotonic() + self.call_deadline
+        scope_deadline = _scope_deadline.get()
+        return deadline if scope_deadline is None else min(deadline, scope_deadline)
+
+    def _queue_remaining(self, limiter: ModelLimiter, model: str, started: float, now: float, deadline: float) -> float:
+        """Seconds a queued request may keep waiting; raises once the queue timeout or the call deadline has passed."""
+        remaining = min(started + self.queue_timeout, deadline) - now
+        if remaining > 0:
+            return remaining
+        if deadline < started + self.queue_timeout:
+            self._record_wait(limiter, model, now - started)
+            raise DeadlineExceeded(f"Call to {model} ran out of time after queueing {now - started:.1f}s for an OpenRouter slot")
+        raise self._timed_out(limiter, model, now - started)
+
+    def acquire(self, model: str, deadline: Optional[float] = None) -> float:
+        """Block until a slot for model is free; returns the seconds spent queueing."""
+        started = time.monotonic()
+        deadline = deadline if deadline is not None else float("inf")
+        _check_deadline(model, started, deadline)
+        with self._condition:
+            limiter = self._limiter(model)
+            while True:
+                now = time.monotonic()
+                delay = limiter.try_acquire(now)
+                if delay == 0.0:
+                    break
+                remaining = self._queue_remaining(limiter, model, started, now, deadline)
+                self._condition.wait(min(remaining, delay) if delay is not None else remaining)
+            waited = now - started
+            self._record_wait(limiter, model, waited)
+        return waited
+
+    async def acquire_async(self, model: str, deadline: Optional[float] = None) -> float:
+        """acquire() for coroutines: waits on the event loop instead of blocking a thread."""
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        deadline = deadline if deadline is not None else float("inf")
+        _check_deadline(model, started, deadline)
+        while True:
+            with self._lock:
+                limiter = self._limiter(model)
+                now = time.monotonic()
+                delay = limiter.try_acquire(now)
+                if delay == 0.0:
+                    waited = now - started
+                    self._record_wait(limiter, model, waited)
+                    return waited
+                remaining = self._queue_remaining(limiter, model, started, now, deadline)
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            try:
+                await asyncio.wait_for(waiter, min(remaining, delay) if delay is not None else remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._lock:
+                    if (loop, waiter) in self._async_waiters:
+                        self._async_waiters.remove((loop, waiter))
+
+    def release(self, model: str, status_code: Optional[int] = 200, retry_after: Optional[float] = None) -> None:
+        """Return a slot; status_code (None for transport errors) and retry_after drive the adaptation."""
+        with self._condition:
+            self._limiter(model).release(time.monotonic(), status_code, retry_after)
+            self._condition.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+
+    def _retry_delay(self, model: str, error: Exception, attempt: int, timeouts: int, deadline: float) -> Optional[float]:
+        """
+        Release the failed request's slot and return how long to wait before
+        retrying, or None to give up. timeouts counts the earlier attempts of
+        this call that timed out waiting for a response.
+        """
+        status_code = getattr(error, "status_code", None)
+        retry_after = retry_after_seconds(getattr(error, "headers", None))
+        self.release(model, status_code, retry_after)
+        if attempt >= self.max_retries:
+            return None
+        if status_code is not None and status_code not in RETRYABLE_STATUSES:
+            return None
+        # A request that already waited out its whole read timeout is likely to do so again
+        if getattr(error, "timed_out", False) and timeouts >= self.timeout_retries:
+            return None
+        if retry_after is not None and retry_after > self.retry_max:
+            return None
+        delay = max(retry_after or 0.0, random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt)))
+        if time.monotonic() + delay >= deadline:
+            logger.warning(f"Not retrying {model}: the call's {self.call_deadline:.0f}s deadline would pass")
+            return None
+        with self._lock:
+            self._limiter(model).retries += 1
+        metrics.LLM_RETRIES.inc(model=model)
+        logger.warning(f"OpenRouter {status_code or 'transport error'} for {model}; retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+        return delay
+
+    def call(self, model: str, request: Callable[[float], T]) -> T:
+        """
+        Run request(time_left) under a slot for model, retrying retryable
+        failures. time_left is the seconds remaining before the call's
+        deadline; the request should not wait on OpenRouter for longer.
+        """
+        deadline = self._deadline()
+        attempt = timeouts = 0
+        while True:
+            self.acquire(model, deadline)
+            try:
+                result = request(deadline - time.monotonic())
+            except Exception as e:
+                delay = self._retry_delay(model, e, attempt, timeouts, deadline)
+                if delay is None:
+                    raise
+                attempt += 1
+                timeouts += getattr(e, "timed_out", False)
+                time.sleep(delay)
+                continue
+            self.release(model)
+            return result
+
+    async def call_async(self, model: str, request: Callable[[float], Awaitable[T]]) -> T:
+        deadline = self._deadline()
+        attempt = timeouts = 0
+        while True:
+            await self.acquire_async(model, deadline)
+            try:
+                result = await request(deadline - time.monotonic())
+            except asyncio.CancelledError:
+                self.release(model, None)
+                raise
+            except Exception as e:
+                delay = self._retry_delay(model, e, attempt, timeouts, deadline)
+                if delay is None:
+                    raise
+                attempt += 1
+                timeouts += getattr(e, "timed_out", False)
+                await asyncio.sleep(delay)
+                continue
+            self.release(model)
+            return result
+
+    def stream(self, model: str, open_stream: Callable[[float], Iterator[str]]) -> Iterator[str]:
+        """
+        Hold a slot for model while the stream is consumed. A stream that
+        fails before its first chunk is retried like call(); once content
+        has been yielded the error is raised.
+        """
+        deadline = self._deadline()
+        attempt = timeouts = 0
+        while True:
+            self.acquire(model, deadline)
+            chunks = open_stream(deadline - time.monotonic())
+            started = released = False
+            delay = None
+            try:
+                for chunk in chunks:
+                    started = True
+                    yield chunk
+            except Exception as e:
+                released = True
+                delay = None if started else self._retry_delay(model, e, attempt, timeouts, deadline)
+                timeouts += getattr(e, "timed_out", False)
+                if started:
+                    self.release(model, getattr(e, "status_code", None))
+                if delay is None:
+                    raise
+            except BaseException:
+                # Closed by the consumer (a success once content arrived) or cancelled
+                released = True
+                self.release(model, 200 if started else None)
+                raise
+            finally:
+                close = getattr(chunks, "close", None)
+                if close is not None:
+                    close()
+                if not released:
+                    self.release(model)
+            if delay is None:
+                return
+            attempt += 1
+            time.sleep(delay)
+
+    async def stream_async(self, model: str, open_stream: Callable[[float], AsyncIterator[str]]) -> AsyncIterator[str]:
+        deadline = self._deadline()
+        attempt = timeouts = 0
+        while True:
+            await self.acquire_async(model, deadline)
+            chunks = open_stream(deadline - time.monotonic())
+            started = released = False
+            delay = None
+            try:
+                async for chunk in chunks:
+                    started = True
+                    yield chunk
+            except Exception as e:
+                released = True
+                delay = None if started else self._retry_delay(model, e, attempt, timeouts, deadline)
+                timeouts += getattr(e, "timed_out", False)
+                if started:
+                    self.release(model, getattr(e, "status_code", None))
+                if delay is None:
+                    raise
+            except BaseException:
+                # Closed by the consumer (a success once content arrived) or cancelled
+                released = True
+                self.release(model, 200 if started else None)
+                raise
+            finally:
+                await chunks.aclose()
+                if not released:
+                    self.release(model)
+            if delay is None:
+                return
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            return {model: limiter.stats(now) for model, limiter in self._limiters.items()}
+
+def _wake(waiter: "asyncio.Future[None]") -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+def parse_model_limits(value: str) -> Dict[str, Tuple[float, int]]:
+    """Parse LLM_MODEL_LIMITS: comma-separated model=requests_per_second/max_in_flight entries."""
+    limits: Dict[str, Tuple[float, int]] = {}
+    for entry in filter(None, (part.strip() for part in value.split(","))):
+        model, _, spec = entry.rpartition("=")
+        rate, _, max_in_flight = spec.partition("/")
+        limits[model] = (float(rate), int(max_in_flight or os.environ.get("LLM_MAX_IN_FLIGHT", "128")))
+    return limits
+
+_governor: Optional[RateGovernor] = None
+_governor_pid: Optional[int] = None
+_governor_lock = threading.Lock()
+
+def get_governor() -> RateGovernor:
+    """Return the process-wide governor configured from the environment."""
+    global _governor, _governor_pid
+    pid = os.getpid()
+    if _governor_pid == pid:
+        return _governor
+    with _governor_lock:
+        if _governor_pid != pid:
+            _governor = RateGovernor(
+                rate=float(os.environ.get("LLM_RATE_LIMIT", "50")),
+                burst=float(os.environ["LLM_RATE_BURST"]) if "LLM_RATE_BURST" in os.environ else None,
+                max_in_flight=int(os.environ.get("LLM_MAX_IN_FLIGHT", "128")),
+                queue_timeout=float(os.environ.get("LLM_QUEUE_TIMEOUT", "60")),
+                max_retries=int(os.environ.get("LLM_MAX_RETRIES", "4")),
+                retry_base=float(os.environ.get("LLM_RETRY_BASE_SECONDS", "0.5")),
+                retry_max=float(os.environ.get("LLM_RETRY_MAX_SECONDS", "20")),
+                model_limits=parse_model_limits(os.environ.get("LLM_MODEL_LIMITS", "")),
+                timeout_retries=int(os.environ.get("LLM_TIMEOUT_RETRIES", "0")),
+                call_deadline=float(os.environ.get("LLM_CALL_DEADLINE_SECONDS", "300"))
+            )
+            _governor_pid = pid
+        return _governor
@@ -0,0 +1,78 @@
+import json
+import logging
+from typing import Any, Callable, Dict
+
+from pydantic import TypeAdapter, ValidationError
+
+from utils.json_stream import find_json_span
+
+logger = logging.getLogger(__name__)
+
+REPAIR_PROMPT_TEMPLATE = """
+    This JSON {name} does not match its schema:
+    {fragment}
+
+    Validation errors:
+    {errors}
+
+    Schema:
+    {schema}
+
+    Fix only what the errors describe and keep every other value unchanged.
+    Return ONLY the corrected JSON with no explanatory text before or after.
+    """
+
+def response_format(name: str, adapter: TypeAdapter) -> Dict[str, Any]:
+    """OpenAI-style json_schema response_format built from a pydantic adapter."""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "schema": adapter.json_schema()}
+    }
+
+def load_json(text: str) -> Any:
+    """Decode model output that should be pure JSON, tolerating a preamble or code fence."""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        span = find_json_span(text)
+        if span is None:
+            raise ValueError("No JSON value found in response")
+        return json.loads(span)
+
+def describe_errors(error: Exception) -> str:
+    """One line per validation error, short enough to send back to the model."""
+    if isinstance(error, ValidationError):
+        return "\n".join(
+            f"- {'.'.join(str(part) for part in item['loc']) or '(root)'}: {item['msg']}"
+            for item in error.errors()
+        )
+    return f"- {str(error)}"
+
+def validate_or_repair(
+    adapter: TypeAdapter,
+    fragment: Any,
+    complete: Callable[[str, Dict[str, Any]], str],
+    name: str
+) -> Any:
+    """
+    Validate fragment (raw model text or an already decoded value) with a
+    precompiled adapter. If it doesn't validate, send just that fragment and
+    its errors back through complete(prompt, response_format) once and
+    validate the answer; a second failure raises ValidationError/ValueError.
+    """
+    try:
+        value = load_json(fragment) if isinstance(fragment, str) else fragment
+        return adapter.validate_python(value)
+    except ValueError as e:  # pydantic's ValidationError is a ValueError
+        error = e
+
+    fragment_text = fragment if isinstance(fragment, str) else json.dumps(fragment, ensure_ascii=False)
+    logger.info("Repairing invalid %s: %s", name, describe_errors(error))
+    prompt = REPAIR_PROMPT_TEMPLATE.format(
+        name=name,
+        fragment=fragment_text,
+        errors=describe_errors(error),
+        schema=json.dumps(adapter.json_schema())
+    )
+    repaired = complete(prompt, response_format(name, adapter))
+    return adapter.validate_python(load_json(repaired))
@@ -0,0 +1,61 @@
+import re
+from typing import List
+
+# Rough characters-per-token ratio for English prose; good enough to decide
+# whether a prompt is getting close to the model's context window.
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate, no tokenizer download required."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def split_into_sections(text: str, max_tokens: int) -> List[str]:
+    """
+    Split text into sections of at most max_tokens (estimated), breaking on
+    paragraph boundaries first, then sentences, then hard character limits.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    sections: List[str] = []
+    current: List[str] = []
+    current_len = 0
+
+    def flush() -> None:
+        nonlocal current, current_len
+        if current:
+            sections.append("\n\n".join(current))
+        current, current_len = [], 0
+
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        pieces = [paragraph]
+        if len(paragraph) > max_chars:
+            pieces = _split_long_paragraph(paragraph, max_chars)
+        for piece in pieces:
+            if current_len + len(piece) > max_chars:
+                flush()
+            current.append(piece)
+            current_len += len(piece) + 2
+    flush()
+    return sections
+
+def _split_long_paragraph(paragraph: str, max_chars: int) -> List[str]:
+    pieces: List[str] = []
+    current = ""
+    for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+        while len(sentence) > max_chars:
+            # A single "sentence" longer than a section (e.g. OCR output without punctuation)
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if current and len(current) + len(sentence) + 1 > max_chars:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
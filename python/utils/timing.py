@@ -0,0 +1,34 @@
+import time
+import logging
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class StageTimer:
+    """
+    Records wall-clock time per pipeline stage. mark(stage) closes the stage
+    that is currently running (if any) and starts timing the next one.
+    """
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self._stage: Optional[str] = None
+        self._started = 0.0
+        self._created = time.perf_counter()
+
+    def mark(self, stage: str) -> None:
+        self.stop()
+        self._stage = stage
+        self._started = time.perf_counter()
+
+    def stop(self) -> None:
+        if self._stage is not None:
+            elapsed = time.perf_counter() - self._started
+            self.timings[self._stage] = self.timings.get(self._stage, 0.0) + elapsed
+            self._stage = None
+
+    def total(self) -> float:
+        return time.perf_counter() - self._created
+
+    def summary(self) -> str:
+        stages = ", ".join(f"{stage}={elapsed:.2f}s" for stage, elapsed in self.timings.items())
+        return f"{stages}, total={self.total():.2f}s"
@@ -0,0 +1,61 @@
+import os
+import uuid
+import logging
+from typing import BinaryIO, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Only this much of an upload is read to detect its type
+SNIFF_BYTES = 8192
+
+class UploadTooLarge(ValueError):
+    pass
+
+def spool_to_disk(stream: BinaryIO, directory: str, max_bytes: int,
+                  suffix: str = "", chunk_size: int = 64 * 1024) -> Tuple[str, int]:
+    """
+    Copy an upload stream to a new file in directory chunk by chunk, so at most
+    chunk_size bytes are held in memory. Returns (path, size); the partial file
+    is removed if the upload exceeds max_bytes.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{uuid.uuid4().hex}{suffix}")
+    size = 0
+    try:
+        with open(path, "wb") as spool:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds the maximum size of {max_bytes // (1024 * 1024)} MB")
+                spool.write(chunk)
+    except BaseException:
+        remove_quietly(path)
+        raise
+    logger.debug("Spooled %s bytes to %s", size, path)
+    return path, size
+
+def sniff_mime_type(path: str, sample_size: int = SNIFF_BYTES) -> Optional[str]:
+    """Detect a file's MIME type from its first few KB only."""
+    with open(path, "rb") as f:
+        head = f.read(sample_size)
+    if not head:
+        return None
+    try:
+        import magic
+        return magic.from_buffer(head, mime=True)
+    except ImportError:
+        # Without libmagic we can still recognise the formats we accept
+        return "application/pdf" if head.startswith(b"%PDF") else "application/octet-stream"
+
+def remove_quietly(path: Optional[str]) -> None:
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Failed to remove upload {path}: {str(e)}")
@@ -139,7 +139,7 @@ def download_youtube_audio(youtube_url, max_retries=3, retry_delay=2, skip_downl
         
         if skip_download:
             # Return video ID instead of downloading
-            logger.info(f"Skipping download and returning YouTube video ID: {video_id}")
+            logger.info("Skipping download and returning YouTube video ID: %s", video_id)
             return video_id
             
         # Original download logic goes here for backward compatibility
@@ -161,7 +161,7 @@ def download_youtube_audio(youtube_url, max_retries=3, retry_delay=2, skip_downl
                 yt = pytube.YouTube(youtube_url)
                 
                 # Get title for logging
-                logger.info(f"Downloading audio from: '{yt.title}' (ID: {video_id})")
+                logger.info("Downloading audio from: '%s' (ID: %s)", yt.title, video_id)
                 
                 # Get audio stream - try multiple options
                 audio_stream = None
@@ -185,7 +185,7 @@ def download_youtube_audio(youtube_url, max_retries=3, retry_delay=2, skip_downl
                     raise Exception("No suitable audio stream found")
                     
                 # Download the stream
-                logger.info(f"Downloading {audio_stream.mime_type} stream, size: {audio_stream.filesize_mb:.2f}MB")
+                logger.info("Downloading %s stream, size: %.2fMB", audio_stream.mime_type, audio_stream.filesize_mb)
                 audio_file = audio_stream.download(output_path=os.path.dirname(temp_file), 
                                                   filename=os.path.basename(temp_file))
                 
@@ -193,7 +193,7 @@ def download_youtube_audio(youtube_url, max_retries=3, retry_delay=2, skip_downl
                 if not os.path.exists(audio_file) or os.path.getsize(audio_file) < 1000:
                     raise Exception(f"Downloaded file is too small ({os.path.getsize(audio_file)} bytes)")
                     
-                logger.info(f"Successfully downloaded audio to {audio_file}")
+                logger.info("Successfully downloaded audio to %s", audio_file)
                 return audio_file
                 
             except Exception as e:
@@ -203,7 +203,7 @@ def download_youtube_audio(youtube_url, max_retries=3, retry_delay=2, skip_downl
                 
                 # Wait before retrying
                 if retry_count < max_retries:
-                    logger.info(f"Waiting {retry_delay} seconds before retry...")
+                    logger.info("Waiting %s seconds before retry...", retry_delay)
                     time.sleep(retry_delay)
                     retry_delay *= 2  # Exponential backoff
         
@@ -5,6 +5,9 @@ import magic  # python-magic library for file type detection
 
 logger = logging.getLogger(__name__)
 
+# Only this much of a file is passed to libmagic to detect its type
+SNIFF_BYTES = 8192
+
 def detect_file_type(content):
     """
     Detect the file type from content which could be bytes, string, or base64 encoded.
@@ -21,8 +24,8 @@ def detect_file_type(content):
                 base64_content = content.split("base64,")[1]
                 # Decode base64
                 decoded_content = base64.b64decode(base64_content)
-                # Double-check mime type
-                detected_mime = magic.from_buffer(decoded_content, mime=True)
+                # Double-check mime type; libmagic only needs the first few KB
+                detected_mime = magic.from_buffer(decoded_content[:SNIFF_BYTES], mime=True)
                 
                 logger.debug(f"Base64 content detected. Declared: {declared_mime}, Detected: {detected_mime}")
                 return (detected_mime, decoded_content)
@@ -35,7 +38,7 @@ def detect_file_type(content):
             return ("text/plain", content.encode('utf-8'))
     elif isinstance(content, bytes):
         # Already in bytes format
-        mime_type = magic.from_buffer(content, mime=True)
+        mime_type = magic.from_buffer(content[:SNIFF_BYTES], mime=True)
         return (mime_type, content)
     else:
         # Unsupported type